@@ -56,10 +56,6 @@ def main():
     # set up log level
     log_setup(args["verbose"] - args["quiet"])
 
-    # enable asyncio debugging
-    # loop = asyncio.get_event_loop()
-    # loop.set_debug(args["debug"])
-
     config_path = args.pop("config_path")
     config = read_config(Path(config_path))
 
@@ -69,7 +65,8 @@ def main():
         cli.error("no subcommand was given")
     subcommand_class.argparse_validate(args, cli.error)
     subcommand_object = subcommand_class(config=config, **args)
-    asyncio.run(subcommand_object.run())
+    # subcommands receive the debug flag as well to enable their own debugging aids
+    asyncio.run(subcommand_object.run(), debug=args["debug"])
 
 
 if __name__ == "__main__":
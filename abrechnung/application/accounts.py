@@ -19,7 +19,11 @@ from abrechnung.core.service import (
 from abrechnung.domain.accounts import Account, AccountType, AccountDetails
 from abrechnung.domain.users import User
 from abrechnung.framework.database import Connection
-from abrechnung.framework.decorators import with_db_transaction, with_db_connection
+from abrechnung.framework.decorators import (
+    with_db_transaction,
+    with_db_connection,
+    with_db_read_connection,
+)
 from .common import _get_or_create_tag_ids
 
 
@@ -193,9 +197,11 @@ class AccountService(Service):
             description=db_json["description"],
             deleted=db_json["deleted"],
             owning_user_id=db_json["owning_user_id"],
-            date_info=date.fromisoformat(db_json["date_info"])
-            if db_json["date_info"] is not None
-            else None,
+            date_info=(
+                date.fromisoformat(db_json["date_info"])
+                if db_json["date_info"] is not None
+                else None
+            ),
             tags=db_json["tags"],
             clearing_shares={
                 cred["share_account_id"]: cred["shares"]
@@ -227,22 +233,39 @@ class AccountService(Service):
             pending_details=pending_details,
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_accounts(
-        self, *, conn: Connection, user: User, group_id: int
+        self,
+        *,
+        conn: Connection,
+        user: User,
+        group_id: int,
+        as_of: Optional[datetime] = None,
     ) -> list[Account]:
+        """
+        if as_of is given the state committed at that point in time is returned, without any pending changes.
+        """
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
-        cur = conn.cursor(
-            "select account_id, group_id, type, last_changed, is_wip, "
-            "   committed_details, pending_details "
-            "from full_account_state_valid_at($1) "
-            "where group_id = $2",
-            user.id,
-            group_id,
-        )
+        if as_of is not None:
+            rows = await conn.fetch(
+                "select account_id, group_id, type, last_changed, is_wip, "
+                "   committed_details, pending_details "
+                "from committed_account_state_of_group_at($1, $2)",
+                group_id,
+                as_of,
+            )
+        else:
+            rows = await conn.fetch(
+                "select account_id, group_id, type, last_changed, is_wip, "
+                "   committed_details, pending_details "
+                "from full_account_state_valid_at($1) "
+                "where group_id = $2",
+                user.id,
+                group_id,
+            )
 
         result = []
-        async for account in cur:
+        for account in rows:
             result.append(self._account_db_row(account))
 
         return result
@@ -613,22 +636,22 @@ class AccountService(Service):
                 f"Cannot delete an account that is references by another clearing account"
             )
 
-        now = datetime.now(tz=timezone.utc)
-        revision_id = await conn.fetchval(
-            "insert into account_revision (user_id, account_id, started, committed) "
-            "values ($1, $2, $3, $4) returning id",
-            user.id,
-            account_id,
-            now,
-            now,
+        # the deletion is committed together with any pending change of the user, the commit checks and the
+        # clearing account graph run when the revision is committed, hence its history has to exist by then
+        revision_id = await self._get_or_create_pending_account_change(
+            conn=conn, user=user, account_id=account_id
         )
         await conn.execute(
-            "insert into account_history (id, revision_id, name, description, owning_user_id, date_info, deleted) "
-            "select $1, $2, name, description, owning_user_id, date_info, true "
-            "from account_history ah where ah.id = $1 and ah.revision_id = $3 ",
+            "update account_history set deleted = true where id = $1 and revision_id = $2",
             account_id,
             revision_id,
-            row["revision_id"],
+        )
+        # a deletion does not conflict with changes committed since the pending change was started
+        now = datetime.now(tz=timezone.utc)
+        await conn.execute(
+            "update account_revision set started = $2, committed = $2 where id = $1",
+            revision_id,
+            now,
         )
 
         await create_group_log(
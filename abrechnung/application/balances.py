@@ -0,0 +1,545 @@
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import asyncpg
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from abrechnung.core.auth import check_group_permissions
+from abrechnung.core.service import Service
+from abrechnung.domain.balances import AccountBalance
+from abrechnung.domain.users import User
+from abrechnung.framework.database import Connection
+from abrechnung.framework.decorators import with_db_read_connection
+from abrechnung.framework.queries import prepared_query
+
+# read the version before the graph, a graph newer than its version is only cached until the next request
+CLEARING_GRAPH_VERSION_QUERY = prepared_query(
+    "clearing_graph_version",
+    "select coalesce((select version from clearing_account_graph where group_id = $1), 0)",
+)
+CLEARING_GRAPH_QUERY = prepared_query(
+    "clearing_graph",
+    "select cae.account_id, cae.share_account_id, cae.shares "
+    "from clearing_account_edge cae join account a on a.id = cae.account_id "
+    "where a.group_id = $1",
+)
+CLEARING_GRAPH_AS_OF_QUERY = prepared_query(
+    "clearing_graph_as_of",
+    "select cas.account_id, cas.share_account_id, cas.shares "
+    "from account_state_validity v "
+    "   join account_history ah on ah.id = v.account_id and ah.revision_id = v.revision_id "
+    "   join clearing_account_share cas on cas.account_id = v.account_id and cas.revision_id = v.revision_id "
+    "where v.group_id = $1 and v.valid_during @> $2::timestamptz and not ah.deleted",
+)
+BALANCE_ACCOUNTS_QUERY = prepared_query(
+    "balance_accounts",
+    "select v.account_id "
+    "from account_state_validity v "
+    "   join account_history ah on ah.id = v.account_id and ah.revision_id = v.revision_id "
+    "where v.group_id = $1 and v.valid_during @> coalesce($2, now()) and not ah.deleted",
+)
+# the shares of all transactions and positions of a group committed at a point in time, default now, in coordinate
+# format as one row of arrays
+BALANCE_DATA_QUERY = prepared_query(
+    "balance_data",
+    """
+with transactions as materialized (
+    select v.transaction_id, v.revision_id, t.type, th.value, th.currency_conversion_rate
+    from transaction_state_validity v
+        join transaction t on t.id = v.transaction_id
+        join transaction_history th on th.id = v.transaction_id and th.revision_id = v.revision_id
+    where v.group_id = $1 and v.valid_during @> coalesce($2, now()) and not th.deleted
+), positions as materialized (
+    select v.item_id, v.revision_id, v.transaction_id, pih.price, pih.communist_shares
+    from purchase_item_state_validity v
+        join purchase_item_history pih on pih.id = v.item_id and pih.revision_id = v.revision_id
+        join transactions t on t.transaction_id = v.transaction_id
+    where v.group_id = $1 and v.valid_during @> coalesce($2, now()) and t.type = 'purchase' and not pih.deleted
+)
+select
+    t.transaction_ids, t.values, t.currency_conversion_rates,
+    cs.transaction_ids as creditor_transaction_ids, cs.account_ids as creditor_account_ids, cs.shares as creditor_shares,
+    ds.transaction_ids as debitor_transaction_ids, ds.account_ids as debitor_account_ids, ds.shares as debitor_shares,
+    p.position_ids, p.transaction_ids as position_transaction_ids, p.prices, p.communist_shares,
+    u.position_ids as usage_position_ids, u.account_ids as usage_account_ids, u.shares as usage_shares
+from
+    (
+        select
+            array_agg(transaction_id order by transaction_id) as transaction_ids,
+            array_agg(value order by transaction_id) as values,
+            array_agg(currency_conversion_rate order by transaction_id) as currency_conversion_rates
+        from transactions
+    ) t,
+    (
+        select array_agg(cs.transaction_id) as transaction_ids, array_agg(cs.account_id) as account_ids,
+            array_agg(cs.shares) as shares
+        from creditor_share cs
+            join transactions t on t.transaction_id = cs.transaction_id and t.revision_id = cs.revision_id
+    ) cs,
+    (
+        select array_agg(ds.transaction_id) as transaction_ids, array_agg(ds.account_id) as account_ids,
+            array_agg(ds.shares) as shares
+        from debitor_share ds
+            join transactions t on t.transaction_id = ds.transaction_id and t.revision_id = ds.revision_id
+    ) ds,
+    (
+        select
+            array_agg(item_id order by item_id) as position_ids,
+            array_agg(transaction_id order by item_id) as transaction_ids,
+            array_agg(price order by item_id) as prices,
+            array_agg(communist_shares order by item_id) as communist_shares
+        from positions
+    ) p,
+    (
+        select array_agg(piu.item_id) as position_ids, array_agg(piu.account_id) as account_ids,
+            array_agg(piu.share_amount) as shares
+        from purchase_item_usage piu
+            join positions p on p.item_id = piu.item_id and p.revision_id = piu.revision_id
+    ) u
+""",
+)
+
+# maps account ids to amounts
+BalanceVector = dict[int, float]
+
+
+@dataclass
+class BalanceEffect:
+    """the effect of a transaction on the balance of the involved accounts"""
+
+    paid: BalanceVector
+    consumed: BalanceVector
+
+
+@dataclass
+class BalancePosition:
+    price: float
+    communist_shares: float
+    usages: dict[int, float]
+
+
+def transaction_balance_effect(
+    value: float,
+    currency_conversion_rate: float,
+    creditor_shares: dict[int, float],
+    debitor_shares: dict[int, float],
+    positions: Optional[list[BalancePosition]] = None,
+) -> BalanceEffect:
+    """
+    the creditors paid the transaction value according to their shares. positions are consumed by the accounts using
+    them, the communist shares of a position and the value not covered by positions are consumed by the debitors.
+    """
+    paid: BalanceVector = defaultdict(float)
+    consumed: BalanceVector = defaultdict(float)
+
+    remaining_value = value
+    for position in positions or []:
+        total_usages = position.communist_shares + sum(position.usages.values())
+        if total_usages <= 0:
+            continue
+        for account_id, usage in position.usages.items():
+            consumed[account_id] += (
+                position.price * usage / total_usages * currency_conversion_rate
+            )
+        remaining_value -= (
+            position.price * (total_usages - position.communist_shares) / total_usages
+        )
+
+    total_debitor_shares = sum(debitor_shares.values())
+    if total_debitor_shares > 0:
+        for account_id, shares in debitor_shares.items():
+            consumed[account_id] += (
+                remaining_value
+                * shares
+                / total_debitor_shares
+                * currency_conversion_rate
+            )
+
+    total_creditor_shares = sum(creditor_shares.values())
+    if total_creditor_shares > 0:
+        for account_id, shares in creditor_shares.items():
+            paid[account_id] += (
+                value * shares / total_creditor_shares * currency_conversion_rate
+            )
+
+    return BalanceEffect(paid=dict(paid), consumed=dict(consumed))
+
+
+@dataclass
+class ShareMatrix:
+    """sparse matrix in coordinate format of the shares accounts have in transactions or positions"""
+
+    row_ids: list[int]
+    account_ids: list[int]
+    shares: list[float]
+
+
+@dataclass
+class GroupBalanceData:
+    """the committed transactions of a group with everything affecting balances, in columns"""
+
+    # sorted by transaction id
+    transaction_ids: list[int]
+    values: list[float]
+    currency_conversion_rates: list[float]
+    # rows are transaction ids
+    creditor_shares: ShareMatrix
+    debitor_shares: ShareMatrix
+    # sorted by position id
+    position_ids: list[int]
+    position_transaction_ids: list[int]
+    position_prices: list[float]
+    position_communist_shares: list[float]
+    # rows are position ids
+    usages: ShareMatrix
+
+
+async def fetch_balance_data(
+    conn: asyncpg.Connection, group_id: int, as_of: Optional[datetime] = None
+) -> GroupBalanceData:
+    row = await BALANCE_DATA_QUERY.fetchrow(conn, group_id, as_of)
+    return GroupBalanceData(
+        transaction_ids=row["transaction_ids"] or [],
+        values=row["values"] or [],
+        currency_conversion_rates=row["currency_conversion_rates"] or [],
+        creditor_shares=ShareMatrix(
+            row_ids=row["creditor_transaction_ids"] or [],
+            account_ids=row["creditor_account_ids"] or [],
+            shares=row["creditor_shares"] or [],
+        ),
+        debitor_shares=ShareMatrix(
+            row_ids=row["debitor_transaction_ids"] or [],
+            account_ids=row["debitor_account_ids"] or [],
+            shares=row["debitor_shares"] or [],
+        ),
+        position_ids=row["position_ids"] or [],
+        position_transaction_ids=row["position_transaction_ids"] or [],
+        position_prices=row["prices"] or [],
+        position_communist_shares=row["communist_shares"] or [],
+        usages=ShareMatrix(
+            row_ids=row["usage_position_ids"] or [],
+            account_ids=row["usage_account_ids"] or [],
+            shares=row["usage_shares"] or [],
+        ),
+    )
+
+
+def compute_balances_python(
+    data: GroupBalanceData,
+) -> tuple[BalanceVector, BalanceVector]:
+    """what each account paid and consumed, by summing up the balance effects of the transactions one by one"""
+    creditor_shares: dict[int, dict[int, float]] = defaultdict(dict)
+    for transaction_id, account_id, shares in zip(
+        data.creditor_shares.row_ids,
+        data.creditor_shares.account_ids,
+        data.creditor_shares.shares,
+    ):
+        creditor_shares[transaction_id][account_id] = shares
+    debitor_shares: dict[int, dict[int, float]] = defaultdict(dict)
+    for transaction_id, account_id, shares in zip(
+        data.debitor_shares.row_ids,
+        data.debitor_shares.account_ids,
+        data.debitor_shares.shares,
+    ):
+        debitor_shares[transaction_id][account_id] = shares
+    usages: dict[int, dict[int, float]] = defaultdict(dict)
+    for position_id, account_id, shares in zip(
+        data.usages.row_ids, data.usages.account_ids, data.usages.shares
+    ):
+        usages[position_id][account_id] = shares
+    positions: dict[int, list[BalancePosition]] = defaultdict(list)
+    for position_id, transaction_id, price, communist_shares in zip(
+        data.position_ids,
+        data.position_transaction_ids,
+        data.position_prices,
+        data.position_communist_shares,
+    ):
+        positions[transaction_id].append(
+            BalancePosition(
+                price=price,
+                communist_shares=communist_shares,
+                usages=usages.get(position_id, {}),
+            )
+        )
+
+    paid: BalanceVector = defaultdict(float)
+    consumed: BalanceVector = defaultdict(float)
+    for transaction_id, value, currency_conversion_rate in zip(
+        data.transaction_ids, data.values, data.currency_conversion_rates
+    ):
+        effect = transaction_balance_effect(
+            value=value,
+            currency_conversion_rate=currency_conversion_rate,
+            creditor_shares=creditor_shares.get(transaction_id, {}),
+            debitor_shares=debitor_shares.get(transaction_id, {}),
+            positions=positions.get(transaction_id),
+        )
+        for account_id, amount in effect.paid.items():
+            paid[account_id] += amount
+        for account_id, amount in effect.consumed.items():
+            consumed[account_id] += amount
+    return dict(paid), dict(consumed)
+
+
+def _weighted_sums(
+    indices: "np.ndarray", weights: "np.ndarray", length: int
+) -> "np.ndarray":
+    # bincount returns integers for empty inputs
+    return np.bincount(indices, weights=weights, minlength=length).astype(
+        np.float64, copy=False
+    )
+
+
+def compute_balances_numpy(
+    data: GroupBalanceData,
+) -> tuple[BalanceVector, BalanceVector]:
+    """
+    same as compute_balances_python with the share matrices as sparse arrays, each step is a vectorized operation.
+    rows and accounts are mapped to dense indices, sums per row or account are weighted bincounts.
+    """
+    transaction_ids = np.asarray(data.transaction_ids, dtype=np.int64)
+    n_transactions = len(transaction_ids)
+    values = np.asarray(data.values, dtype=np.float64)
+    rates = np.asarray(data.currency_conversion_rates, dtype=np.float64)
+
+    account_ids, account_index = np.unique(
+        np.concatenate(
+            [
+                np.asarray(data.creditor_shares.account_ids, dtype=np.int64),
+                np.asarray(data.debitor_shares.account_ids, dtype=np.int64),
+                np.asarray(data.usages.account_ids, dtype=np.int64),
+            ]
+        ),
+        return_inverse=True,
+    )
+    n_accounts = len(account_ids)
+    n_creditor_shares = len(data.creditor_shares.shares)
+    n_debitor_shares = len(data.debitor_shares.shares)
+    creditor_accounts = account_index[:n_creditor_shares]
+    debitor_accounts = account_index[
+        n_creditor_shares : n_creditor_shares + n_debitor_shares
+    ]
+    usage_accounts = account_index[n_creditor_shares + n_debitor_shares :]
+
+    def share_fractions(
+        matrix: ShareMatrix, row_ids: "np.ndarray"
+    ) -> tuple["np.ndarray", "np.ndarray"]:
+        """the dense row index of each entry and its fraction of the total shares of its row"""
+        rows = np.searchsorted(row_ids, np.asarray(matrix.row_ids, dtype=np.int64))
+        shares = np.asarray(matrix.shares, dtype=np.float64)
+        totals = _weighted_sums(rows, shares, length=len(row_ids))
+        row_totals = totals[rows]
+        return rows, np.divide(
+            shares, row_totals, out=np.zeros_like(shares), where=row_totals > 0
+        )
+
+    creditor_rows, creditor_fractions = share_fractions(
+        data.creditor_shares, transaction_ids
+    )
+    paid = _weighted_sums(
+        creditor_accounts,
+        (values * rates)[creditor_rows] * creditor_fractions,
+        length=n_accounts,
+    )
+
+    position_ids = np.asarray(data.position_ids, dtype=np.int64)
+    position_rows = np.searchsorted(
+        transaction_ids,
+        np.asarray(data.position_transaction_ids, dtype=np.int64),
+    )
+    prices = np.asarray(data.position_prices, dtype=np.float64)
+    communist_shares = np.asarray(data.position_communist_shares, dtype=np.float64)
+    usage_positions = np.searchsorted(
+        position_ids, np.asarray(data.usages.row_ids, dtype=np.int64)
+    )
+    usage_shares = np.asarray(data.usages.shares, dtype=np.float64)
+    total_usages = communist_shares + _weighted_sums(
+        usage_positions, usage_shares, length=len(position_ids)
+    )
+    # positions without any usages are not part of the balance, their value remains with the debitors
+    used_fractions = np.divide(
+        total_usages - communist_shares,
+        total_usages,
+        out=np.zeros_like(total_usages),
+        where=total_usages > 0,
+    )
+    remaining_values = values - _weighted_sums(
+        position_rows, prices * used_fractions, length=n_transactions
+    )
+    consumed = _weighted_sums(
+        usage_accounts,
+        (prices * rates[position_rows])[usage_positions]
+        * usage_shares
+        / total_usages[usage_positions],
+        length=n_accounts,
+    )
+
+    debitor_rows, debitor_fractions = share_fractions(
+        data.debitor_shares, transaction_ids
+    )
+    consumed += _weighted_sums(
+        debitor_accounts,
+        (remaining_values * rates)[debitor_rows] * debitor_fractions,
+        length=n_accounts,
+    )
+
+    account_id_list = account_ids.tolist()
+    return (
+        dict(zip(account_id_list, paid.tolist())),
+        dict(zip(account_id_list, consumed.tolist())),
+    )
+
+
+def compute_balances(data: GroupBalanceData) -> tuple[BalanceVector, BalanceVector]:
+    """what each account paid and consumed, vectorized if numpy is installed"""
+    if np is None:
+        return compute_balances_python(data)
+    return compute_balances_numpy(data)
+
+
+class ClearingResolver:
+    """
+    resolves the amounts of clearing accounts to the accounts they distribute to.
+
+    the clearing graph is processed once in topological order into a flattened matrix which maps every clearing account
+    to the accounts without clearing shares it (transitively) distributes to, weighted by its fraction of the amount.
+    resolving a balance vector then is a single sparse matrix vector multiplication.
+    """
+
+    def __init__(self, clearing_shares: dict[int, dict[int, float]]):
+        """clearing_shares maps clearing accounts to their share accounts and shares, it must be acyclic"""
+        self.order = self._topological_order(clearing_shares)
+        self.flattened: dict[int, BalanceVector] = {}
+        # accounts come after all accounts distributing to them, resolve in reverse such that share accounts are known
+        for account_id in reversed(self.order):
+            total_shares = sum(clearing_shares[account_id].values())
+            if total_shares <= 0:
+                continue
+            row: BalanceVector = defaultdict(float)
+            for share_account_id, shares in clearing_shares[account_id].items():
+                weight = shares / total_shares
+                if share_account_id in self.flattened:
+                    for target_id, target_weight in self.flattened[
+                        share_account_id
+                    ].items():
+                        row[target_id] += weight * target_weight
+                else:
+                    row[share_account_id] += weight
+            self.flattened[account_id] = dict(row)
+
+    @staticmethod
+    def _topological_order(clearing_shares: dict[int, dict[int, float]]) -> list[int]:
+        """the clearing accounts ordered such that each comes before the accounts it distributes to"""
+        n_incoming: dict[int, int] = {account_id: 0 for account_id in clearing_shares}
+        for shares in clearing_shares.values():
+            for share_account_id in shares:
+                if share_account_id in n_incoming:
+                    n_incoming[share_account_id] += 1
+
+        ready = [account_id for account_id, count in n_incoming.items() if count == 0]
+        order = []
+        while ready:
+            account_id = ready.pop()
+            order.append(account_id)
+            for share_account_id in clearing_shares[account_id]:
+                if share_account_id not in n_incoming:
+                    continue
+                n_incoming[share_account_id] -= 1
+                if n_incoming[share_account_id] == 0:
+                    ready.append(share_account_id)
+
+        if len(order) != len(clearing_shares):
+            raise RuntimeError("the clearing account graph contains a cycle")
+        return order
+
+    def resolve(self, vector: BalanceVector) -> BalanceVector:
+        result: BalanceVector = defaultdict(float)
+        for account_id, amount in vector.items():
+            row = self.flattened.get(account_id)
+            if row is None:
+                result[account_id] += amount
+                continue
+            for target_id, weight in row.items():
+                result[target_id] += amount * weight
+        return dict(result)
+
+
+class BalanceService(Service):
+    # number of groups whose clearing resolvers are kept per api worker
+    RESOLVER_CACHE_SIZE = 256
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # group id -> graph version and the resolver built from that version of the clearing graph
+        self._resolvers: OrderedDict[int, tuple[int, ClearingResolver]] = OrderedDict()
+
+    @staticmethod
+    def _build_clearing_resolver(rows: list[asyncpg.Record]) -> ClearingResolver:
+        clearing_shares: dict[int, dict[int, float]] = defaultdict(dict)
+        for row in rows:
+            clearing_shares[row["account_id"]][row["share_account_id"]] = row["shares"]
+        return ClearingResolver(dict(clearing_shares))
+
+    async def _get_clearing_resolver(
+        self, conn: asyncpg.Connection, group_id: int
+    ) -> ClearingResolver:
+        version = await CLEARING_GRAPH_VERSION_QUERY.fetchval(conn, group_id)
+        cached = self._resolvers.get(group_id)
+        if cached is not None and cached[0] == version:
+            self._resolvers.move_to_end(group_id)
+            return cached[1]
+
+        resolver = self._build_clearing_resolver(
+            await CLEARING_GRAPH_QUERY.fetch(conn, group_id)
+        )
+
+        self._resolvers[group_id] = (version, resolver)
+        self._resolvers.move_to_end(group_id)
+        if len(self._resolvers) > self.RESOLVER_CACHE_SIZE:
+            self._resolvers.popitem(last=False)
+        return resolver
+
+    # the graph version, the graph and the balance data have to come from the same committed state
+    @with_db_read_connection(snapshot=True)
+    async def get_balances(
+        self,
+        *,
+        conn: Connection,
+        user: User,
+        group_id: int,
+        as_of: Optional[datetime] = None,
+    ) -> list[AccountBalance]:
+        """
+        balances of all accounts of a group according to the committed state, with clearing accounts resolved.
+        if as_of is given the state committed at that point in time is used.
+        """
+        await check_group_permissions(conn=conn, group_id=group_id, user=user)
+        if as_of is None:
+            resolver = await self._get_clearing_resolver(conn, group_id)
+        else:
+            # historic clearing graphs are not cached, they are looked up via the validity ranges of the accounts
+            resolver = self._build_clearing_resolver(
+                await CLEARING_GRAPH_AS_OF_QUERY.fetch(conn, group_id, as_of)
+            )
+
+        data = await fetch_balance_data(conn, group_id, as_of)
+        paid, consumed = compute_balances(data)
+
+        resolved_paid = resolver.resolve(paid)
+        resolved_consumed = resolver.resolve(consumed)
+        return [
+            AccountBalance(
+                account_id=row["account_id"],
+                balance=resolved_paid.get(row["account_id"], 0.0)
+                - resolved_consumed.get(row["account_id"], 0.0),
+                total_paid=resolved_paid.get(row["account_id"], 0.0),
+                total_consumed=resolved_consumed.get(row["account_id"], 0.0),
+            )
+            for row in await BALANCE_ACCOUNTS_QUERY.fetch(conn, group_id, as_of)
+        ]
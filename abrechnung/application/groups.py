@@ -23,7 +23,10 @@ from abrechnung.domain.groups import (
 )
 from abrechnung.domain.users import User
 from abrechnung.framework.database import Connection
-from abrechnung.framework.decorators import with_db_transaction
+from abrechnung.framework.decorators import (
+    with_db_transaction,
+    with_db_read_connection,
+)
 
 
 class GroupService(Service):
@@ -146,7 +149,7 @@ class GroupService(Service):
             AccountType.personal.value,
         )
         revision_id = await conn.fetchval(
-            "insert into account_revision (user_id, account_id, committed) values ($1, $2, now()) returning id",
+            "insert into account_revision (user_id, account_id) values ($1, $2) returning id",
             user.id,
             account_id,
         )
@@ -160,6 +163,10 @@ class GroupService(Service):
             "",
             user.id,
         )
+        await conn.execute(
+            "update account_revision set committed = now() where id = $1",
+            revision_id,
+        )
         return account_id
 
     @with_db_transaction
@@ -205,9 +212,9 @@ class GroupService(Service):
             await conn.execute("delete from group_invite where id = $1", invite["id"])
         return group["id"]
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_groups(self, *, conn: Connection, user: User) -> list[Group]:
-        cur = conn.cursor(
+        rows = await conn.fetch(
             "select grp.id, grp.name, grp.description, grp.terms, grp.currency_symbol, grp.created_at, "
             "grp.created_by, grp.add_user_account_on_join "
             "from grp "
@@ -215,7 +222,7 @@ class GroupService(Service):
             user.id,
         )
         result = []
-        async for group in cur:
+        for group in rows:
             result.append(
                 Group(
                     id=group["id"],
@@ -231,7 +238,7 @@ class GroupService(Service):
 
         return result
 
-    @with_db_transaction
+    @with_db_read_connection
     async def get_group(self, *, conn: Connection, user: User, group_id: int) -> Group:
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
         group = await conn.fetchrow(
@@ -443,12 +450,12 @@ class GroupService(Service):
             invite_single_use=group["invite_single_use"],
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_invites(
         self, *, conn: Connection, user: User, group_id: int
     ) -> list[GroupInvite]:
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
-        cur = conn.cursor(
+        rows = await conn.fetch(
             "select id, case when created_by = $1 then token else null end as token, description, created_by, "
             "valid_until, single_use, join_as_editor "
             "from group_invite gi "
@@ -457,7 +464,7 @@ class GroupService(Service):
             group_id,
         )
         result = []
-        async for invite in cur:
+        for invite in rows:
             result.append(
                 GroupInvite(
                     id=invite["id"],
@@ -471,7 +478,7 @@ class GroupService(Service):
             )
         return result
 
-    @with_db_transaction
+    @with_db_read_connection
     async def get_invite(
         self, *, conn: Connection, user: User, group_id: int, invite_id: int
     ) -> GroupInvite:
@@ -497,12 +504,12 @@ class GroupService(Service):
             join_as_editor=row["join_as_editor"],
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_members(
         self, *, conn: Connection, user: User, group_id: int
     ) -> list[GroupMember]:
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
-        cur = conn.cursor(
+        rows = await conn.fetch(
             "select usr.id, usr.username, gm.is_owner, gm.can_write, gm.description, "
             "gm.invited_by, gm.joined_at "
             "from usr "
@@ -511,7 +518,7 @@ class GroupService(Service):
             group_id,
         )
         result = []
-        async for group in cur:
+        for group in rows:
             result.append(
                 GroupMember(
                     user_id=group["id"],
@@ -525,7 +532,7 @@ class GroupService(Service):
             )
         return result
 
-    @with_db_transaction
+    @with_db_read_connection
     async def get_member(
         self, *, conn: Connection, user: User, group_id: int, member_id: int
     ) -> GroupMember:
@@ -551,12 +558,12 @@ class GroupService(Service):
             description=row["description"],
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_log(
         self, *, conn: Connection, user: User, group_id: int
     ) -> list[GroupLog]:
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
-        cur = conn.cursor(
+        rows = await conn.fetch(
             "select id, user_id, logged_at, type, message, affected "
             "from group_log "
             "where group_id = $1",
@@ -564,7 +571,7 @@ class GroupService(Service):
         )
 
         result = []
-        async for log in cur:
+        for log in rows:
             result.append(
                 GroupLog(
                     id=log["id"],
@@ -26,7 +26,48 @@ from abrechnung.domain.transactions import (
 )
 from abrechnung.domain.users import User
 from abrechnung.framework.database import Connection
-from abrechnung.framework.decorators import with_db_transaction
+from abrechnung.framework.decorators import (
+    with_db_transaction,
+    with_db_read_connection,
+)
+from abrechnung.framework.queries import prepared_query
+
+TRANSACTION_PERMISSIONS_QUERY = prepared_query(
+    "transaction_permissions",
+    "select t.type, t.group_id, can_write, is_owner "
+    "from group_membership gm join transaction t on gm.group_id = t.group_id and gm.user_id = $1 "
+    "where t.id = $2",
+)
+PENDING_REVISION_QUERY = prepared_query(
+    "pending_transaction_revision",
+    "select id "
+    "from transaction_revision "
+    "where transaction_id = $1 and user_id = $2 and committed is null",
+)
+GROUP_TRANSACTIONS_QUERY = prepared_query(
+    "group_transactions",
+    "select transaction_id, group_id, type, last_changed, is_wip, "
+    "   committed_details, pending_details, "
+    "   committed_positions, pending_positions, committed_files, pending_files "
+    "from full_transaction_state_valid_at($1) "
+    "where group_id = $2",
+)
+GROUP_TRANSACTIONS_AS_OF_QUERY = prepared_query(
+    "group_transactions_as_of",
+    "select transaction_id, group_id, type, last_changed, is_wip, "
+    "   committed_details, pending_details, "
+    "   committed_positions, pending_positions, committed_files, pending_files "
+    "from committed_transaction_state_of_group_at($1, $2) "
+    "where $3::timestamptz is null or last_changed >= $3",
+)
+TRANSACTION_QUERY = prepared_query(
+    "transaction",
+    "select transaction_id, group_id, type, last_changed, is_wip, "
+    "   committed_details, pending_details, "
+    "   committed_positions, pending_positions, committed_files, pending_files "
+    "from full_transaction_state_valid_at($1) "
+    "where group_id = $2 and transaction_id = $3",
+)
 
 
 @dataclass
@@ -58,12 +99,8 @@ class TransactionService(Service):
         transaction_type: Optional[Union[str, list[str]]] = None,
     ) -> int:
         """returns group id of the transaction"""
-        result = await conn.fetchrow(
-            "select t.type, t.group_id, can_write, is_owner "
-            "from group_membership gm join transaction t on gm.group_id = t.group_id and gm.user_id = $1 "
-            "where t.id = $2",
-            user.id,
-            transaction_id,
+        result = await TRANSACTION_PERMISSIONS_QUERY.fetchrow(
+            conn, user.id, transaction_id
         )
         if not result:
             raise NotFoundError(f"user is not a member of this group")
@@ -192,7 +229,7 @@ class TransactionService(Service):
             pending_files=pending_files,
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def list_transactions(
         self,
         *,
@@ -201,13 +238,27 @@ class TransactionService(Service):
         group_id: int,
         min_last_changed: Optional[datetime] = None,
         additional_transactions: Optional[list[int]] = None,
+        as_of: Optional[datetime] = None,
     ) -> list[Transaction]:
+        """
+        if as_of is given the state committed at that point in time is returned, without any pending changes,
+        hence it cannot be combined with additional_transactions.
+        """
         await check_group_permissions(conn=conn, group_id=group_id, user=user)
 
-        if min_last_changed:
+        if as_of is not None:
+            if additional_transactions:
+                raise InvalidCommand(
+                    "Cannot request transactions with pending changes together with a committed state as of a "
+                    "point in time"
+                )
+            rows = await GROUP_TRANSACTIONS_AS_OF_QUERY.fetch(
+                conn, group_id, as_of, min_last_changed
+            )
+        elif min_last_changed:
             # if a minimum last changed value is specified we must also return all transactions the current
             # user has pending changes with to properly sync state across different devices of the user
-            cur = conn.cursor(
+            rows = await conn.fetch(
                 "select transaction_id, group_id, type, last_changed, is_wip, "
                 "   committed_details, pending_details, "
                 "   committed_positions, pending_positions, committed_files, pending_files "
@@ -220,38 +271,23 @@ class TransactionService(Service):
                 additional_transactions,
             )
         else:
-            cur = conn.cursor(
-                "select transaction_id, group_id, type, last_changed, is_wip, "
-                "   committed_details, pending_details, "
-                "   committed_positions, pending_positions, committed_files, pending_files "
-                "from full_transaction_state_valid_at($1) "
-                "where group_id = $2",
-                user.id,
-                group_id,
-            )
+            rows = await GROUP_TRANSACTIONS_QUERY.fetch(conn, user.id, group_id)
 
         result = []
-        async for transaction in cur:
+        for transaction in rows:
             result.append(self._transaction_db_row(transaction))
 
         return result
 
-    @with_db_transaction
+    @with_db_read_connection
     async def get_transaction(
         self, *, conn: Connection, user: User, transaction_id: int
     ) -> Transaction:
         group_id = await self._check_transaction_permissions(
             conn=conn, user=user, transaction_id=transaction_id
         )
-        transaction = await conn.fetchrow(
-            "select transaction_id, group_id, type, last_changed, is_wip, "
-            "   committed_details, pending_details, "
-            "   committed_positions, pending_positions, committed_files, pending_files "
-            "from full_transaction_state_valid_at($1) "
-            "where group_id = $2 and transaction_id = $3",
-            user.id,
-            group_id,
-            transaction_id,
+        transaction = await TRANSACTION_QUERY.fetchrow(
+            conn, user.id, group_id, transaction_id
         )
         return self._transaction_db_row(transaction)
 
@@ -595,7 +631,7 @@ class TransactionService(Service):
         )
         return transaction_id, revision_id
 
-    @with_db_transaction
+    @with_db_read_connection
     async def read_file_contents(
         self, *, conn: Connection, user: User, file_id: int, blob_id: int
     ) -> tuple[str, bytes]:
@@ -758,9 +794,9 @@ class TransactionService(Service):
             user=user,
             transaction_id=transaction_id,
             can_write=True,
-            transaction_type=TransactionType.purchase.value
-            if positions is not None
-            else None,
+            transaction_type=(
+                TransactionType.purchase.value if positions is not None else None
+            ),
         )
         revision_id = await self._get_or_create_revision(
             conn=conn, user=user, transaction_id=transaction_id
@@ -1049,12 +1085,8 @@ class TransactionService(Service):
         self, conn: asyncpg.Connection, user: User, transaction_id: int
     ) -> int:
         """return the revision id, assumes we are already in a transaction"""
-        revision_id = await conn.fetchval(
-            "select id "
-            "from transaction_revision "
-            "where transaction_id = $1 and user_id = $2 and committed is null",
-            transaction_id,
-            user.id,
+        revision_id = await PENDING_REVISION_QUERY.fetchval(
+            conn, transaction_id, user.id
         )
         if revision_id:  # there already is a wip revision
             return revision_id
@@ -18,10 +18,33 @@ from abrechnung.core.service import (
 )
 from abrechnung.domain.users import User, Session
 from abrechnung.framework.database import Connection
-from abrechnung.framework.decorators import with_db_transaction
+from abrechnung.framework.database import ReplicaRouter
+from abrechnung.framework.database import SessionCommit, current_session_commit
+from abrechnung.framework.decorators import (
+    with_db_connection,
+    with_db_transaction,
+    with_db_read_connection,
+)
+from abrechnung.framework.queries import prepared_query
 
 ALGORITHM = "HS256"
 
+SESSION_QUERY = prepared_query(
+    "session",
+    "select s.id, slc.commit_lsn "
+    "from session s left join session_last_commit slc on slc.session_id = s.id "
+    "where s.id = $1 and s.user_id = $2 and (s.valid_until is null or s.valid_until > now())",
+)
+USER_QUERY = prepared_query(
+    "user",
+    "select id, email, registered_at, username, pending, deleted, is_guest_user "
+    "from usr where id = $1",
+)
+USER_SESSIONS_QUERY = prepared_query(
+    "user_sessions",
+    "select id, name, valid_until, last_seen from session where user_id = $1",
+)
+
 
 class InvalidPassword(Exception):
     pass
@@ -41,8 +64,15 @@ class UserService(Service):
         self,
         db_pool: Pool,
         config: Config,
+        read_db_pool: Optional[Pool] = None,
+        replica_router: Optional[ReplicaRouter] = None,
     ):
-        super().__init__(db_pool=db_pool, config=config)
+        super().__init__(
+            db_pool=db_pool,
+            config=config,
+            read_db_pool=read_db_pool,
+            replica_router=replica_router,
+        )
 
         self.enable_registration = self.cfg.registration.enabled
         self.allow_guest_users = self.cfg.registration.allow_guest_users
@@ -75,21 +105,22 @@ class UserService(Service):
         except JWTError:
             raise PermissionError
 
-    @with_db_transaction
+    # sessions are always checked on the primary, a lagging replica would reject fresh and accept revoked sessions
+    @with_db_connection
     async def get_user_from_token(self, *, conn: Connection, token: str) -> User:
         token_metadata = self.decode_jwt_payload(token)
 
-        sess = await conn.fetchval(
-            "select id from session "
-            "where id = $1 and user_id = $2 and valid_until is null or valid_until > now()",
-            token_metadata.session_id,
-            token_metadata.user_id,
+        sess = await SESSION_QUERY.fetchrow(
+            conn, token_metadata.session_id, token_metadata.user_id
         )
         if not sess:
             raise PermissionError
         user = await self._get_user(conn=conn, user_id=token_metadata.user_id)
         if user is None:
             raise PermissionError
+        current_session_commit.set(
+            SessionCommit(session_id=sess["id"], commit_lsn=sess["commit_lsn"])
+        )
         return user
 
     async def _verify_user_password(self, user_id: int, password: str) -> bool:
@@ -284,19 +315,12 @@ class UserService(Service):
         return user_id
 
     async def _get_user(self, conn: asyncpg.Connection, user_id: int) -> User:
-        user = await conn.fetchrow(
-            "select id, email, registered_at, username, pending, deleted, is_guest_user "
-            "from usr where id = $1",
-            user_id,
-        )
+        user = await USER_QUERY.fetchrow(conn, user_id)
 
         if user is None:
             raise NotFoundError(f"User with id {user_id} does not exist")
 
-        rows = await conn.fetch(
-            "select id, name, valid_until, last_seen from session where user_id = $1",
-            user_id,
-        )
+        rows = await USER_SESSIONS_QUERY.fetch(conn, user_id)
         sessions = [
             Session(
                 id=row["id"],
@@ -318,7 +342,7 @@ class UserService(Service):
             sessions=sessions,
         )
 
-    @with_db_transaction
+    @with_db_read_connection
     async def get_user(self, *, conn: Connection, user_id: int) -> User:
         return await self._get_user(conn, user_id)
 
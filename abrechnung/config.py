@@ -6,6 +6,7 @@ import yaml
 from pydantic import BaseModel
 
 from abrechnung.framework.database import DatabaseConfig
+from abrechnung.framework.loop_monitor import MonitoringConfig
 
 
 class ServiceConfig(BaseModel):
@@ -24,9 +25,25 @@ class ApiConfig(BaseModel):
     host: str
     port: int
     id: str = "default"
+    # number of worker processes sharing the listening socket,
+    # each worker registers its own notification forwarder with id "<id>-<worker index>"
+    workers: int = 1
+    # crashed workers are restarted after a delay which doubles with every crash of the worker, up to 30 seconds
+    worker_restart_delay: timedelta = timedelta(seconds=1)
+    # the api exits with an error once workers crashed more than worker_max_restarts times within worker_restart_window
+    worker_max_restarts: int = 5
+    worker_restart_window: timedelta = timedelta(minutes=1)
     max_uploadable_file_size: int = 1024
     enable_cors: bool = True
     access_token_validity: timedelta = timedelta(hours=1)
+    # identical websocket notifications for a client within this window are only delivered once
+    notification_debounce: timedelta = timedelta(milliseconds=100)
+    # size of the database pool reserved for websocket connection handling, separate from the http pool
+    websocket_db_connections: int = 2
+    # expose query and connection pool metrics in the prometheus format at /api/metrics
+    enable_metrics: bool = False
+    # report the database and application time of each request to clients in a Server-Timing header
+    server_timing: bool = False
 
 
 class RegistrationConfig(BaseModel):
@@ -45,6 +62,20 @@ class EmailConfig(BaseModel):
     port: int
     mode: str = "smtp"  # oneof "local" "smtp-ssl" "smtp-starttls" "smtp"
     auth: Optional[AuthConfig] = None
+    # number of mails sent concurrently, each over its own connection to the mail server
+    max_connections: int = 4
+    # connections to the mail server are closed after being unused for this long
+    connection_idle_timeout: timedelta = timedelta(seconds=30)
+    # failed deliveries are retried after retry_delay, doubling the delay for every further attempt
+    retry_delay: timedelta = timedelta(minutes=1)
+    max_retry_delay: timedelta = timedelta(hours=6)
+    # delivery of a mail is given up after this many failed attempts
+    max_attempts: int = 10
+    # interval in which the mailer checks for pending mails regardless of database notifications
+    sweep_interval: timedelta = timedelta(minutes=5)
+    # if set, users receive a mail summarizing the activity in their groups in this interval.
+    # due digests are sent whenever the mailer sweeps for pending mails.
+    digest_interval: Optional[timedelta] = None
 
 
 class Config(BaseModel):
@@ -55,6 +86,7 @@ class Config(BaseModel):
     # in case all params are optional this is needed to make the whole section optional
     demo: DemoConfig = DemoConfig()
     registration: RegistrationConfig = RegistrationConfig()
+    monitoring: MonitoringConfig = MonitoringConfig()
 
 
 def read_config(config_path: Path) -> Config:
@@ -1,7 +1,13 @@
 from .errors import NotFoundError
 from abrechnung.framework.database import Connection
+from abrechnung.framework.queries import prepared_query
 from abrechnung.domain.users import User
 
+GROUP_PERMISSIONS_QUERY = prepared_query(
+    "group_permissions",
+    "select is_owner, can_write from group_membership where group_id = $1 and user_id = $2",
+)
+
 
 async def check_group_permissions(
     conn: Connection,
@@ -10,11 +16,7 @@ async def check_group_permissions(
     is_owner: bool = False,
     can_write: bool = False,
 ) -> tuple[bool, bool]:
-    membership = await conn.fetchrow(
-        "select is_owner, can_write from group_membership where group_id = $1 and user_id = $2",
-        group_id,
-        user.id,
-    )
+    membership = await GROUP_PERMISSIONS_QUERY.fetchrow(conn, group_id, user.id)
     if membership is None:
         raise NotFoundError(f"group not found")
 
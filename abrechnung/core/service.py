@@ -1,9 +1,22 @@
+from typing import Optional
+
 import asyncpg
 
 from abrechnung.config import Config
+from abrechnung.framework.database import ReplicaRouter
 
 
 class Service:
-    def __init__(self, db_pool: asyncpg.Pool, config: Config):
+    def __init__(
+        self,
+        db_pool: asyncpg.Pool,
+        config: Config,
+        read_db_pool: Optional[asyncpg.Pool] = None,
+        replica_router: Optional[ReplicaRouter] = None,
+    ):
         self.db_pool = db_pool
+        # pool used for read only queries, the main pool is used if there is no separate one
+        self.read_db_pool = read_db_pool or db_pool
+        # routes reads to database replicas if any are configured
+        self.replica_router = replica_router
         self.cfg = config
@@ -0,0 +1,410 @@
+"""
+Bulk loading of large generated data sets, e.g. for benchmarks.
+
+Instead of creating accounts and transactions one by one through the services all rows are written with COPY.
+Every account and transaction is created with a single committed revision. The per revision commit checks run once
+all rows of a revision are present: the commit triggers are deferred until the end of the surrounding transaction,
+this includes maintaining the graph of clearing accounts. The remaining account checks are check constraints, the
+history rows are copied last, their triggers touch the already committed revisions and thereby re-evaluate the check
+constraints of each revision against its complete contents. The validity ranges of the new states are copied directly,
+the commit triggers only compute them if they are missing.
+Everything is validated before writing as well such that invalid data is rejected with a descriptive error.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import asyncpg
+
+from abrechnung.core.errors import InvalidCommand
+
+
+@dataclass
+class BulkAccount:
+    name: str
+    type: str = "personal"
+    description: str = ""
+    owning_user_id: Optional[int] = None
+    date_info: Optional[date] = None
+    # index of the share account in the list of loaded accounts -> shares
+    clearing_shares: dict[int, float] = field(default_factory=dict)
+
+
+@dataclass
+class BulkPosition:
+    name: str
+    price: float
+    communist_shares: float = 0.0
+    # account index -> shares
+    usages: dict[int, float] = field(default_factory=dict)
+
+
+@dataclass
+class BulkTransaction:
+    type: str
+    name: str
+    value: float
+    billed_at: date
+    # account index -> shares
+    creditor_shares: dict[int, float]
+    debitor_shares: dict[int, float]
+    description: Optional[str] = None
+    currency_symbol: str = "€"
+    currency_conversion_rate: float = 1.0
+    positions: list[BulkPosition] = field(default_factory=list)
+
+
+def _check_shares(what: str, shares: dict[int, float], n_accounts: int):
+    for account_index, share in shares.items():
+        if not 0 <= account_index < n_accounts:
+            raise InvalidCommand(f"{what} references unknown account {account_index}")
+        if share <= 0:
+            raise InvalidCommand(f"{what} has a share of {share} which is not positive")
+
+
+def _check_accounts(accounts: list[BulkAccount]):
+    for i, account in enumerate(accounts):
+        if account.type not in ("personal", "clearing"):
+            raise InvalidCommand(f"account {i} has unknown type {account.type}")
+        if account.type == "personal" and account.clearing_shares:
+            raise InvalidCommand(
+                f'"personal" type account {i} cannot have clearing shares'
+            )
+        _check_shares(f"account {i}", account.clearing_shares, len(accounts))
+
+    # clearing accounts must not depend on themselves, checked with an iterative depth first search
+    visited = [0] * len(accounts)  # 0 = unvisited, 1 = on the current path, 2 = done
+    for root in range(len(accounts)):
+        if visited[root]:
+            continue
+        stack = [(root, iter(accounts[root].clearing_shares))]
+        visited[root] = 1
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                visited[node] = 2
+                stack.pop()
+            elif visited[child] == 1:
+                raise InvalidCommand(
+                    f"clearing account {child} has a cyclic dependency on itself"
+                )
+            elif visited[child] == 0:
+                visited[child] = 1
+                stack.append((child, iter(accounts[child].clearing_shares)))
+
+
+def _check_transactions(transactions: list[BulkTransaction], n_accounts: int):
+    for i, transaction in enumerate(transactions):
+        n_creditors = len(transaction.creditor_shares)
+        n_debitors = len(transaction.debitor_shares)
+        if transaction.type == "transfer" and (n_creditors != 1 or n_debitors != 1):
+            raise InvalidCommand(
+                f'"transfer" type transaction {i} must have exactly one creditor and debitor share'
+            )
+        elif transaction.type == "purchase" and (n_creditors != 1 or n_debitors < 1):
+            raise InvalidCommand(
+                f'"purchase" type transaction {i} must have exactly one creditor and at least one debitor share'
+            )
+        elif transaction.type == "mimo" and (n_creditors < 1 or n_debitors < 1):
+            raise InvalidCommand(
+                f'"mimo" type transaction {i} must have at least one creditor and debitor share'
+            )
+        elif transaction.type not in ("transfer", "purchase", "mimo"):
+            raise InvalidCommand(f"transaction {i} has unknown type {transaction.type}")
+        if transaction.positions and transaction.type != "purchase":
+            raise InvalidCommand(
+                f'only "purchase" type transactions can have positions, transaction {i} is a {transaction.type}'
+            )
+
+        _check_shares(f"transaction {i}", transaction.creditor_shares, n_accounts)
+        _check_shares(f"transaction {i}", transaction.debitor_shares, n_accounts)
+        for position in transaction.positions:
+            _check_shares(
+                f"position {position.name} of transaction {i}",
+                position.usages,
+                n_accounts,
+            )
+            if position.communist_shares < 0 or (
+                position.communist_shares == 0 and not position.usages
+            ):
+                raise InvalidCommand(
+                    f"position {position.name} of transaction {i} must have at least one account assigned "
+                    f"or its common shares set greater than 0"
+                )
+
+
+async def _next_ids(conn: asyncpg.Connection, sequence: str, n: int) -> list[int]:
+    if n == 0:
+        return []
+    return [
+        row[0]
+        for row in await conn.fetch(
+            "select nextval($1::regclass) from generate_series(1, $2)", sequence, n
+        )
+    ]
+
+
+def _revision_timestamps(base: datetime, n: int) -> list[datetime]:
+    """
+    distinct commit timestamps for n revisions, such that the conflict checks of committed revisions
+    can use the index on the commit timestamp
+    """
+    return [base - timedelta(microseconds=n - i) for i in range(n)]
+
+
+async def bulk_load_accounts(
+    conn: asyncpg.Connection,
+    group_id: int,
+    user_id: int,
+    accounts: list[BulkAccount],
+) -> list[int]:
+    """
+    write accounts and their clearing shares, returns the ids of the created accounts.
+    has to be run inside a transaction.
+    """
+    _check_accounts(accounts)
+    # the revisions are committed before their contents are written, maintain the clearing account graph on commit
+    await conn.execute(
+        "set constraints check_clearing_accounts_for_cyclic_dependencies deferred"
+    )
+    account_ids = await _next_ids(conn, "account_id_seq", len(accounts))
+    revision_ids = await _next_ids(conn, "account_revision_id_seq", len(accounts))
+    timestamps = _revision_timestamps(
+        await conn.fetchval("select now()"), len(accounts)
+    )
+
+    await conn.copy_records_to_table(
+        "account",
+        records=(
+            (account_id, group_id, account.type)
+            for account_id, account in zip(account_ids, accounts)
+        ),
+        columns=("id", "group_id", "type"),
+    )
+    await conn.copy_records_to_table(
+        "account_revision",
+        records=(
+            (revision_id, user_id, account_id, timestamp, timestamp, timestamp)
+            for revision_id, account_id, timestamp in zip(
+                revision_ids, account_ids, timestamps
+            )
+        ),
+        columns=("id", "user_id", "account_id", "started", "committed", "last_changed"),
+    )
+    await conn.copy_records_to_table(
+        "clearing_account_share",
+        records=(
+            (account_id, revision_id, account_ids[share_account], shares)
+            for account_id, revision_id, account in zip(
+                account_ids, revision_ids, accounts
+            )
+            for share_account, shares in account.clearing_shares.items()
+        ),
+        columns=("account_id", "revision_id", "share_account_id", "shares"),
+    )
+    await conn.copy_records_to_table(
+        "account_history",
+        records=(
+            (
+                account_id,
+                revision_id,
+                account.name,
+                account.description,
+                account.owning_user_id,
+                account.date_info,
+            )
+            for account_id, revision_id, account in zip(
+                account_ids, revision_ids, accounts
+            )
+        ),
+        columns=(
+            "id",
+            "revision_id",
+            "name",
+            "description",
+            "owning_user_id",
+            "date_info",
+        ),
+    )
+    await conn.copy_records_to_table(
+        "account_state_validity",
+        records=(
+            (account_id, revision_id, group_id, asyncpg.Range(timestamp, None))
+            for account_id, revision_id, timestamp in zip(
+                account_ids, revision_ids, timestamps
+            )
+        ),
+        columns=("account_id", "revision_id", "group_id", "valid_during"),
+    )
+    return account_ids
+
+
+async def bulk_load_transactions(
+    conn: asyncpg.Connection,
+    group_id: int,
+    user_id: int,
+    account_ids: list[int],
+    transactions: list[BulkTransaction],
+) -> list[int]:
+    """
+    write transactions including their shares and positions, returns the ids of the created transactions.
+    shares reference accounts by their index in account_ids. has to be run inside a transaction.
+    """
+    _check_transactions(transactions, len(account_ids))
+    # the revisions are committed before their contents are written, validate them on commit instead
+    await conn.execute("set constraints check_committed_transactions deferred")
+    transaction_ids = await _next_ids(conn, "transaction_id_seq", len(transactions))
+    revision_ids = await _next_ids(
+        conn, "transaction_revision_id_seq", len(transactions)
+    )
+    timestamps = _revision_timestamps(
+        await conn.fetchval("select now()"), len(transactions)
+    )
+    positions = [
+        (transaction_id, revision_id, position)
+        for transaction_id, revision_id, transaction in zip(
+            transaction_ids, revision_ids, transactions
+        )
+        for position in transaction.positions
+    ]
+    position_timestamps = [
+        timestamp
+        for timestamp, transaction in zip(timestamps, transactions)
+        for _ in transaction.positions
+    ]
+    position_ids = await _next_ids(conn, "purchase_item_id_seq", len(positions))
+
+    await conn.copy_records_to_table(
+        "transaction",
+        records=(
+            (transaction_id, group_id, transaction.type)
+            for transaction_id, transaction in zip(transaction_ids, transactions)
+        ),
+        columns=("id", "group_id", "type"),
+    )
+    await conn.copy_records_to_table(
+        "transaction_revision",
+        records=(
+            (revision_id, user_id, transaction_id, timestamp, timestamp, timestamp)
+            for revision_id, transaction_id, timestamp in zip(
+                revision_ids, transaction_ids, timestamps
+            )
+        ),
+        columns=(
+            "id",
+            "user_id",
+            "transaction_id",
+            "started",
+            "committed",
+            "last_changed",
+        ),
+    )
+    for table, attr in (
+        ("creditor_share", "creditor_shares"),
+        ("debitor_share", "debitor_shares"),
+    ):
+        await conn.copy_records_to_table(
+            table,
+            records=(
+                (transaction_id, revision_id, account_ids[account], shares)
+                for transaction_id, revision_id, transaction in zip(
+                    transaction_ids, revision_ids, transactions
+                )
+                for account, shares in getattr(transaction, attr).items()
+            ),
+            columns=("transaction_id", "revision_id", "account_id", "shares"),
+        )
+    await conn.copy_records_to_table(
+        "purchase_item",
+        records=(
+            (position_id, transaction_id)
+            for position_id, (transaction_id, _, _) in zip(position_ids, positions)
+        ),
+        columns=("id", "transaction_id"),
+    )
+    await conn.copy_records_to_table(
+        "purchase_item_usage",
+        records=(
+            (position_id, revision_id, account_ids[account], shares)
+            for position_id, (_, revision_id, position) in zip(position_ids, positions)
+            for account, shares in position.usages.items()
+        ),
+        columns=("item_id", "revision_id", "account_id", "share_amount"),
+    )
+    await conn.copy_records_to_table(
+        "purchase_item_history",
+        records=(
+            (
+                position_id,
+                revision_id,
+                position.name,
+                position.price,
+                position.communist_shares,
+            )
+            for position_id, (_, revision_id, position) in zip(position_ids, positions)
+        ),
+        columns=("id", "revision_id", "name", "price", "communist_shares"),
+    )
+    await conn.copy_records_to_table(
+        "transaction_history",
+        records=(
+            (
+                transaction_id,
+                revision_id,
+                transaction.currency_symbol,
+                transaction.currency_conversion_rate,
+                transaction.value,
+                transaction.billed_at,
+                transaction.name,
+                transaction.description,
+            )
+            for transaction_id, revision_id, transaction in zip(
+                transaction_ids, revision_ids, transactions
+            )
+        ),
+        columns=(
+            "id",
+            "revision_id",
+            "currency_symbol",
+            "currency_conversion_rate",
+            "value",
+            "billed_at",
+            "name",
+            "description",
+        ),
+    )
+    await conn.copy_records_to_table(
+        "transaction_state_validity",
+        records=(
+            (transaction_id, revision_id, group_id, asyncpg.Range(timestamp, None))
+            for transaction_id, revision_id, timestamp in zip(
+                transaction_ids, revision_ids, timestamps
+            )
+        ),
+        columns=("transaction_id", "revision_id", "group_id", "valid_during"),
+    )
+    await conn.copy_records_to_table(
+        "purchase_item_state_validity",
+        records=(
+            (
+                position_id,
+                revision_id,
+                transaction_id,
+                group_id,
+                asyncpg.Range(timestamp, None),
+            )
+            for position_id, (transaction_id, revision_id, _), timestamp in zip(
+                position_ids, positions, position_timestamps
+            )
+        ),
+        columns=(
+            "item_id",
+            "revision_id",
+            "transaction_id",
+            "group_id",
+            "valid_during",
+        ),
+    )
+    return transaction_ids
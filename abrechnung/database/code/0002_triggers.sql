@@ -13,6 +13,8 @@ create trigger pending_registration_trig
     after insert or update
     on pending_registration
     for each row
+    -- the mailer clears mail_next_attempt once it has picked up the mail, this must not notify it again
+    when (NEW.mail_next_attempt is not null)
 execute function pending_registration_updated();
 
 create or replace function pending_password_recovery_updated() returns trigger as
@@ -28,6 +30,7 @@ create trigger pending_password_recovery_trig
     after insert or update
     on pending_password_recovery
     for each row
+    when (NEW.mail_next_attempt is not null)
 execute function pending_password_recovery_updated();
 
 create or replace function pending_email_change_updated() returns trigger as
@@ -43,8 +46,24 @@ create trigger pending_email_change_trig
     after insert or update
     on pending_email_change
     for each row
+    when (NEW.mail_next_attempt is not null)
 execute function pending_email_change_updated();
 
+create or replace function mail_outbox_updated() returns trigger as
+$$
+begin
+    perform pg_notify('mailer', 'mail_outbox');
+
+    return null;
+end;
+$$ language plpgsql;
+
+create trigger mail_outbox_trig
+    after insert
+    on mail_outbox
+    for each statement
+execute function mail_outbox_updated();
+
 create or replace function group_updated() returns trigger as
 $$
 begin
@@ -198,160 +217,186 @@ create trigger group_log_update_trig
     for each row
 execute function group_log_updated();
 
+-- notifications for changes in transaction contents
+-- these triggers run once per statement and send one notification per group listing all affected transactions
+-- instead of one per changed row, such that a bulk change of many transactions results in a single notification.
+create or replace procedure notify_transactions_changed(
+    transaction_ids integer[]
+) as
+$$
+<<locals>> declare
+    group_info record;
+begin
+    for group_info in select
+                          t.group_id,
+                          array_agg(t.id order by t.id) as transaction_ids
+                      from
+                          transaction t
+                      where
+                              t.id = any (notify_transactions_changed.transaction_ids)
+                      group by t.group_id loop
+        call notify_group('transaction', group_info.group_id, group_info.group_id::bigint,
+                          json_build_object('element_id', group_info.group_id, 'transaction_ids',
+                                            group_info.transaction_ids));
+    end loop;
+end;
+$$ language plpgsql;
+
 create or replace function transaction_history_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id       grp.id%TYPE;
-    transaction_id integer;
+    transaction_ids integer[];
 begin
-    -- A deletion should not be possible therefore NEW should never be NULL
-    if NEW is null then
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-        where
-                transaction.id = OLD.id;
-    else
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-        where
-                transaction.id = NEW.id;
-    end if;
+    select array_agg(distinct changed_rows.id) into locals.transaction_ids from changed_rows;
 
-    call notify_group('transaction', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'transaction_id', locals.transaction_id));
+    call notify_transactions_changed(locals.transaction_ids);
     return NULL;
 end;
 $$ language plpgsql;
 
+create trigger transaction_history_insert_trig
+    after insert
+    on transaction_history
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_history_updated();
+
 create trigger transaction_history_update_trig
-    after insert or update or delete
+    after update
     on transaction_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_history_updated();
+
+create trigger transaction_history_delete_trig
+    after delete
+    on transaction_history
+    referencing old table as changed_rows
+    for each statement
 execute function transaction_history_updated();
 
 create or replace function transaction_share_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id       grp.id%TYPE;
-    transaction_id integer;
+    transaction_ids integer[];
 begin
-    -- A deletion should not be possible therefore NEW should never be NULL
-    if NEW is null then
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-            join transaction_history th on transaction.id = th.id
-        where th.revision_id = OLD.revision_id and th.id = OLD.transaction_id;
-    else
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-            join transaction_history th on transaction.id = th.id
-        where th.revision_id = NEW.revision_id and th.id = NEW.transaction_id;
-    end if;
+    select array_agg(distinct changed_rows.transaction_id) into locals.transaction_ids from changed_rows;
 
-    call notify_group('transaction', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'transaction_id', locals.transaction_id));
+    call notify_transactions_changed(locals.transaction_ids);
     return NULL;
 end;
 $$ language plpgsql;
 
-create trigger creditor_share_trig
-    after insert or update or delete
+create trigger creditor_share_insert_trig
+    after insert
     on creditor_share
-    for each row
+    referencing new table as changed_rows
+    for each statement
 execute function transaction_share_updated();
 
-create trigger debitor_share_trig
-    after insert or update or delete
+create trigger creditor_share_update_trig
+    after update
+    on creditor_share
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_share_updated();
+
+create trigger creditor_share_delete_trig
+    after delete
+    on creditor_share
+    referencing old table as changed_rows
+    for each statement
+execute function transaction_share_updated();
+
+create trigger debitor_share_insert_trig
+    after insert
     on debitor_share
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_share_updated();
+
+create trigger debitor_share_update_trig
+    after update
+    on debitor_share
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_share_updated();
+
+create trigger debitor_share_delete_trig
+    after delete
+    on debitor_share
+    referencing old table as changed_rows
+    for each statement
 execute function transaction_share_updated();
 
 create or replace function purchase_item_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id       grp.id%TYPE;
-    transaction_id integer;
+    transaction_ids integer[];
 begin
-    -- A deletion should not be possible therefore NEW should never be NULL
-    if NEW is null then return null; end if;
-
     select
-        transaction.group_id,
-        transaction.id
-    into locals.group_id, locals.transaction_id
+        array_agg(distinct pi.transaction_id)
+    into locals.transaction_ids
     from
-        transaction
-        join purchase_item pi on transaction.id = pi.transaction_id
-    where
-            pi.id = NEW.id;
+        changed_rows
+        join purchase_item pi on pi.id = changed_rows.id;
 
-    call notify_group('transaction', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'transaction_id', locals.transaction_id));
+    call notify_transactions_changed(locals.transaction_ids);
     return null;
 end;
 $$ language plpgsql;
 
-create trigger purchase_item_trig
-    after insert or update or delete
+-- deletions of purchase items only happen when pending changes are discarded, we do not notify about those
+create trigger purchase_item_insert_trig
+    after insert
     on purchase_item_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function purchase_item_updated();
+
+create trigger purchase_item_update_trig
+    after update
+    on purchase_item_history
+    referencing new table as changed_rows
+    for each statement
 execute function purchase_item_updated();
 
 create or replace function purchase_item_usage_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id       grp.id%TYPE;
-    transaction_id integer;
+    transaction_ids integer[];
 begin
-    if NEW is null then
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-            join purchase_item pi on transaction.id = pi.transaction_id
-        where
-                pi.id = OLD.item_id;
-    else
-        select
-            transaction.group_id,
-            transaction.id
-        into locals.group_id, locals.transaction_id
-        from
-            transaction
-            join purchase_item pi on transaction.id = pi.transaction_id
-        where
-                pi.id = NEW.item_id;
-    end if;
-
+    select
+        array_agg(distinct pi.transaction_id)
+    into locals.transaction_ids
+    from
+        changed_rows
+        join purchase_item pi on pi.id = changed_rows.item_id;
 
-    call notify_group('transaction', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'transaction_id', locals.transaction_id));
+    call notify_transactions_changed(locals.transaction_ids);
     return null;
 end;
 $$ language plpgsql;
 
-create trigger purchase_item_usage_trig
-    after insert or update or delete
+create trigger purchase_item_usage_insert_trig
+    after insert
     on purchase_item_usage
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function purchase_item_usage_updated();
+
+create trigger purchase_item_usage_update_trig
+    after update
+    on purchase_item_usage
+    referencing new table as changed_rows
+    for each statement
+execute function purchase_item_usage_updated();
+
+create trigger purchase_item_usage_delete_trig
+    after delete
+    on purchase_item_usage
+    referencing old table as changed_rows
+    for each statement
 execute function purchase_item_usage_updated();
 
 create or replace function update_last_changed() returns trigger as
@@ -365,7 +410,11 @@ $$ language plpgsql;
 create or replace function update_related_transaction_last_changed() returns trigger as
 $$
 begin
-    update transaction_revision set last_changed = now() where id = NEW.revision_id;
+    update transaction_revision
+    set
+        last_changed = now()
+    where
+            id in (select distinct changed_rows.revision_id from changed_rows);
     return null;
 end;
 $$ language plpgsql;
@@ -373,7 +422,11 @@ $$ language plpgsql;
 create or replace function update_related_account_last_changed() returns trigger as
 $$
 begin
-    update account_revision set last_changed = now() where id = NEW.revision_id;
+    update account_revision
+    set
+        last_changed = now()
+    where
+            id in (select distinct changed_rows.revision_id from changed_rows);
     return null;
 end;
 $$ language plpgsql;
@@ -390,22 +443,46 @@ create trigger transaction_revision_last_change_update_trig
     for each row
 execute function update_last_changed();
 
+create trigger transaction_history_last_changed_insert_trig
+    after insert
+    on transaction_history
+    referencing new table as changed_rows
+    for each statement
+execute function update_related_transaction_last_changed();
+
 create trigger transaction_history_last_changed_update_trig
-    after insert or update
+    after update
     on transaction_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function update_related_transaction_last_changed();
+
+create trigger purchase_item_last_changed_insert_trig
+    after insert
+    on purchase_item_history
+    referencing new table as changed_rows
+    for each statement
 execute function update_related_transaction_last_changed();
 
 create trigger purchase_item_last_changed_update_trig
-    after insert or update
+    after update
     on purchase_item_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
 execute function update_related_transaction_last_changed();
 
+create trigger account_last_changed_insert_trig
+    after insert
+    on account_history
+    referencing new table as changed_rows
+    for each statement
+execute function update_related_account_last_changed();
+
 create trigger account_last_changed_update_trig
-    after insert or update
+    after update
     on account_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
 execute function update_related_account_last_changed();
 
 create or replace function transaction_revision_updated() returns trigger as
@@ -447,32 +524,40 @@ execute function transaction_revision_updated();
 create or replace function account_history_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id   grp.id%TYPE;
-    account_id integer;
+    account_info record;
 begin
-    -- A deletion should not be possible therefore NEW should never be NULL
-    if NEW is null then
-        select account.group_id, account.id
-        into locals.group_id, locals.account_id
-        from account
-        where account.id = OLD.id;
-    else
-        select account.group_id, account.id
-        into locals.group_id, locals.account_id
-        from account
-        where account.id = NEW.id;
-    end if;
-
-    call notify_group('account', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'account_id', locals.account_id));
+    for account_info in select distinct
+                            a.group_id,
+                            a.id
+                        from
+                            changed_rows
+                            join account a on a.id = changed_rows.id loop
+        call notify_group('account', account_info.group_id, account_info.group_id::bigint,
+                          json_build_object('element_id', account_info.group_id, 'account_id', account_info.id));
+    end loop;
     return NULL;
 end;
 $$ language plpgsql;
 
+create trigger account_history_insert_trig
+    after insert
+    on account_history
+    referencing new table as changed_rows
+    for each statement
+execute function account_history_updated();
+
 create trigger account_history_update_trig
-    after insert or update or delete
+    after update
     on account_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
+execute function account_history_updated();
+
+create trigger account_history_delete_trig
+    after delete
+    on account_history
+    referencing old table as changed_rows
+    for each statement
 execute function account_history_updated();
 
 create or replace function account_revision_updated() returns trigger as
@@ -514,27 +599,155 @@ execute function account_revision_updated();
 create or replace function file_history_updated() returns trigger as
 $$
 <<locals>> declare
-    group_id       grp.id%TYPE;
-    transaction_id integer;
+    transaction_ids integer[];
 begin
     select
-        transaction.group_id,
-        transaction.id
-    into locals.group_id, locals.transaction_id
+        array_agg(distinct f.transaction_id)
+    into locals.transaction_ids
     from
-        transaction
-        join file f on transaction.id = f.transaction_id
-    where
-            f.id = (case when NEW is null then OLD.id else NEW.id end);
+        changed_rows
+        join file f on f.id = changed_rows.id;
 
-    call notify_group('transaction', locals.group_id, locals.group_id::bigint,
-                      json_build_object('element_id', locals.group_id, 'transaction_id', locals.transaction_id));
+    call notify_transactions_changed(locals.transaction_ids);
     return null;
 end;
 $$ language plpgsql;
 
-create trigger file_history_trig
-    after insert or update or delete
+create trigger file_history_insert_trig
+    after insert
     on file_history
-    for each row
+    referencing new table as changed_rows
+    for each statement
 execute function file_history_updated();
+
+create trigger file_history_update_trig
+    after update
+    on file_history
+    referencing new table as changed_rows
+    for each statement
+execute function file_history_updated();
+
+create trigger file_history_delete_trig
+    after delete
+    on file_history
+    referencing old table as changed_rows
+    for each statement
+execute function file_history_updated();
+-- recompute the validity ranges of a transaction and its positions when one of its revisions is committed.
+-- deferred as history rows can be inserted after their revision has been committed
+create or replace function update_transaction_state_validity() returns trigger as
+$$
+begin
+    if NEW.committed is null or (TG_OP = 'UPDATE' and OLD.committed is not null) then return null; end if;
+    -- already written by bulk loads
+    if exists(select from transaction_state_validity v where v.transaction_id = NEW.transaction_id and v.revision_id = NEW.id) then
+        return null;
+    end if;
+
+    -- serialize concurrent commits of the same transaction, the statements below have to see the ranges written
+    -- by a concurrent commit which finished while we were waiting
+    perform from transaction t where t.id = NEW.transaction_id for no key update;
+
+    -- committed is the start time of the committing database transaction, hence revisions of concurrent sessions
+    -- can commit out of order. the new revision splits the range containing its commit time, which is usually the
+    -- open one, and is valid until the commit time of the next revision.
+    if exists(select from transaction_history th where th.id = NEW.transaction_id and th.revision_id = NEW.id) then
+        update transaction_state_validity
+        set valid_during = tstzrange(lower(valid_during), NEW.committed)
+        where
+            transaction_id = NEW.transaction_id
+            and lower(valid_during) < NEW.committed
+            and (upper_inf(valid_during) or upper(valid_during) > NEW.committed);
+
+        insert into transaction_state_validity (transaction_id, revision_id, group_id, valid_during)
+        select
+            NEW.transaction_id,
+            NEW.id,
+            t.group_id,
+            tstzrange(NEW.committed, (select min(lower(v.valid_during))
+                                      from transaction_state_validity v
+                                      where v.transaction_id = NEW.transaction_id
+                                        and lower(v.valid_during) > NEW.committed))
+        from transaction t
+        where t.id = NEW.transaction_id;
+    end if;
+
+    update purchase_item_state_validity v
+    set valid_during = tstzrange(lower(v.valid_during), NEW.committed)
+    from purchase_item_history pih
+    where
+        pih.revision_id = NEW.id
+        and v.item_id = pih.id
+        and lower(v.valid_during) < NEW.committed
+        and (upper_inf(v.valid_during) or upper(v.valid_during) > NEW.committed);
+
+    insert into purchase_item_state_validity (item_id, revision_id, transaction_id, group_id, valid_during)
+    select
+        pih.id,
+        NEW.id,
+        t.id,
+        t.group_id,
+        tstzrange(NEW.committed, (select min(lower(v.valid_during))
+                                  from purchase_item_state_validity v
+                                  where v.item_id = pih.id and lower(v.valid_during) > NEW.committed))
+    from
+        purchase_item_history pih
+        join transaction t on t.id = NEW.transaction_id
+    where
+        pih.revision_id = NEW.id;
+
+    return null;
+end;
+$$ language plpgsql;
+
+create constraint trigger transaction_state_validity_trig
+    after insert or update of committed
+    on transaction_revision
+    deferrable initially deferred
+    for each row
+execute function update_transaction_state_validity();
+
+create or replace function update_account_state_validity() returns trigger as
+$$
+begin
+    if NEW.committed is null or (TG_OP = 'UPDATE' and OLD.committed is not null) then return null; end if;
+    -- already written by bulk loads
+    if exists(select from account_state_validity v where v.account_id = NEW.account_id and v.revision_id = NEW.id) then
+        return null;
+    end if;
+
+    -- see update_transaction_state_validity for the locking and the handling of out of order commits
+    perform from account a where a.id = NEW.account_id for no key update;
+
+    -- the history row of the revision is only guaranteed to exist at the end of the transaction, hence the deferral
+    if exists(select from account_history ah where ah.id = NEW.account_id and ah.revision_id = NEW.id) then
+        update account_state_validity
+        set valid_during = tstzrange(lower(valid_during), NEW.committed)
+        where
+            account_id = NEW.account_id
+            and lower(valid_during) < NEW.committed
+            and (upper_inf(valid_during) or upper(valid_during) > NEW.committed);
+
+        insert into account_state_validity (account_id, revision_id, group_id, valid_during)
+        select
+            NEW.account_id,
+            NEW.id,
+            a.group_id,
+            tstzrange(NEW.committed, (select min(lower(v.valid_during))
+                                      from account_state_validity v
+                                      where v.account_id = NEW.account_id
+                                        and lower(v.valid_during) > NEW.committed))
+        from account a
+        where a.id = NEW.account_id;
+    end if;
+
+    return null;
+end;
+$$ language plpgsql;
+
+create constraint trigger account_state_validity_trig
+    after insert or update of committed
+    on account_revision
+    deferrable initially deferred
+    for each row
+execute function update_account_state_validity();
@@ -94,62 +94,68 @@ alter table creditor_share add constraint check_creditor_share_gt_zero check ( s
 alter table creditor_share add constraint check_creditor_shares
     check (check_creditor_shares(transaction_id, revision_id, account_id));
 
-create or replace function check_committed_transactions(
-    revision_id bigint,
-    transaction_id integer,
-    started timestamptz,
-    committed timestamptz
-) returns boolean as
+-- validates a transaction revision once it is committed, all checks are evaluated by a single query.
+-- runs as a constraint trigger instead of a check constraint such that it is not re-evaluated on every update of the
+-- revision row, e.g. when changing a revision's history bumps its last_changed.
+-- the query is planned once, re-planning it for every committed revision costs more than evaluating it.
+create or replace function check_committed_transactions() returns trigger as
 $$
 <<locals>> declare
-    n_creditor_shares   integer;
-    n_debitor_shares    integer;
-    transaction_type    text;
-    transaction_deleted boolean;
+    has_conflict          boolean;
+    has_history           boolean;
+    transaction_type      text;
+    transaction_deleted   boolean;
+    n_creditor_shares     integer;
+    n_debitor_shares      integer;
+    has_invalid_positions boolean;
 begin
-    if committed is null then return true; end if;
-
-    perform
-    from
-        transaction_revision tr
-    where
-            tr.transaction_id = check_committed_transactions.transaction_id
-        and tr.id != check_committed_transactions.revision_id
-        and tr.committed between check_committed_transactions.started and check_committed_transactions.committed;
-
-    if found then raise 'another change was committed earlier, committing is not possible due to conflicts'; end if;
+    if NEW.committed is null or (TG_OP = 'UPDATE' and OLD.committed is not null) then return null; end if;
 
     select
+        exists(select
+                   1
+               from
+                   transaction_revision tr
+               where
+                       tr.transaction_id = NEW.transaction_id
+                   and tr.id != NEW.id
+                   and tr.committed between NEW.started and NEW.committed),
+        th.id is not null,
         t.type,
-        th.deleted
-    into locals.transaction_type, locals.transaction_deleted
+        th.deleted,
+        (select count(cs.account_id) from creditor_share cs where cs.transaction_id = t.id and cs.revision_id = NEW.id),
+        (select count(ds.account_id) from debitor_share ds where ds.transaction_id = t.id and ds.revision_id = NEW.id),
+        -- look for a purchase item at the current revision that has sum(usages) + communist_shares <= 0
+        case
+            when t.type = 'purchase' then exists(select
+                                                      1
+                                                  from
+                                                      purchase_item pi
+                                                      join purchase_item_history pih on pi.id = pih.id
+                                                      left join purchase_item_usage piu
+                                                          on pih.revision_id = piu.revision_id and pi.id = piu.item_id
+                                                  where
+                                                          pih.revision_id = NEW.id
+                                                      and pi.transaction_id = t.id
+                                                      and not pih.deleted
+                                                  group by pi.id
+                                                  having sum(coalesce(piu.share_amount, 0) + pih.communist_shares) <= 0)
+            else false
+        end
+    into locals.has_conflict, locals.has_history, locals.transaction_type, locals.transaction_deleted,
+        locals.n_creditor_shares, locals.n_debitor_shares, locals.has_invalid_positions
     from
-        transaction_history th
-        join transaction t on t.id = th.id
+        transaction t
+        left join transaction_history th on th.id = t.id and th.revision_id = NEW.id
     where
-            th.revision_id = check_committed_transactions.revision_id;
+            t.id = NEW.transaction_id;
 
-    if locals.transaction_deleted then -- if the transaction is deleted we simply accept anything as we dont care
-        return true;
+    if locals.has_conflict then
+        raise 'another change was committed earlier, committing is not possible due to conflicts';
     end if;
 
-    select
-        count(cs.account_id)
-    into locals.n_creditor_shares
-    from
-        creditor_share cs
-    where
-            cs.transaction_id = check_committed_transactions.transaction_id
-        and cs.revision_id = check_committed_transactions.revision_id;
-
-    select
-        count(ds.account_id)
-    into locals.n_debitor_shares
-    from
-        debitor_share ds
-    where
-            ds.transaction_id = check_committed_transactions.transaction_id
-        and ds.revision_id = check_committed_transactions.revision_id;
+    -- if the transaction is deleted we simply accept anything as we dont care
+    if not locals.has_history or locals.transaction_deleted then return null; end if;
 
     -- check that the number of shares fits the transaction type
     if locals.transaction_type = 'transfer' then
@@ -169,20 +175,7 @@ begin
         if locals.n_debitor_shares < 1 then
             raise '"purchase" type transactions must have at least one debitor share';
         end if;
-
-        -- check that all purchase items have at least an item share or communist shares > 0
-        -- i.e. we look for a purchase item at the current revision that has sum(usages) + communist_shares <= 0
-        -- if such a one is found we raise an exception
-        perform from purchase_item pi
-        join purchase_item_history pih on pi.id = pih.id
-        left join purchase_item_usage piu on pih.revision_id = piu.revision_id and pi.id = piu.item_id
-        where pih.revision_id = check_committed_transactions.revision_id
-            and pi.transaction_id = check_committed_transactions.transaction_id
-            and not pih.deleted
-        group by pi.id
-        having sum(coalesce(piu.share_amount, 0) + pih.communist_shares) <= 0;
-
-        if found then
+        if locals.has_invalid_positions then
             raise 'all transaction positions must have at least one account assigned or their common shares set greater than 0';
         end if;
     end if;
@@ -196,9 +189,9 @@ begin
         end if;
     end if;
 
-    return true;
+    return null;
 end
-$$ language plpgsql;
+$$ language plpgsql set plan_cache_mode = force_generic_plan;
 
 create or replace function check_transaction_revisions_change_per_user(
     transaction_id integer,
@@ -226,8 +219,13 @@ begin
 end
 $$ language plpgsql;
 
-alter table transaction_revision add constraint check_committed_transactions
-    check (check_committed_transactions(id, transaction_id, started, committed));
+-- deferrable such that bulk loading can insert committed revisions before their contents
+create constraint trigger check_committed_transactions
+    after insert or update of committed
+    on transaction_revision
+    deferrable initially immediate
+    for each row
+execute function check_committed_transactions();
 alter table transaction_revision add constraint check_transaction_revisions_change_per_user
     check (check_transaction_revisions_change_per_user(transaction_id, user_id, committed));
 
@@ -399,63 +397,101 @@ alter table account_revision add constraint check_committed_accounts
 alter table account_revision add constraint check_account_revisions_change_per_user
     check (check_account_revisions_change_per_user(account_id, user_id, committed));
 
-create or replace function check_clearing_accounts_for_cyclic_dependencies(
-    revision_id bigint,
-    account_id integer,
-    committed timestamptz
-) returns boolean as
+-- replaces the edges of an account in the clearing account graph once one of its revisions is committed and checks
+-- that the account cannot reach itself via its new edges. as the graph is acyclic before the change only paths
+-- starting at the changed account can form a cycle. every change of the graph increments the graph version of the group.
+create or replace function check_clearing_accounts_for_cyclic_dependencies() returns trigger as
 $$
 <<locals>> declare
-    group_id          int;
-    account_type      text;
-
-    n_clearing_shares int;
-
-    cycle_path        int[];
+    group_id        int;
+    account_deleted boolean;
+    n_removed       int;
+    n_added         int := 0;
 begin
-    if committed is null then return true; end if;
+    if NEW.committed is null or (TG_OP = 'UPDATE' and OLD.committed is not null) then return null; end if;
 
     select
-        a.type,
+        ah.deleted,
         a.group_id
-    into locals.account_type, locals.group_id
+    into locals.account_deleted, locals.group_id
     from
-        account a
-    where a.id = check_clearing_accounts_for_cyclic_dependencies.account_id;
+        account_history ah
+        join account a on a.id = ah.id
+    where
+            ah.id = NEW.account_id
+        and ah.revision_id = NEW.id;
 
-    select
-        count(cas.share_account_id)
-    into locals.n_clearing_shares
+    if not found then return null; end if;
+
+    delete from clearing_account_edge cae where cae.account_id = NEW.account_id;
+    get diagnostics locals.n_removed = row_count;
+
+    if not locals.account_deleted then
+        insert into clearing_account_edge (account_id, share_account_id, shares)
+        select
+            cas.account_id,
+            cas.share_account_id,
+            cas.shares
+        from
+            clearing_account_share cas
+        where
+                cas.account_id = NEW.account_id
+            and cas.revision_id = NEW.id;
+        get diagnostics locals.n_added = row_count;
+    end if;
+
+    if locals.n_removed = 0 and locals.n_added = 0 then return null; end if;
+
+    -- locking the version of the graph serializes changes to the graph of a group, otherwise two concurrent changes
+    -- could each add half of a cycle
+    insert into clearing_account_graph (group_id)
+    values (locals.group_id)
+    on conflict on constraint clearing_account_graph_pkey do update set version = clearing_account_graph.version + 1;
+
+    if locals.n_added = 0 then return null; end if;
+
+    perform
     from
-        clearing_account_share cas
-    where
-            cas.account_id = check_clearing_accounts_for_cyclic_dependencies.account_id
-        and cas.revision_id = check_clearing_accounts_for_cyclic_dependencies.revision_id;
-
-    -- now for the juicy part - check if we have circular dependencies in clearing account relations
-    with recursive search_graph(account_id, share_account_id, depth, path, cycle) as (
-        select shares.account_id, shares.share_account_id, 1, array[shares.account_id], false
-        from clearing_account_share shares
-        where shares.revision_id = check_clearing_accounts_for_cyclic_dependencies.revision_id
-        union all
-        select shares.account_id, shares.share_account_id, sg.depth + 1, sg.path || shares.account_id, shares.account_id = any(sg.path)
-        from clearing_account_share shares
-        join account a on shares.account_id = a.id
-        join search_graph sg on sg.share_account_id = shares.account_id and not sg.cycle
-        where a.group_id = locals.group_id -- slight optimization for runtime
-                                                                                     )
-    select path into locals.cycle_path from search_graph where cycle limit 1;
-    -- TODO: good error message and print out all resulting cycles
+        (
+            with recursive reachable(account_id) as (
+                select
+                    cae.share_account_id
+                from
+                    clearing_account_edge cae
+                where
+                    cae.account_id = NEW.account_id
+                union
+                select
+                    cae.share_account_id
+                from
+                    clearing_account_edge cae
+                    join reachable r on cae.account_id = r.account_id
+                                                    )
+            select
+                1
+            from
+                reachable
+            where
+                reachable.account_id = NEW.account_id
+            limit 1
+        ) as cycle;
+
     if found then
-        raise 'this change would result in a cyclic dependency between clearing accounts: %', locals.cycle_path;
+        raise 'this change would result in a cyclic dependency between clearing accounts: account % can reach itself',
+            NEW.account_id;
     end if;
 
-    return true;
+    return null;
 end
 $$ language plpgsql;
 
-alter table account_revision add constraint account_revision_check_cyclic
-    check (check_clearing_accounts_for_cyclic_dependencies(id, account_id, committed));
+-- deferrable such that bulk loading can insert committed revisions before their contents
+create constraint trigger check_clearing_accounts_for_cyclic_dependencies
+    after insert or update of committed
+    on account_revision
+    deferrable initially immediate
+    for each row
+execute function check_clearing_accounts_for_cyclic_dependencies();
 
 alter table account_history add constraint name_not_empty check ( name <> '' );
 alter table transaction_history add constraint description_not_empty check ( description <> '' );
@@ -54,6 +54,24 @@ begin
 end
 $$ language plpgsql;
 
+-- to be called by a forwarder which re-booted after losing its database connection
+-- for each websocket client that is still connected to it.
+-- restores the row in the connection table under the previous connection id.
+create or replace procedure client_reconnected(
+    connection_id bigint, channel_id integer
+) as
+$$
+begin
+    insert into connection (
+        id, channel_id
+    )
+    values (
+        client_reconnected.connection_id, client_reconnected.channel_id
+    )
+    on conflict (id) do update set channel_id = excluded.channel_id;
+end
+$$ language plpgsql;
+
 -- to be called by a forwarder whenever a websocket connection is closed
 -- deletes the row in the connection table
 -- raises bad-connection-id if the connection has not existed
@@ -112,9 +130,13 @@ begin
                           where
                                   connection.id = any (notify_connections.connection_ids)
                           group by connection.channel_id loop
+        -- changed_at is the time of the changing database transaction, i.e. the last_changed of the changed rows,
+        -- in microseconds since the epoch. json timestamps drop trailing zeros of the fraction,
+        -- which python < 3.11 cannot parse.
         perform pg_notify(forwarder_info.channel_name,
                           json_build_object('connections', forwarder_info.connections, 'event', event, 'data',
-                                            data)::text);
+                                            data, 'changed_at',
+                                            (extract(epoch from now()) * 1000000)::bigint)::text);
     end loop;
 end
 $$ language plpgsql;
@@ -206,6 +228,106 @@ begin
 end
 $$ language plpgsql;
 
+-- subscribe user of given token to multiple notifications at once,
+-- subscription_types and element_ids are matched up pairwise.
+-- group membership is only checked once for all group scoped subscriptions.
+create or replace procedure subscribe_many(
+    connection_id bigint,
+    user_id integer,
+    subscription_types text[],
+    element_ids bigint[]
+) as
+$$
+<<locals>> declare
+    n_missing_groups integer;
+begin
+    if cardinality(subscribe_many.subscription_types) != cardinality(subscribe_many.element_ids) then
+        raise exception 'subscription_types and element_ids must have the same length';
+    end if;
+
+    if exists(select from unnest(subscribe_many.element_ids) e(element_id) where e.element_id is null) then
+        raise exception 'invalid element_id value';
+    end if;
+
+    if exists(
+        select
+        from unnest(subscribe_many.subscription_types) s(subscription_type)
+        where
+            s.subscription_type is null
+            or s.subscription_type not in (
+                'test', 'user', 'group', 'account', 'group_member', 'group_invite', 'group_log', 'transaction'
+            )
+    ) then
+        raise exception 'unknown subscription type';
+    end if;
+
+    if exists(
+        select
+        from unnest(subscribe_many.subscription_types, subscribe_many.element_ids) s(subscription_type, element_id)
+        where s.subscription_type in ('test', 'user', 'group') and s.element_id != subscribe_many.user_id
+    ) then
+        raise 'element_id not logged in user';
+    end if;
+
+    select
+        count(*)
+    into locals.n_missing_groups
+    from
+        (
+            select distinct
+                s.element_id
+            from
+                unnest(subscribe_many.subscription_types, subscribe_many.element_ids) s(subscription_type, element_id)
+            where
+                s.subscription_type in ('account', 'group_member', 'group_invite', 'group_log', 'transaction')
+        ) g
+        left join group_membership gm on gm.group_id = g.element_id and gm.user_id = subscribe_many.user_id
+    where
+        gm.user_id is null;
+
+    if locals.n_missing_groups > 0 then
+        raise 'user % tried to subscribe to changes in a group without being a member', subscribe_many.user_id;
+    end if;
+
+    insert into subscription (
+        connection_id, user_id, subscription_type, element_id
+    )
+    select distinct
+        subscribe_many.connection_id,
+        subscribe_many.user_id,
+        s.subscription_type,
+        s.element_id
+    from
+        unnest(subscribe_many.subscription_types, subscribe_many.element_ids) s(subscription_type, element_id)
+    on conflict on constraint subscription_conn_type_elem do update set user_id = subscribe_many.user_id;
+end
+$$ language plpgsql;
+
+-- unsubscribe user of given token from multiple notifications at once
+create or replace procedure unsubscribe_many(
+    connection_id bigint,
+    user_id integer,
+    subscription_types text[],
+    element_ids bigint[]
+) as
+$$
+begin
+    if cardinality(unsubscribe_many.subscription_types) != cardinality(unsubscribe_many.element_ids) then
+        raise exception 'subscription_types and element_ids must have the same length';
+    end if;
+
+    delete
+    from
+        subscription
+        using unnest(unsubscribe_many.subscription_types, unsubscribe_many.element_ids) s(subscription_type, element_id)
+    where
+            subscription.connection_id = unsubscribe_many.connection_id
+        and subscription.subscription_type = s.subscription_type
+        and subscription.element_id = s.element_id
+        and subscription.user_id = unsubscribe_many.user_id;
+end
+$$ language plpgsql;
+
 -- deliver a notification of given type
 -- to all subscribers
 create or replace procedure notify_user(
@@ -342,6 +464,59 @@ where
     or pending_details.json_state is not null
 $$;
 
+-- the committed state of the accounts of a group at a point in time, looked up via the validity ranges of the account
+-- history instead of aggregating the whole history. has the same shape as full_account_state_valid_at.
+create or replace function committed_account_state_of_group_at(
+    group_id integer, valid_at timestamp with time zone
+)
+    returns TABLE (
+        account_id        integer,
+        type              text,
+        group_id          integer,
+        last_changed      timestamptz,
+        is_wip            boolean,
+        committed_details jsonb,
+        pending_details   jsonb
+    )
+    stable
+    language sql
+as
+$$
+select
+    a.id                               as account_id,
+    a.type,
+    a.group_id,
+    ar.last_changed,
+    false                              as is_wip,
+    jsonb_build_array(to_jsonb(state)) as committed_details,
+    null::jsonb                        as pending_details
+from
+    account_state_validity v
+    join account a on a.id = v.account_id
+    join account_revision ar on ar.id = v.revision_id
+    cross join lateral (
+        select
+            ah.name,
+            ah.description,
+            ah.owning_user_id,
+            ah.date_info,
+            ah.deleted,
+            coalesce(cas.shares, '[]'::jsonb)               as clearing_shares,
+            coalesce(tt.tag_names, array []::varchar(255)[]) as tags
+        from
+            account_history ah
+            left join clearing_account_shares_as_json cas
+                on cas.account_id = ah.id and cas.revision_id = ah.revision_id
+            left join account_tags tt on tt.account_id = ah.id and tt.revision_id = ah.revision_id
+        where
+                ah.id = v.account_id
+            and ah.revision_id = v.revision_id
+        ) state
+where
+        v.group_id = committed_account_state_of_group_at.group_id
+    and v.valid_during @> committed_account_state_of_group_at.valid_at
+$$;
+
 create or replace function committed_file_state_valid_at(
     valid_at timestamp with time zone DEFAULT now()
 )
@@ -596,3 +771,129 @@ where
     committed_details.json_state is not null
     or pending_details.json_state is not null
 $$;
+
+-- the committed state of the transactions of a group at a point in time, looked up via the validity ranges of the
+-- transaction and position history instead of aggregating the whole history. files have no validity ranges, their
+-- latest committed revision is looked up among the files of the group. has the same shape as
+-- full_transaction_state_valid_at.
+create or replace function committed_transaction_state_of_group_at(
+    group_id integer, valid_at timestamp with time zone
+)
+    returns TABLE (
+        transaction_id      integer,
+        type                text,
+        group_id            integer,
+        last_changed        timestamp with time zone,
+        is_wip              boolean,
+        committed_details   jsonb,
+        pending_details     jsonb,
+        committed_positions jsonb,
+        pending_positions   jsonb,
+        committed_files     jsonb,
+        pending_files       jsonb
+    )
+    stable
+    language sql
+as
+$$
+select
+    t.id                                                                       as transaction_id,
+    t.type,
+    t.group_id,
+    greatest(tr.last_changed, positions.last_changed, files.last_changed)     as last_changed,
+    false                                                                      as is_wip,
+    jsonb_build_array(to_jsonb(details))                                       as committed_details,
+    null::jsonb                                                                as pending_details,
+    positions.json_state                                                       as committed_positions,
+    null::jsonb                                                                as pending_positions,
+    files.json_state                                                           as committed_files,
+    null::jsonb                                                                as pending_files
+from
+    transaction_state_validity v
+    join transaction t on t.id = v.transaction_id
+    join transaction_revision tr on tr.id = v.revision_id
+    cross join lateral (
+        select
+            th.name,
+            th.description,
+            th.value,
+            th.currency_symbol,
+            th.currency_conversion_rate,
+            th.billed_at,
+            th.deleted,
+            coalesce(csaj.shares, '[]'::jsonb)               as creditor_shares,
+            coalesce(dsaj.shares, '[]'::jsonb)               as debitor_shares,
+            coalesce(tt.tag_names, array []::varchar(255)[]) as tags
+        from
+            transaction_history th
+            left join creditor_shares_as_json csaj
+                on csaj.transaction_id = th.id and csaj.revision_id = th.revision_id
+            left join debitor_shares_as_json dsaj
+                on dsaj.transaction_id = th.id and dsaj.revision_id = th.revision_id
+            left join transaction_tags tt on tt.transaction_id = th.id and tt.revision_id = th.revision_id
+        where
+                th.id = v.transaction_id
+            and th.revision_id = v.revision_id
+        ) details
+    left join (
+        select
+            pv.transaction_id,
+            jsonb_agg(position_state) as json_state,
+            max(ptr.last_changed)     as last_changed
+        from
+            purchase_item_state_validity pv
+            join transaction_revision ptr on ptr.id = pv.revision_id
+            cross join lateral (
+                select
+                    pih.id                            as item_id,
+                    pih.name,
+                    pih.price,
+                    pih.communist_shares,
+                    pih.deleted,
+                    coalesce(piu.usages, '[]'::jsonb) as usages
+                from
+                    purchase_item_history pih
+                    left join purchase_item_usages_as_json piu
+                        on piu.item_id = pih.id and piu.revision_id = pih.revision_id
+                where
+                        pih.id = pv.item_id
+                    and pih.revision_id = pv.revision_id
+                ) position_state
+        where
+                pv.group_id = committed_transaction_state_of_group_at.group_id
+            and pv.valid_during @> committed_transaction_state_of_group_at.valid_at
+        group by pv.transaction_id
+              ) positions on positions.transaction_id = t.id
+    left join (
+        select
+            file_state.transaction_id,
+            jsonb_agg(file_state)        as json_state,
+            max(file_state.last_changed) as last_changed
+        from
+            (
+                select distinct on (fh.id)
+                    fh.id            as file_id,
+                    f.transaction_id,
+                    ftr.last_changed,
+                    fh.filename,
+                    blob.mime_type,
+                    fh.blob_id,
+                    fh.deleted
+                from
+                    file f
+                    join transaction ft on ft.id = f.transaction_id
+                    join file_history fh on fh.id = f.id
+                    join transaction_revision ftr on ftr.id = fh.revision_id
+                    left join blob on blob.id = fh.blob_id
+                where
+                        ft.group_id = committed_transaction_state_of_group_at.group_id
+                    and ftr.committed <= committed_transaction_state_of_group_at.valid_at
+                order by
+                    fh.id, ftr.committed desc
+            ) file_state
+        group by file_state.transaction_id
+              ) files on files.transaction_id = t.id
+where
+        v.group_id = committed_transaction_state_of_group_at.group_id
+    and v.valid_during @> committed_transaction_state_of_group_at.valid_at
+$$;
@@ -0,0 +1,25 @@
+-- revision: 04b1dae7
+-- requires: ee5d2b35
+
+-- mails which have been rendered by the mailer and are waiting to be delivered.
+-- pending mails are claimed by a mailer instance by advancing their next_attempt_at,
+-- such that multiple mailer instances can drain the outbox concurrently.
+create table if not exists mail_outbox (
+    id              bigserial primary key,
+    created_at      timestamptz not null default now(),
+
+    dest_address    text        not null,
+    dest_name       text        not null,
+    subject         text        not null,
+    body            text        not null,
+
+    -- number of delivery attempts so far
+    attempts        integer     not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    last_error      text,
+
+    -- if not NULL the mail has been delivered successfully
+    sent_at         timestamptz
+);
+
+create index mail_outbox_pending_idx on mail_outbox (next_attempt_at) where sent_at is null;
@@ -0,0 +1,13 @@
+-- revision: aadcb4a1
+-- requires: 04b1dae7
+
+-- the group activity a user has already been notified about by the periodic digest mail.
+-- the next digest of a user covers everything that happened in their groups after last_digest_at.
+create table if not exists group_digest_state (
+    user_id        integer     not null primary key references usr (id) on delete cascade,
+    last_digest_at timestamptz not null default now()
+);
+
+-- digests only scan the log entries and transaction revisions since the last digest
+create index group_log_group_id_logged_at_idx on group_log (group_id, logged_at);
+create index transaction_revision_committed_idx on transaction_revision (committed) where committed is not null;
@@ -0,0 +1,2 @@
+-- revision: 8c831627
+-- requires: aadcb4a1
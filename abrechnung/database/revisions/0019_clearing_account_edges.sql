@@ -0,0 +1,33 @@
+-- revision: 9ef2d556
+-- requires: 8c831627
+
+-- the clearing shares of the latest committed revision of every clearing account which is not deleted, i.e. the
+-- current graph of clearing accounts distributing to other accounts. maintained when account revisions are committed
+-- such that cycles can be detected by only following the edges reachable from a changed account.
+create table if not exists clearing_account_edge (
+    account_id       integer not null references account (id) on delete cascade,
+    share_account_id integer not null references account (id) on delete cascade,
+    primary key (account_id, share_account_id)
+);
+
+insert into clearing_account_edge (account_id, share_account_id)
+select
+    cas.account_id,
+    cas.share_account_id
+from
+    (
+        select distinct on (ar.account_id)
+            ar.account_id,
+            ar.id as revision_id,
+            ah.deleted
+        from
+            account_revision ar
+            join account_history ah on ah.id = ar.account_id and ah.revision_id = ar.id
+        where
+            ar.committed is not null
+        order by
+            ar.account_id, ar.committed desc
+    ) latest
+    join clearing_account_share cas on cas.account_id = latest.account_id and cas.revision_id = latest.revision_id
+where
+    not latest.deleted;
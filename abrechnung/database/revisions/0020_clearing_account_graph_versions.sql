@@ -0,0 +1,34 @@
+-- revision: ee364ffe
+-- requires: 9ef2d556
+
+-- the clearing account graph includes the shares of each edge such that clearing accounts can be resolved from it
+alter table clearing_account_edge add column if not exists shares double precision;
+
+update clearing_account_edge cae
+set
+    shares = cas.shares
+from
+    (
+        select distinct on (ar.account_id)
+            ar.account_id,
+            ar.id as revision_id
+        from
+            account_revision ar
+            join account_history ah on ah.id = ar.account_id and ah.revision_id = ar.id
+        where
+            ar.committed is not null
+        order by
+            ar.account_id, ar.committed desc
+    ) latest
+    join clearing_account_share cas on cas.account_id = latest.account_id and cas.revision_id = latest.revision_id
+where
+        cae.account_id = cas.account_id
+    and cae.share_account_id = cas.share_account_id;
+
+alter table clearing_account_edge alter column shares set not null;
+
+-- incremented whenever the clearing account graph of a group changes, allows caching values derived from the graph
+create table if not exists clearing_account_graph (
+    group_id integer not null primary key references grp (id) on delete cascade,
+    version  bigint  not null default 1
+);
@@ -0,0 +1,82 @@
+-- revision: 9bda69b3
+-- requires: ee364ffe
+
+-- the time range during which a committed history row is the current state of its transaction, position or account,
+-- from the commit of its revision until the commit of the next revision with a history row of the same object.
+-- the state of a group at any point in time is then a lookup of the ranges containing it instead of aggregating the
+-- whole history. kept in separate tables as updating the history tables triggers change notifications.
+create table if not exists transaction_state_validity (
+    transaction_id integer   not null references transaction (id) on delete cascade,
+    revision_id    bigint    not null references transaction_revision (id) on delete cascade,
+    primary key (transaction_id, revision_id),
+    group_id       integer   not null references grp (id) on delete cascade,
+    valid_during   tstzrange not null
+);
+
+create index transaction_state_validity_group_id_idx on transaction_state_validity (group_id);
+
+create table if not exists purchase_item_state_validity (
+    item_id        integer   not null references purchase_item (id) on delete cascade,
+    revision_id    bigint    not null references transaction_revision (id) on delete cascade,
+    primary key (item_id, revision_id),
+    transaction_id integer   not null references transaction (id) on delete cascade,
+    group_id       integer   not null references grp (id) on delete cascade,
+    valid_during   tstzrange not null
+);
+
+create index purchase_item_state_validity_transaction_id_idx on purchase_item_state_validity (transaction_id);
+create index purchase_item_state_validity_group_id_idx on purchase_item_state_validity (group_id);
+
+create table if not exists account_state_validity (
+    account_id   integer   not null references account (id) on delete cascade,
+    revision_id  bigint    not null references account_revision (id) on delete cascade,
+    primary key (account_id, revision_id),
+    group_id     integer   not null references grp (id) on delete cascade,
+    valid_during tstzrange not null
+);
+
+create index account_state_validity_group_id_idx on account_state_validity (group_id);
+
+-- the validity ranges of an object are recomputed from its committed revisions in commit order
+create index transaction_revision_transaction_id_committed_idx on transaction_revision (transaction_id, committed desc);
+create index account_revision_account_id_committed_idx on account_revision (account_id, committed desc);
+
+insert into transaction_state_validity (transaction_id, revision_id, group_id, valid_during)
+select
+    th.id,
+    th.revision_id,
+    t.group_id,
+    tstzrange(tr.committed, lead(tr.committed) over (partition by th.id order by tr.committed, tr.id))
+from
+    transaction_history th
+    join transaction_revision tr on tr.id = th.revision_id
+    join transaction t on t.id = th.id
+where
+    tr.committed is not null;
+
+insert into purchase_item_state_validity (item_id, revision_id, transaction_id, group_id, valid_during)
+select
+    pih.id,
+    pih.revision_id,
+    t.id,
+    t.group_id,
+    tstzrange(tr.committed, lead(tr.committed) over (partition by pih.id order by tr.committed, tr.id))
+from
+    purchase_item_history pih
+    join transaction_revision tr on tr.id = pih.revision_id
+    join transaction t on t.id = tr.transaction_id
+where
+    tr.committed is not null;
+
+insert into account_state_validity (account_id, revision_id, group_id, valid_during)
+select
+    ah.id,
+    ah.revision_id,
+    a.group_id,
+    tstzrange(ar.committed, lead(ar.committed) over (partition by ah.id order by ar.committed, ar.id))
+from
+    account_history ah
+    join account_revision ar on ar.id = ah.revision_id
+    join account a on a.id = ah.id
+where
+    ar.committed is not null;
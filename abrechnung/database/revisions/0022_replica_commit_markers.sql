@@ -0,0 +1,11 @@
+-- revision: b96a5d7d
+-- requires: 9bda69b3
+
+-- the write ahead log position of the last transaction made with a session. the row is written as part of the
+-- transaction itself, a replica which shows at least the position the primary showed when the session was last checked
+-- has replayed all changes made with the session. used to route reads of a session to replicas which already see its
+-- writes. kept separate from the session table as changes to sessions trigger notifications.
+create table if not exists session_last_commit (
+    session_id integer primary key references session (id) on delete cascade,
+    commit_lsn pg_lsn not null
+);
@@ -0,0 +1,32 @@
+-- revision: c3f7f40b
+-- requires: b96a5d7d
+
+-- the state of a group at a point in time is looked up by group and validity range. btree_gist allows to index both
+-- together, it is part of the postgres contrib modules which most distributions ship with the server. if it is not
+-- available the validity ranges are at least indexed on their own.
+do
+$$
+    begin
+        if exists(select from pg_available_extensions where name = 'btree_gist') then
+            create extension if not exists btree_gist;
+
+            create index transaction_state_validity_group_id_valid_during_idx
+                on transaction_state_validity using gist (group_id, valid_during);
+            create index purchase_item_state_validity_group_id_valid_during_idx
+                on purchase_item_state_validity using gist (group_id, valid_during);
+            create index account_state_validity_group_id_valid_during_idx
+                on account_state_validity using gist (group_id, valid_during);
+
+            drop index transaction_state_validity_group_id_idx;
+            drop index purchase_item_state_validity_group_id_idx;
+            drop index account_state_validity_group_id_idx;
+        else
+            create index transaction_state_validity_valid_during_idx
+                on transaction_state_validity using gist (valid_during);
+            create index purchase_item_state_validity_valid_during_idx
+                on purchase_item_state_validity using gist (valid_during);
+            create index account_state_validity_valid_during_idx
+                on account_state_validity using gist (valid_during);
+        end if;
+    end
+$$;
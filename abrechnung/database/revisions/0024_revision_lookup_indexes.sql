@@ -0,0 +1,10 @@
+-- revision: f2224e1c
+-- requires: c3f7f40b
+
+-- the purchase items of a revision are looked up by the transaction commit checks and the validity ranges of a commit
+-- by transaction and revision id alone, and discarding a pending change deletes the history of its revision via the
+-- revision_id foreign keys. without these indexes each of these scans all purchase items or history rows ever created.
+-- databases which applied an earlier version of revision 8c831627 already have them.
+create index if not exists transaction_history_revision_id_idx on transaction_history (revision_id);
+create index if not exists purchase_item_transaction_id_idx on purchase_item (transaction_id);
+create index if not exists purchase_item_history_revision_id_idx on purchase_item_history (revision_id);
@@ -0,0 +1,10 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class AccountBalance:
+    account_id: int
+    # what the account paid for others minus what it consumed
+    balance: float
+    total_paid: float
+    total_consumed: float
@@ -1,5 +1,7 @@
 import asyncio
 import contextlib
+import contextvars
+import functools
 import json
 import logging
 import os
@@ -7,6 +9,9 @@ import re
 import shutil
 import ssl
 import tempfile
+import time
+from dataclasses import dataclass
+from datetime import timedelta
 from pathlib import Path
 from typing import Literal, Optional, Type, TypeVar, Union
 
@@ -14,6 +19,7 @@ import asyncpg
 from pydantic import BaseModel
 
 from abrechnung import util
+from abrechnung.framework.metrics import query_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +28,25 @@ REVISION_REQUIRES_RE = re.compile(r"^-- requires: (?P<version>\w+)$")
 REVISION_TABLE = "schema_revision"
 
 
+class PoolConfig(BaseModel):
+    min_size: int = 10
+    max_size: int = 10
+    # number of prepared statements cached per connection, 0 disables the cache
+    statement_cache_size: int = 100
+    # connections are replaced after executing this many queries
+    max_queries: int = 50000
+    # idle connections above min_size are closed after this long
+    max_inactive_connection_lifetime: timedelta = timedelta(minutes=5)
+    # default timeout of single queries, no timeout if not set
+    command_timeout: Optional[timedelta] = None
+
+
+class ReplicaConfig(BaseModel):
+    # all other connection parameters are the same as for the primary
+    host: str
+    port: int = 5432
+
+
 class DatabaseConfig(BaseModel):
     user: Optional[str] = None
     password: Optional[str] = None
@@ -30,6 +55,14 @@ class DatabaseConfig(BaseModel):
     dbname: str
     require_ssl: bool = False
     sslrootcert: Optional[str] = None
+    pool: PoolConfig = PoolConfig()
+    # separate pool for read only queries, e.g. list endpoints, such that they cannot starve write transactions.
+    # if not set reads share the main pool
+    read_pool: Optional[PoolConfig] = None
+    # streaming replicas of the database which serve read only queries, each gets its own read pool
+    replicas: list[ReplicaConfig] = []
+    # queries which take longer than this are logged together with the service method which issued them
+    slow_query_threshold: Optional[timedelta] = timedelta(seconds=1)
 
 
 async def psql_attach(config: DatabaseConfig):
@@ -348,7 +381,62 @@ async def apply_revisions(
 T = TypeVar("T", bound=BaseModel)
 
 
+def _rows_from_status(status: str) -> int:
+    """number of affected rows from a command status like INSERT 0 3 or UPDATE 2"""
+    count = status.rsplit(" ", 1)[-1]
+    return int(count) if count.isdigit() else 0
+
+
 class Connection(asyncpg.Connection):
+    """connection which records the duration and row count of all its queries in the query metrics"""
+
+    # in seconds, set from the database config when the connection is initialized
+    slow_query_threshold: Optional[float] = None
+
+    async def execute(self, query: str, *args, timeout: Optional[float] = None) -> str:
+        with query_metrics.measure(query, self.slow_query_threshold) as measurement:
+            status = await super().execute(query, *args, timeout=timeout)
+            measurement.rows = _rows_from_status(status)
+            return status
+
+    async def executemany(self, command: str, args, *, timeout: Optional[float] = None):
+        with query_metrics.measure(command, self.slow_query_threshold):
+            return await super().executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout=None, record_class=None) -> list:
+        with query_metrics.measure(query, self.slow_query_threshold) as measurement:
+            result = await super().fetch(
+                query, *args, timeout=timeout, record_class=record_class
+            )
+            measurement.rows = len(result)
+            return result
+
+    async def fetchrow(self, query: str, *args, timeout=None, record_class=None):
+        with query_metrics.measure(query, self.slow_query_threshold) as measurement:
+            result = await super().fetchrow(
+                query, *args, timeout=timeout, record_class=record_class
+            )
+            measurement.rows = int(result is not None)
+            return result
+
+    async def fetchval(self, query: str, *args, column=0, timeout=None):
+        with query_metrics.measure(query, self.slow_query_threshold) as measurement:
+            result = await super().fetchval(
+                query, *args, column=column, timeout=timeout
+            )
+            measurement.rows = int(result is not None)
+            return result
+
+    async def copy_records_to_table(self, table_name: str, *, records, **kwargs) -> str:
+        with query_metrics.measure(
+            f"copy {table_name} from stdin", self.slow_query_threshold
+        ) as measurement:
+            status = await super().copy_records_to_table(
+                table_name, records=records, **kwargs
+            )
+            measurement.rows = _rows_from_status(status)
+            return status
+
     async def fetch_one(self, model: Type[T], query: str, *args) -> T:
         result: Optional[asyncpg.Record] = await self.fetchrow(query, *args)
         if result is None:
@@ -369,48 +457,197 @@ class Connection(asyncpg.Connection):
         return [model.model_validate(dict(r)) for r in results]
 
 
-async def init_connection(conn: Connection):
+async def init_connection(conn: Connection, cfg: Optional[DatabaseConfig] = None):
+    if cfg is not None and cfg.slow_query_threshold is not None:
+        conn.slow_query_threshold = cfg.slow_query_threshold.total_seconds()
     await conn.set_type_codec(
         "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
     )
 
 
-async def create_db_pool(cfg: DatabaseConfig, n_connections=10) -> asyncpg.Pool:
+def _get_ssl_context(
+    cfg: DatabaseConfig,
+) -> Union[ssl.SSLContext, Literal["verify-full", "prefer"]]:
+    if cfg.sslrootcert and cfg.require_ssl:
+        sslctx = ssl.create_default_context(
+            ssl.Purpose.SERVER_AUTH,
+            cafile=cfg.sslrootcert,
+        )
+        sslctx.check_hostname = True
+        return sslctx
+
+    return "verify-full" if cfg.require_ssl else "prefer"
+
+
+async def create_db_connection(cfg: DatabaseConfig) -> Connection:
+    """
+    get a single database connection which is not managed by a pool,
+    e.g. for long-lived connections which LISTEN on notification channels
+    """
+    conn = await asyncpg.connect(
+        user=cfg.user,
+        password=cfg.password,
+        database=cfg.dbname,
+        host=cfg.host,
+        port=cfg.port,
+        connection_class=Connection,
+        ssl=_get_ssl_context(cfg),
+        server_settings={"jit": "off"},
+    )
+    await init_connection(conn, cfg)
+    return conn
+
+
+# upper bounds in seconds of the buckets of the pool acquire latency histogram
+ACQUIRE_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+@dataclass
+class PoolMetrics:
+    size: int
+    max_size: int
+    idle: int
+    in_use: int
+    # number of tasks currently waiting for a connection
+    waiting: int
+    acquire_count: int
+    acquire_latency_sum: float
+    # cumulative counts of acquires which took at most the given number of seconds, in the style of prometheus
+    acquire_latency_buckets: dict[float, int]
+
+
+class MetricsPool:
+    """
+    connection pool which keeps track of its utilization to help sizing it.
+    wraps an asyncpg pool, everything apart from acquiring connections is passed through to it.
+    """
+
+    def __init__(self, pool: asyncpg.Pool):
+        self._pool = pool
+        self._n_waiting = 0
+        self._acquire_count = 0
+        self._acquire_latency_sum = 0.0
+        # the last bucket counts the acquires slower than the largest bucket bound
+        self._acquire_latency_counts = [0] * (len(ACQUIRE_LATENCY_BUCKETS) + 1)
+
+    def __getattr__(self, name: str):
+        return getattr(self._pool, name)
+
+    def acquire(self, *, timeout: Optional[float] = None) -> "_MetricsAcquireContext":
+        return _MetricsAcquireContext(self, timeout)
+
+    async def _acquire_connection(self, timeout: Optional[float]) -> asyncpg.Connection:
+        # only acquires finding neither an idle connection nor room for a new one wait for a connection to be released
+        waits = (
+            self._pool.get_idle_size() == 0
+            and self._pool.get_size() >= self._pool.get_max_size()
+        )
+        start = time.perf_counter()
+        if waits:
+            self._n_waiting += 1
+        try:
+            return await self._pool.acquire(timeout=timeout)
+        finally:
+            if waits:
+                self._n_waiting -= 1
+            self._observe_acquire(time.perf_counter() - start)
+
+    def _observe_acquire(self, latency: float):
+        self._acquire_count += 1
+        self._acquire_latency_sum += latency
+        for i, bound in enumerate(ACQUIRE_LATENCY_BUCKETS):
+            if latency <= bound:
+                self._acquire_latency_counts[i] += 1
+                return
+        self._acquire_latency_counts[-1] += 1
+
+    def metrics(self) -> PoolMetrics:
+        size = self.get_size()
+        idle = self.get_idle_size()
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(ACQUIRE_LATENCY_BUCKETS, self._acquire_latency_counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return PoolMetrics(
+            size=size,
+            max_size=self.get_max_size(),
+            idle=idle,
+            in_use=size - idle,
+            waiting=self._n_waiting,
+            acquire_count=self._acquire_count,
+            acquire_latency_sum=self._acquire_latency_sum,
+            acquire_latency_buckets=buckets,
+        )
+
+
+class _MetricsAcquireContext:
+    """like the context returned by asyncpg.Pool.acquire, can be awaited or used as an async context manager"""
+
+    def __init__(self, pool: MetricsPool, timeout: Optional[float]):
+        self.pool = pool
+        self.timeout = timeout
+        self.connection: Optional[asyncpg.Connection] = None
+
+    async def __aenter__(self) -> asyncpg.Connection:
+        self.connection = await self.pool._acquire_connection(self.timeout)
+        return self.connection
+
+    async def __aexit__(self, *exc):
+        connection, self.connection = self.connection, None
+        await self.pool.release(connection)
+
+    def __await__(self):
+        return self.pool._acquire_connection(self.timeout).__await__()
+
+
+async def create_db_pool(
+    cfg: DatabaseConfig,
+    n_connections: Optional[int] = None,
+    pool_config: Optional[PoolConfig] = None,
+) -> MetricsPool:
     """
-    get a connection pool to the database
+    get a connection pool to the database, sized according to pool_config which defaults to the main pool config.
+    n_connections overrides the pool size for pools with a fixed number of connections.
     """
+    pool_config = pool_config or cfg.pool
+    min_size = pool_config.min_size if n_connections is None else n_connections
+    max_size = pool_config.max_size if n_connections is None else n_connections
+    command_timeout = (
+        pool_config.command_timeout.total_seconds()
+        if pool_config.command_timeout is not None
+        else None
+    )
+
     pool = None
 
     retry_counter = 0
     next_log_at_retry = 0
     while pool is None:
         try:
-            sslctx: Optional[Union[ssl.SSLContext, Literal["verify-full", "prefer"]]]
-            if cfg.sslrootcert and cfg.require_ssl:
-                sslctx = ssl.create_default_context(
-                    ssl.Purpose.SERVER_AUTH,
-                    cafile=cfg.sslrootcert,
-                )
-                sslctx.check_hostname = True
-            else:
-                sslctx = "verify-full" if cfg.require_ssl else "prefer"
-
             pool = await asyncpg.create_pool(
                 user=cfg.user,
                 password=cfg.password,
                 database=cfg.dbname,
                 host=cfg.host,
-                max_size=n_connections,
+                port=cfg.port,
+                min_size=min_size,
+                max_size=max_size,
+                max_queries=pool_config.max_queries,
+                max_inactive_connection_lifetime=pool_config.max_inactive_connection_lifetime.total_seconds(),
+                statement_cache_size=pool_config.statement_cache_size,
+                command_timeout=command_timeout,
                 connection_class=Connection,
-                min_size=n_connections,
-                ssl=sslctx,
+                record_class=asyncpg.Record,
+                loop=None,
+                ssl=_get_ssl_context(cfg),
                 # the introspection query of asyncpg (defined as introspection.INTRO_LOOKUP_TYPES)
                 # can take 1s with the jit.
                 # the introspection is triggered to create converters for unknown types,
                 # for example the integer[] (oid = 1007).
                 # see https://github.com/MagicStack/asyncpg/issues/530
                 server_settings={"jit": "off"},
-                init=init_connection,
+                init=functools.partial(init_connection, cfg=cfg),
             )
         except Exception as e:  # pylint: disable=broad-except
             sleep_amount = 10
@@ -423,4 +660,99 @@ async def create_db_pool(cfg: DatabaseConfig, n_connections=10) -> asyncpg.Pool:
             next_log_at_retry = min(retry_counter * 2, 2**9)
             await asyncio.sleep(sleep_amount)
 
-    return pool
+    return MetricsPool(pool)
+
+
+@dataclass
+class SessionCommit:
+    """the session a request is made with and the wal position of the last transaction written with it"""
+
+    session_id: int
+    commit_lsn: Optional[int] = None
+
+
+# set once the session of a request is authenticated, used to route the reads of the request to up to date replicas
+current_session_commit: contextvars.ContextVar[Optional[SessionCommit]] = (
+    contextvars.ContextVar("current_session_commit", default=None)
+)
+
+
+class ReplicaRouter:
+    """
+    distributes read only queries over the read pools of the database replicas.
+
+    to make sure users see their own changes every transaction which wrote something records the write ahead log
+    position of the primary for the session it was made with. the position is looked up together with the session when
+    authenticating a request, reads of the request skip replicas which do not show this position yet. if no replica is
+    up to date the read falls back to the primary.
+    """
+
+    def __init__(self, primary: asyncpg.Pool, replicas: list[asyncpg.Pool]):
+        self.primary = primary
+        self.replicas = replicas
+        self._next_replica = 0
+
+    @staticmethod
+    async def record_commit(
+        conn: asyncpg.Connection, session_commit: Optional[SessionCommit]
+    ) -> Optional[int]:
+        """
+        mark the session as having written in the current transaction, if the transaction wrote anything.
+        has to be called as the last statement of the transaction, returns the recorded wal position.
+        """
+        if session_commit is None:
+            return None
+        # the wal position is read again once the row lock is held as concurrent writers wait for each other's commit
+        return await conn.fetchval(
+            "insert into session_last_commit (session_id, commit_lsn) "
+            "select s.id, pg_current_wal_lsn() from session s "
+            "where s.id = $1 and txid_current_if_assigned() is not null "
+            "on conflict (session_id) do update set commit_lsn = pg_current_wal_lsn() "
+            "returning commit_lsn",
+            session_commit.session_id,
+        )
+
+    async def _acquire_replica(
+        self, session_commit: Optional[SessionCommit]
+    ) -> tuple[Optional[asyncpg.Pool], Optional[asyncpg.Connection]]:
+        for _ in range(len(self.replicas)):
+            pool = self.replicas[self._next_replica]
+            self._next_replica = (self._next_replica + 1) % len(self.replicas)
+            try:
+                conn = await pool.acquire()
+            except (OSError, asyncpg.PostgresConnectionError) as e:
+                logger.warning(f"Failed to acquire a replica connection: {e}")
+                continue
+
+            if session_commit is None or session_commit.commit_lsn is None:
+                return pool, conn
+            try:
+                replayed = await conn.fetchval(
+                    "select coalesce((select commit_lsn from session_last_commit where session_id = $1) >= $2::pg_lsn, "
+                    "       false)",
+                    session_commit.session_id,
+                    session_commit.commit_lsn,
+                )
+            except BaseException:
+                await pool.release(conn)
+                raise
+            if replayed:
+                return pool, conn
+            await pool.release(conn)
+
+        return None, None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, session_commit: Optional[SessionCommit] = None):
+        pool, conn = await self._acquire_replica(session_commit)
+        if conn is None:
+            pool = self.primary
+            conn = await pool.acquire()
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    async def close(self):
+        for pool in self.replicas:
+            await pool.close()
@@ -1,14 +1,18 @@
-from functools import wraps
+from functools import partial, wraps
+
+from abrechnung.framework.database import current_session_commit
+from abrechnung.framework.metrics import query_metrics
 
 
 def with_db_connection(func):
     @wraps(func)
     async def wrapper(self, **kwargs):
-        if "conn" in kwargs:
-            return await func(self, **kwargs)
+        with query_metrics.service_method(func.__qualname__):
+            if "conn" in kwargs:
+                return await func(self, **kwargs)
 
-        async with self.db_pool.acquire() as conn:
-            return await func(self, conn=conn, **kwargs)
+            async with self.db_pool.acquire() as conn:
+                return await func(self, conn=conn, **kwargs)
 
     return wrapper
 
@@ -16,11 +20,51 @@ def with_db_connection(func):
 def with_db_transaction(func):
     @wraps(func)
     async def wrapper(self, **kwargs):
-        if "conn" in kwargs:
-            return await func(self, **kwargs)
+        with query_metrics.service_method(func.__qualname__):
+            if "conn" in kwargs:
+                return await func(self, **kwargs)
 
-        async with self.db_pool.acquire() as conn:
-            async with conn.transaction():
-                return await func(self, conn=conn, **kwargs)
+            async with self.db_pool.acquire() as conn:
+                session_commit = current_session_commit.get()
+                commit_lsn = None
+                async with conn.transaction():
+                    result = await func(self, conn=conn, **kwargs)
+                    if self.replica_router is not None:
+                        commit_lsn = await self.replica_router.record_commit(
+                            conn, session_commit
+                        )
+                if commit_lsn is not None:
+                    # later reads of the same request have to see this commit as well
+                    session_commit.commit_lsn = commit_lsn
+                return result
+
+    return wrapper
+
+
+def with_db_read_connection(func=None, *, snapshot: bool = False):
+    """
+    provide a connection from the read pool or a replica, for methods which only read data.
+
+    queries run without an explicit transaction to save the BEGIN / COMMIT round trips, methods which need a consistent
+    view across several queries can request a read only repeatable read snapshot with snapshot=True.
+    """
+    if func is None:
+        return partial(with_db_read_connection, snapshot=snapshot)
+
+    @wraps(func)
+    async def wrapper(self, **kwargs):
+        with query_metrics.service_method(func.__qualname__):
+            if "conn" in kwargs:
+                return await func(self, **kwargs)
+
+            if self.replica_router is not None:
+                acquire = self.replica_router.acquire(current_session_commit.get())
+            else:
+                acquire = self.read_db_pool.acquire()
+            async with acquire as conn:
+                if not snapshot:
+                    return await func(self, conn=conn, **kwargs)
+                async with conn.transaction(isolation="repeatable_read", readonly=True):
+                    return await func(self, conn=conn, **kwargs)
 
     return wrapper
@@ -0,0 +1,185 @@
+"""
+Detection of code which blocks the event loop.
+
+The LoopLagMonitor continuously measures how late the event loop wakes up a sleeping task, a lag well above zero means
+that something hogs the loop, e.g. blocking calls or cpu heavy work. The BlockingCallWatchdog pinpoints the culprit
+by logging the stack of the event loop thread whenever the loop did not run for longer than a threshold.
+"""
+
+import asyncio
+import collections
+import contextlib
+import logging
+import sys
+import threading
+import time
+import traceback
+from datetime import timedelta
+from typing import Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+LAG_QUANTILES = (0.5, 0.9, 0.99, 1.0)
+
+
+class MonitoringConfig(BaseModel):
+    # interval in which the api and the mailer measure how late their event loop wakes up a sleeping task
+    loop_lag_sample_interval: timedelta = timedelta(milliseconds=250)
+    # lag percentiles are computed over this many recent measurements
+    loop_lag_samples: int = 1200
+    # interval in which the lag percentiles are logged, never if not set
+    loop_lag_report_interval: Optional[timedelta] = timedelta(minutes=5)
+    # in debug mode (-d) the stack of any code blocking the event loop for longer than this is logged
+    blocking_call_threshold: timedelta = timedelta(milliseconds=100)
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        sample_interval: float = 0.25,
+        n_samples: int = 1200,
+        report_interval: Optional[float] = None,
+    ):
+        """
+        :param sample_interval: seconds between two lag measurements
+        :param n_samples: number of recent measurements the percentiles are computed from
+        :param report_interval: if set the lag percentiles are logged in this interval in seconds
+        """
+        self.sample_interval = sample_interval
+        self.report_interval = report_interval
+        self._samples: collections.deque[float] = collections.deque(maxlen=n_samples)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        last_report = loop.time()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.sample_interval)
+            now = loop.time()
+            self._samples.append(max(now - start - self.sample_interval, 0.0))
+
+            if (
+                self.report_interval is not None
+                and now - last_report >= self.report_interval
+            ):
+                last_report = now
+                logger.info(f"Event loop lag: {self.format_percentiles()}")
+
+    def percentiles(self) -> dict[float, float]:
+        """the lag in seconds at the LAG_QUANTILES of the recent measurements, the quantile 1.0 is the maximum"""
+        if not self._samples:
+            return {}
+        samples = sorted(self._samples)
+        return {
+            q: samples[min(int(q * len(samples)), len(samples) - 1)]
+            for q in LAG_QUANTILES
+        }
+
+    def format_percentiles(self) -> str:
+        return ", ".join(
+            f"{'max' if q == 1.0 else f'p{q * 100:g}'} {lag * 1000:.1f} ms"
+            for q, lag in self.percentiles().items()
+        )
+
+
+class BlockingCallWatchdog:
+    def __init__(self, threshold: float = 0.1):
+        """
+        :param threshold: seconds the event loop may not run before the stack of the loop thread is logged
+        """
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        self._heartbeat_handle: Optional[asyncio.TimerHandle] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """start watching the running event loop, must be called from within the loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._beat()
+        self._thread = threading.Thread(
+            target=self._watch, name="event-loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_handle is not None:
+            self._heartbeat_handle.cancel()
+            self._heartbeat_handle = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _beat(self):
+        self._heartbeat = time.monotonic()
+        self._heartbeat_handle = self._loop.call_later(self.threshold / 4, self._beat)
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stopped.wait(self.threshold / 4):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat
+            # report every stall only once
+            if blocked_for < self.threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self._loop_thread_id
+            )
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            task = asyncio.current_task(self._loop)
+            task_name = task.get_name() if task is not None else "no task"
+            logger.warning(
+                f"Event loop blocked for more than {blocked_for * 1000:.0f} ms in {task_name}, "
+                f"currently at:\n{stack}"
+            )
+
+
+class LoopMonitor:
+    """the lag monitor and, in debug mode, the blocking call watchdog of a service's event loop"""
+
+    def __init__(self, cfg: MonitoringConfig, debug: bool = False):
+        self.lag = LoopLagMonitor(
+            sample_interval=cfg.loop_lag_sample_interval.total_seconds(),
+            n_samples=cfg.loop_lag_samples,
+            report_interval=(
+                cfg.loop_lag_report_interval.total_seconds()
+                if cfg.loop_lag_report_interval is not None
+                else None
+            ),
+        )
+        self.watchdog = (
+            BlockingCallWatchdog(threshold=cfg.blocking_call_threshold.total_seconds())
+            if debug
+            else None
+        )
+
+    def start(self):
+        self.lag.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+
+    async def stop(self):
+        await self.lag.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
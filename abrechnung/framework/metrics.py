@@ -0,0 +1,399 @@
+"""
+Instrumentation of database queries and http requests, exposed in the prometheus text format.
+
+Queries are grouped by their fingerprint, the query text with literals replaced and whitespace collapsed,
+together with the service method which issued them. Requests are grouped by their route.
+"""
+
+import contextlib
+import contextvars
+import functools
+import hashlib
+import logging
+import re
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterator, Optional
+
+if TYPE_CHECKING:
+    from abrechnung.framework.database import PoolMetrics
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the buckets of the query duration histograms
+QUERY_DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# upper bounds of the buckets of the queries per request histograms
+REQUEST_QUERIES_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+# upper bounds in seconds of the buckets of the request duration histograms
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# upper bounds in bytes of the buckets of the response size histograms
+RESPONSE_SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+# numbers which are not part of an identifier or a positional parameter like $1
+_NUMBER_LITERAL_RE = re.compile(r"(?<![\w$])\d+(?:\.\d+)?\b")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_service_method: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "service_method", default=None
+)
+_request_queries: contextvars.ContextVar[Optional["RequestQueries"]] = (
+    contextvars.ContextVar("request_queries", default=None)
+)
+
+
+@functools.lru_cache(maxsize=1024)
+def query_fingerprint(query: str) -> tuple[str, str]:
+    """returns a short stable hash and the normalized text of a query"""
+    normalized = _STRING_LITERAL_RE.sub("?", query)
+    normalized = _NUMBER_LITERAL_RE.sub("?", normalized)
+    normalized = _WHITESPACE_RE.sub(" ", normalized).strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16], normalized
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.bounds = buckets
+        # the last bucket counts the observations above the largest bucket bound
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self._counts[i] += 1
+                return
+        self._counts[-1] += 1
+
+    def buckets(self) -> dict[float, int]:
+        """cumulative counts of observations which were at most the given bound, in the style of prometheus"""
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.bounds, self._counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return buckets
+
+
+@dataclass
+class QueryMetric:
+    calls: int = 0
+    errors: int = 0
+    rows: int = 0
+    duration: Histogram = field(
+        default_factory=lambda: Histogram(QUERY_DURATION_BUCKETS)
+    )
+
+
+@dataclass
+class RequestQueries:
+    """the queries issued while handling a single request"""
+
+    count: int = 0
+    # total time spent waiting for the database in seconds
+    duration: float = 0.0
+
+
+class QueryMeasurement:
+    def __init__(self):
+        # number of rows returned or affected by the query
+        self.rows = 0
+
+
+class QueryMetrics:
+    def __init__(self):
+        # fingerprint -> normalized query text
+        self._queries: dict[str, str] = {}
+        # (fingerprint, service method) -> metric
+        self._metrics: dict[tuple[str, str], QueryMetric] = {}
+
+    @staticmethod
+    @contextlib.contextmanager
+    def service_method(name: str) -> Iterator[None]:
+        """attribute all queries within this context to the given service method"""
+        token = _service_method.set(name)
+        try:
+            yield
+        finally:
+            _service_method.reset(token)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def track_request() -> Iterator[RequestQueries]:
+        """count the queries issued within this context, e.g. while handling a request"""
+        request_queries = RequestQueries()
+        token = _request_queries.set(request_queries)
+        try:
+            yield request_queries
+        finally:
+            _request_queries.reset(token)
+
+    def get(self, query: str, method: str = "") -> Optional[QueryMetric]:
+        """the metric of a query issued by the given service method"""
+        fingerprint, _ = query_fingerprint(query)
+        return self._metrics.get((fingerprint, method))
+
+    @contextlib.contextmanager
+    def measure(
+        self, query: str, slow_query_threshold: Optional[float] = None
+    ) -> Iterator[QueryMeasurement]:
+        measurement = QueryMeasurement()
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield measurement
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(
+                query,
+                duration=time.perf_counter() - start,
+                rows=measurement.rows,
+                failed=failed,
+                slow_query_threshold=slow_query_threshold,
+            )
+
+    def observe(
+        self,
+        query: str,
+        duration: float,
+        rows: int = 0,
+        failed: bool = False,
+        slow_query_threshold: Optional[float] = None,
+    ):
+        fingerprint, normalized = query_fingerprint(query)
+        method = _service_method.get() or ""
+        self._queries.setdefault(fingerprint, normalized)
+        metric = self._metrics.get((fingerprint, method))
+        if metric is None:
+            metric = self._metrics[(fingerprint, method)] = QueryMetric()
+        metric.calls += 1
+        metric.errors += failed
+        metric.rows += rows
+        metric.duration.observe(duration)
+
+        request_queries = _request_queries.get()
+        if request_queries is not None:
+            request_queries.count += 1
+            request_queries.duration += duration
+
+        if slow_query_threshold is not None and duration >= slow_query_threshold:
+            logger.warning(
+                f"Slow query {fingerprint} took {duration * 1000:.1f} ms and returned {rows} rows "
+                f"in {method or 'unknown service method'}: {normalized}"
+            )
+
+    def render(self) -> list[str]:
+        lines = [
+            "# HELP abrechnung_query_info normalized text of the queries by fingerprint",
+            "# TYPE abrechnung_query_info gauge",
+        ]
+        for fingerprint, normalized in self._queries.items():
+            lines.append(
+                f"abrechnung_query_info{_labels(fingerprint=fingerprint, query=normalized)} 1"
+            )
+
+        lines.append("# HELP abrechnung_query_errors_total number of failed queries")
+        lines.append("# TYPE abrechnung_query_errors_total counter")
+        for (fingerprint, method), metric in self._metrics.items():
+            labels = _labels(fingerprint=fingerprint, method=method)
+            lines.append(f"abrechnung_query_errors_total{labels} {metric.errors}")
+
+        lines.append(
+            "# HELP abrechnung_query_rows_total number of rows returned or affected by queries"
+        )
+        lines.append("# TYPE abrechnung_query_rows_total counter")
+        for (fingerprint, method), metric in self._metrics.items():
+            labels = _labels(fingerprint=fingerprint, method=method)
+            lines.append(f"abrechnung_query_rows_total{labels} {metric.rows}")
+
+        lines.append(
+            "# HELP abrechnung_query_duration_seconds execution time of queries"
+        )
+        lines.append("# TYPE abrechnung_query_duration_seconds histogram")
+        for (fingerprint, method), metric in self._metrics.items():
+            lines.extend(
+                _render_histogram(
+                    "abrechnung_query_duration_seconds",
+                    metric.duration,
+                    fingerprint=fingerprint,
+                    method=method,
+                )
+            )
+        return lines
+
+
+@dataclass
+class RequestMetric:
+    # time spent waiting for the database and everything else, e.g. validation, serialization or a busy event loop
+    db_time: float = 0.0
+    app_time: float = 0.0
+    # status code -> number of responses
+    responses: dict[int, int] = field(default_factory=dict)
+    duration: Histogram = field(
+        default_factory=lambda: Histogram(REQUEST_DURATION_BUCKETS)
+    )
+    response_size: Histogram = field(
+        default_factory=lambda: Histogram(RESPONSE_SIZE_BUCKETS)
+    )
+    queries: Histogram = field(
+        default_factory=lambda: Histogram(REQUEST_QUERIES_BUCKETS)
+    )
+
+
+class RequestMetrics:
+    def __init__(self):
+        # number of requests currently being handled
+        self.in_flight = 0
+        # (http method, route) -> metric
+        self._metrics: dict[tuple[str, str], RequestMetric] = {}
+
+    def get(self, method: str, route: str) -> Optional[RequestMetric]:
+        return self._metrics.get((method, route))
+
+    def observe(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        duration: float,
+        response_size: int,
+        request_queries: RequestQueries,
+    ):
+        metric = self._metrics.get((method, route))
+        if metric is None:
+            metric = self._metrics[(method, route)] = RequestMetric()
+        metric.responses[status] = metric.responses.get(status, 0) + 1
+        metric.db_time += request_queries.duration
+        metric.app_time += max(duration - request_queries.duration, 0.0)
+        metric.duration.observe(duration)
+        metric.response_size.observe(response_size)
+        metric.queries.observe(request_queries.count)
+
+    def render(self) -> list[str]:
+        lines = [
+            "# HELP abrechnung_http_requests_in_flight number of requests currently being handled",
+            "# TYPE abrechnung_http_requests_in_flight gauge",
+            f"abrechnung_http_requests_in_flight {self.in_flight}",
+            "# HELP abrechnung_http_responses_total number of responses by status code",
+            "# TYPE abrechnung_http_responses_total counter",
+        ]
+        for (method, route), metric in self._metrics.items():
+            for status, count in metric.responses.items():
+                labels = _labels(method=method, route=route, status=str(status))
+                lines.append(f"abrechnung_http_responses_total{labels} {count}")
+
+        for kind, description in (
+            ("db", "time spent waiting for the database"),
+            ("app", "time spent outside of database queries"),
+        ):
+            name = f"abrechnung_http_request_{kind}_seconds_total"
+            lines.append(f"# HELP {name} {description} while handling requests")
+            lines.append(f"# TYPE {name} counter")
+            for (method, route), metric in self._metrics.items():
+                value = metric.db_time if kind == "db" else metric.app_time
+                lines.append(f"{name}{_labels(method=method, route=route)} {value}")
+
+        for attr, name, description in (
+            ("duration", "request_duration_seconds", "time to handle a request"),
+            ("response_size", "response_size_bytes", "size of the response bodies"),
+            ("queries", "request_queries", "number of queries issued per request"),
+        ):
+            name = f"abrechnung_http_{name}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), metric in self._metrics.items():
+                lines.extend(
+                    _render_histogram(
+                        name, getattr(metric, attr), method=method, route=route
+                    )
+                )
+        return lines
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: str) -> str:
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()
+        )
+        + "}"
+    )
+
+
+def _render_histogram(name: str, histogram: Histogram, **labels: str) -> list[str]:
+    lines = []
+    for bound, count in histogram.buckets().items():
+        lines.append(f"{name}_bucket{_labels(**labels, le=str(bound))} {count}")
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+def render_pool_metrics(pools: dict[str, "PoolMetrics"]) -> list[str]:
+    gauges = {
+        "size": "number of open connections",
+        "max_size": "maximum number of connections",
+        "idle": "number of idle connections",
+        "in_use": "number of acquired connections",
+        "waiting": "number of tasks waiting for a connection",
+    }
+    lines = []
+    for attr, description in gauges.items():
+        lines.append(f"# HELP abrechnung_db_pool_{attr} {description}")
+        lines.append(f"# TYPE abrechnung_db_pool_{attr} gauge")
+        for pool, metrics in pools.items():
+            lines.append(
+                f"abrechnung_db_pool_{attr}{_labels(pool=pool)} {getattr(metrics, attr)}"
+            )
+
+    name = "abrechnung_db_pool_acquire_duration_seconds"
+    lines.append(f"# HELP {name} time spent waiting for a connection")
+    lines.append(f"# TYPE {name} histogram")
+    for pool, metrics in pools.items():
+        for bound, count in metrics.acquire_latency_buckets.items():
+            lines.append(f"{name}_bucket{_labels(pool=pool, le=str(bound))} {count}")
+        lines.append(
+            f'{name}_bucket{_labels(pool=pool, le="+Inf")} {metrics.acquire_count}'
+        )
+        lines.append(f"{name}_sum{_labels(pool=pool)} {metrics.acquire_latency_sum}")
+        lines.append(f"{name}_count{_labels(pool=pool)} {metrics.acquire_count}")
+    return lines
+
+
+def render_loop_lag(percentiles: dict[float, float]) -> list[str]:
+    lines = [
+        "# HELP abrechnung_event_loop_lag_seconds delay of the event loop in waking up sleeping tasks",
+        "# TYPE abrechnung_event_loop_lag_seconds summary",
+    ]
+    for quantile, lag in percentiles.items():
+        lines.append(
+            f"abrechnung_event_loop_lag_seconds{_labels(quantile=str(quantile))} {lag}"
+        )
+    return lines
+
+
+def render_metrics(
+    pools: dict[str, "PoolMetrics"], loop_lag: Optional[dict[float, float]] = None
+) -> str:
+    """all metrics of this process in the prometheus text exposition format"""
+    lines = query_metrics.render() + request_metrics.render()
+    lines += render_pool_metrics(pools)
+    if loop_lag is not None:
+        lines += render_loop_lag(loop_lag)
+    return "\n".join(lines) + "\n"
+
+
+query_metrics = QueryMetrics()
+request_metrics = RequestMetrics()
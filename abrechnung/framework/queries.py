@@ -0,0 +1,78 @@
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import asyncpg
+
+
+@dataclass
+class QueryStats:
+    calls: int = 0
+    # total execution time in seconds
+    total_time: float = 0.0
+
+
+class PreparedQuery:
+    """a hot query which is prepared once per connection by the statement cache of asyncpg"""
+
+    def __init__(self, registry: "QueryRegistry", name: str, sql: str):
+        self.registry = registry
+        self.name = name
+        self.sql = sql
+
+    async def fetch(self, conn: asyncpg.Connection, *args) -> list[asyncpg.Record]:
+        return await self.registry.execute(self, conn, "fetch", *args)
+
+    async def fetchrow(self, conn: asyncpg.Connection, *args) -> asyncpg.Record | None:
+        return await self.registry.execute(self, conn, "fetchrow", *args)
+
+    async def fetchval(self, conn: asyncpg.Connection, *args) -> Any:
+        return await self.registry.execute(self, conn, "fetchval", *args)
+
+
+class QueryRegistry:
+    """
+    central registry of hot queries.
+
+    the queries are executed through the connection, hence asyncpg prepares them lazily on their first use on each
+    connection and keeps them in its statement cache, which also takes care of re-preparing them after schema
+    changes. with statement_cache_size=0, e.g. behind pgbouncer, they are executed without being prepared.
+    execution counts and times are tracked per query.
+    """
+
+    def __init__(self):
+        self._queries: dict[str, PreparedQuery] = {}
+        self._stats: dict[str, QueryStats] = {}
+
+    def register(self, name: str, sql: str) -> PreparedQuery:
+        if name in self._queries and self._queries[name].sql != sql:
+            raise ValueError(f"a different query named {name} is already registered")
+        query = PreparedQuery(self, name, sql)
+        self._queries[name] = query
+        self._stats.setdefault(name, QueryStats())
+        return query
+
+    async def execute(
+        self, query: PreparedQuery, conn: asyncpg.Connection, method: str, *args
+    ):
+        start = time.perf_counter()
+        try:
+            return await getattr(conn, method)(query.sql, *args)
+        finally:
+            stats = self._stats[query.name]
+            stats.calls += 1
+            stats.total_time += time.perf_counter() - start
+
+    def stats(self) -> dict[str, QueryStats]:
+        return {
+            name: QueryStats(calls=stats.calls, total_time=stats.total_time)
+            for name, stats in self._stats.items()
+        }
+
+
+query_registry = QueryRegistry()
+
+
+def prepared_query(name: str, sql: str) -> PreparedQuery:
+    """register a hot query with the global query registry"""
+    return query_registry.register(name, sql)
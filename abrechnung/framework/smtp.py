@@ -0,0 +1,114 @@
+import asyncio
+import email.message
+import logging
+import smtplib
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_MAIL_REJECTED_ERRORS = (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)
+
+
+class SMTPConnectionPool:
+    """
+    pool of reusable smtplib connections.
+
+    smtplib is blocking, therefore all interaction with the mail server happens in worker threads
+    such that sending mails never blocks the event loop. At most max_connections mails are sent
+    concurrently, connections which have been idle for longer than idle_timeout seconds are closed.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], smtplib.SMTP],
+        max_connections: int = 4,
+        idle_timeout: float = 30,
+    ):
+        self._connect = connect
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+
+        self._semaphore = asyncio.Semaphore(max_connections)
+        # idle connections together with the time they were last used
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def _acquire(self) -> tuple[smtplib.SMTP, bool]:
+        """returns a connection and whether it was reused from the pool"""
+        while self._idle:
+            conn, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout:
+                return conn, True
+            await asyncio.to_thread(self._close, conn)
+
+        return await asyncio.to_thread(self._connect), False
+
+    def _release(self, conn: smtplib.SMTP):
+        self._idle.append((conn, time.monotonic()))
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._close_idle_connections())
+
+    @staticmethod
+    def _close(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
+
+    async def _close_idle_connections(self):
+        while self._idle:
+            await asyncio.sleep(self.idle_timeout)
+            now = time.monotonic()
+            expired = [
+                conn
+                for conn, last_used in self._idle
+                if now - last_used >= self.idle_timeout
+            ]
+            self._idle = [
+                (conn, last_used)
+                for conn, last_used in self._idle
+                if now - last_used < self.idle_timeout
+            ]
+            for conn in expired:
+                await asyncio.to_thread(self._close, conn)
+
+    async def connect(self):
+        """open a connection to the mail server and keep it for later use"""
+        async with self._semaphore:
+            conn, _ = await self._acquire()
+            self._release(conn)
+
+    async def send_message(self, msg: email.message.EmailMessage):
+        async with self._semaphore:
+            conn, reused = await self._acquire()
+            try:
+                try:
+                    await asyncio.to_thread(conn.send_message, msg)
+                except _MAIL_REJECTED_ERRORS:
+                    # smtplib exceptions derive from OSError, don't mistake these for a broken connection
+                    raise
+                except (smtplib.SMTPServerDisconnected, OSError):
+                    # a pooled connection might have been closed by the server in the meantime,
+                    # retry once on a fresh connection
+                    await asyncio.to_thread(conn.close)
+                    if not reused:
+                        raise
+                    logger.debug("smtp connection was closed, reconnecting")
+                    conn = await asyncio.to_thread(self._connect)
+                    await asyncio.to_thread(conn.send_message, msg)
+            except _MAIL_REJECTED_ERRORS:
+                # the server rejected this mail but the connection is still usable
+                self._release(conn)
+                raise
+            except BaseException:
+                await asyncio.to_thread(conn.close)
+                raise
+            self._release(conn)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await asyncio.to_thread(self._close, conn)
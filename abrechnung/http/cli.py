@@ -1,4 +1,11 @@
+import asyncio
+import collections
 import logging
+import multiprocessing
+import signal
+import socket
+from multiprocessing.process import BaseProcess
+from typing import Callable, Optional
 
 import asyncpg
 import uvicorn
@@ -9,21 +16,61 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from abrechnung import __version__
 from abrechnung.application.accounts import AccountService
+from abrechnung.application.balances import BalanceService
 from abrechnung.application.groups import GroupService
 from abrechnung.application.transactions import TransactionService
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
 from abrechnung.core.errors import NotFoundError, InvalidCommand
-from abrechnung.framework.database import create_db_pool
+from abrechnung.framework.database import (
+    ReplicaRouter,
+    create_db_connection,
+    create_db_pool,
+)
+from abrechnung.framework.loop_monitor import LoopMonitor
 from abrechnung.subcommand import SubCommand
-from .middleware import ContextMiddleware
-from .routers import transactions, groups, auth, accounts, common, websocket
-from .routers.websocket import NotificationManager
+from .middleware import ContextMiddleware, MetricsMiddleware
+from .routers import (
+    transactions,
+    groups,
+    auth,
+    accounts,
+    balances,
+    common,
+    websocket,
+)
+from .routers.websocket import (
+    NotificationManager,
+    remove_stale_forwarders,
+    worker_forwarder_id,
+)
+
+
+def _run_worker(
+    config: Config,
+    worker_index: int,
+    sock: socket.socket,
+    log_level: int,
+    debug: bool,
+):
+    """entry point of a spawned api worker process"""
+    logging.basicConfig(level=log_level, format="[%(asctime)s] %(message)s")
+    logging.captureWarnings(True)
+
+    # uvicorn re-raises the signal which stopped it once it has shut down, with the default
+    # SIGTERM handler that would kill the worker before its notification forwarder is unregistered
+    signal.signal(signal.SIGTERM, lambda signum, frame: None)
+
+    worker_config = config.model_copy(deep=True)
+    worker_config.api.id = worker_forwarder_id(config.api.id, worker_index)
+    api = ApiCli(config=worker_config, debug=debug)
+    asyncio.run(api.serve(sockets=[sock]), debug=debug)
 
 
 class ApiCli(SubCommand):
-    def __init__(self, config: Config, **kwargs):
+    def __init__(self, config: Config, debug: bool = False, **kwargs):
         self.cfg = config
+        self.debug = debug
 
         self.logger = logging.getLogger(__name__)
 
@@ -39,6 +86,7 @@ class ApiCli(SubCommand):
         self.api.include_router(groups.router)
         self.api.include_router(auth.router)
         self.api.include_router(accounts.router)
+        self.api.include_router(balances.router)
         self.api.include_router(common.router)
         self.api.include_router(websocket.router)
         self.api.add_middleware(
@@ -104,37 +152,195 @@ class ApiCli(SubCommand):
         return self._format_error_message(exc.status_code, exc.detail)
 
     async def _setup(self):
+        self.loop_monitor = LoopMonitor(self.cfg.monitoring, debug=self.debug)
+        self.loop_monitor.start()
+
         self.db_pool = await create_db_pool(self.cfg.database)
-        self.user_service = UserService(db_pool=self.db_pool, config=self.cfg)
-        self.transaction_service = TransactionService(
-            db_pool=self.db_pool, config=self.cfg
+        if self.cfg.database.read_pool is not None:
+            self.read_db_pool = await create_db_pool(
+                self.cfg.database, pool_config=self.cfg.database.read_pool
+            )
+        else:
+            self.read_db_pool = self.db_pool
+        self.db_pools = {"main": self.db_pool}
+        if self.read_db_pool is not self.db_pool:
+            self.db_pools["read"] = self.read_db_pool
+        self.replica_router = None
+        if self.cfg.database.replicas:
+            replica_pools = [
+                await create_db_pool(
+                    self.cfg.database.model_copy(
+                        update={"host": replica.host, "port": replica.port}
+                    ),
+                    pool_config=self.cfg.database.read_pool,
+                )
+                for replica in self.cfg.database.replicas
+            ]
+            for i, replica_pool in enumerate(replica_pools):
+                self.db_pools[f"replica-{i}"] = replica_pool
+            self.replica_router = ReplicaRouter(
+                primary=self.read_db_pool, replicas=replica_pools
+            )
+
+        service_args = dict(
+            db_pool=self.db_pool,
+            config=self.cfg,
+            read_db_pool=self.read_db_pool,
+            replica_router=self.replica_router,
         )
-        self.account_service = AccountService(db_pool=self.db_pool, config=self.cfg)
-        self.group_service = GroupService(db_pool=self.db_pool, config=self.cfg)
+        self.user_service = UserService(**service_args)
+        self.transaction_service = TransactionService(**service_args)
+        self.account_service = AccountService(**service_args)
+        self.group_service = GroupService(**service_args)
+        self.balance_service = BalanceService(**service_args)
         self.notification_manager = NotificationManager(config=self.cfg)
 
-        await self.notification_manager.initialize(db_pool=self.db_pool)
+        await self.notification_manager.initialize()
 
         self.api.add_middleware(
             ContextMiddleware,
             config=self.cfg,
             db_pool=self.db_pool,
+            db_pools=self.db_pools,
+            loop_lag_monitor=self.loop_monitor.lag,
             user_service=self.user_service,
             transaction_service=self.transaction_service,
             account_service=self.account_service,
             group_service=self.group_service,
+            balance_service=self.balance_service,
             notification_manager=self.notification_manager,
         )
+        self.api.add_middleware(
+            MetricsMiddleware, server_timing=self.cfg.api.server_timing
+        )
 
     async def _teardown(self):
         await self.notification_manager.teardown()
+        if self.replica_router is not None:
+            await self.replica_router.close()
+        if self.read_db_pool is not self.db_pool:
+            await self.read_db_pool.close()
         await self.db_pool.close()
+        await self.loop_monitor.stop()
 
-    async def run(self):
+    async def _remove_stale_forwarders(self):
+        connection = await create_db_connection(self.cfg.database)
+        try:
+            n_removed = await remove_stale_forwarders(
+                connection, self.cfg.api.id, self.cfg.api.workers
+            )
+            if n_removed > 0:
+                self.logger.info(f"Removed {n_removed} stale notification forwarders")
+        finally:
+            await connection.close()
+
+    async def serve(self, sockets: Optional[list[socket.socket]] = None):
         await self._setup()
 
         try:
             webserver = uvicorn.Server(self.uvicorn_config)
-            await webserver.serve()
+            await webserver.serve(sockets=sockets)
         finally:
             await self._teardown()
+
+    async def _run_workers(
+        self, worker_target: Callable[..., None] = _run_worker
+    ) -> bool:
+        """
+        run the api in multiple worker processes which share one listening socket.
+        crashed workers are restarted under their previous worker index after an exponential backoff.
+        returns False if the workers crashed too often and were given up on.
+        """
+        sock = self.uvicorn_config.bind_socket()
+        ctx = multiprocessing.get_context("spawn")
+        loop = asyncio.get_running_loop()
+        workers: dict[int, BaseProcess] = {}
+        started_at: dict[int, float] = {}
+        restart_delays: dict[int, float] = {}
+        # worker index -> loop time at which the crashed worker is started again
+        pending_restarts: dict[int, float] = {}
+        # loop times of the crashes within the restart window
+        crashes: collections.deque[float] = collections.deque()
+        initial_delay = self.cfg.api.worker_restart_delay.total_seconds()
+        restart_window = self.cfg.api.worker_restart_window.total_seconds()
+
+        def start_worker(worker_index: int):
+            process = ctx.Process(
+                target=worker_target,
+                kwargs={
+                    "config": self.cfg,
+                    "worker_index": worker_index,
+                    "sock": sock,
+                    "log_level": logging.root.level,
+                    "debug": self.debug,
+                },
+                name=f"abrechnung-api-{worker_index}",
+            )
+            process.start()
+            workers[worker_index] = process
+            started_at[worker_index] = loop.time()
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        for i in range(self.cfg.api.workers):
+            start_worker(i)
+        self.logger.info(f"Started {self.cfg.api.workers} api workers")
+
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=min(initial_delay, 1))
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+                now = loop.time()
+                for worker_index, process in workers.items():
+                    if process.is_alive() or worker_index in pending_restarts:
+                        continue
+
+                    crashes.append(now)
+                    while crashes[0] < now - restart_window:
+                        crashes.popleft()
+                    if len(crashes) > self.cfg.api.worker_max_restarts:
+                        self.logger.error(
+                            f"Api worker {worker_index} exited with code {process.exitcode}, api workers crashed "
+                            f"{len(crashes)} times within {restart_window} seconds, giving up"
+                        )
+                        return False
+
+                    # the backoff starts over for workers which ran for a while before crashing
+                    if now - started_at[worker_index] > restart_window:
+                        restart_delays.pop(worker_index, None)
+                    delay = restart_delays.get(worker_index, initial_delay)
+                    restart_delays[worker_index] = min(delay * 2, 30)
+                    pending_restarts[worker_index] = now + delay
+                    self.logger.warning(
+                        f"Api worker {worker_index} exited with code {process.exitcode}, "
+                        f"restarting in {delay} seconds"
+                    )
+
+                for worker_index, restart_at in list(pending_restarts.items()):
+                    if restart_at <= now:
+                        del pending_restarts[worker_index]
+                        start_worker(worker_index)
+        finally:
+            self.logger.info("Stopping api workers")
+            for process in workers.values():
+                process.terminate()
+            for process in workers.values():
+                await asyncio.to_thread(process.join, 10)
+            sock.close()
+
+        return True
+
+    async def run(self):
+        await self._remove_stale_forwarders()
+
+        if self.cfg.api.workers > 1:
+            if not await self._run_workers():
+                raise SystemExit(1)
+        else:
+            await self.serve()
@@ -2,10 +2,13 @@ import asyncpg
 from fastapi import Request, Depends
 
 from abrechnung.application.accounts import AccountService
+from abrechnung.application.balances import BalanceService
 from abrechnung.application.groups import GroupService
 from abrechnung.application.transactions import TransactionService
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
+from abrechnung.framework.database import MetricsPool
+from abrechnung.framework.loop_monitor import LoopLagMonitor
 
 
 def get_config(request: Request) -> Config:
@@ -31,6 +34,15 @@ async def get_db_transaction(
             yield conn
 
 
+def get_db_pools(request: Request) -> dict[str, MetricsPool]:
+    """all database pools of this api worker by name"""
+    return request.state.db_pools
+
+
+def get_loop_lag_monitor(request: Request) -> LoopLagMonitor:
+    return request.state.loop_lag_monitor
+
+
 def get_user_service(request: Request) -> UserService:
     return request.state.user_service
 
@@ -45,3 +57,7 @@ def get_account_service(request: Request) -> AccountService:
 
 def get_transaction_service(request: Request) -> TransactionService:
     return request.state.transaction_service
+
+
+def get_balance_service(request: Request) -> BalanceService:
+    return request.state.balance_service
@@ -1,15 +1,25 @@
+import time
 from typing import Union
 
 import asyncpg
 from starlette.requests import Request
-from starlette.types import ASGIApp, Scope, Receive, Send
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Scope, Receive, Send
 from starlette.websockets import WebSocket
 
 from abrechnung.application.accounts import AccountService
+from abrechnung.application.balances import BalanceService
 from abrechnung.application.groups import GroupService
 from abrechnung.application.transactions import TransactionService
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
+from abrechnung.framework.database import MetricsPool, current_session_commit
+from abrechnung.framework.loop_monitor import LoopLagMonitor
+from abrechnung.framework.metrics import (
+    RequestQueries,
+    query_metrics,
+    request_metrics,
+)
 from abrechnung.http.routers.websocket import NotificationManager
 
 
@@ -19,20 +29,26 @@ class ContextMiddleware:
         app: ASGIApp,
         config: Config,
         db_pool: asyncpg.Pool,
+        db_pools: dict[str, MetricsPool],
+        loop_lag_monitor: LoopLagMonitor,
         user_service: UserService,
         transaction_service: TransactionService,
         account_service: AccountService,
         group_service: GroupService,
+        balance_service: BalanceService,
         notification_manager: NotificationManager,
     ) -> None:
         self.app = app
 
         self.config = config
         self.db_pool = db_pool
+        self.db_pools = db_pools
+        self.loop_lag_monitor = loop_lag_monitor
         self.user_service = user_service
         self.transaction_service = transaction_service
         self.account_service = account_service
         self.group_service = group_service
+        self.balance_service = balance_service
         self.notification_manager = notification_manager
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
@@ -45,10 +61,79 @@ class ContextMiddleware:
 
         req.state.config = self.config
         req.state.db_pool = self.db_pool
+        req.state.db_pools = self.db_pools
+        req.state.loop_lag_monitor = self.loop_lag_monitor
         req.state.user_service = self.user_service
         req.state.transaction_service = self.transaction_service
         req.state.account_service = self.account_service
         req.state.group_service = self.group_service
+        req.state.balance_service = self.balance_service
         req.state.notification_manager = self.notification_manager
 
-        await self.app(scope, receive, send)
+        # the session is only known once the request is authenticated
+        token = current_session_commit.set(None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_session_commit.reset(token)
+
+
+def _server_timing(duration: float, request_queries: RequestQueries) -> str:
+    db_time = request_queries.duration
+    return (
+        f'db;dur={db_time * 1000:.1f};desc="{request_queries.count} queries", '
+        f"app;dur={max(duration - db_time, 0.0) * 1000:.1f}, "
+        f"total;dur={duration * 1000:.1f}"
+    )
+
+
+class MetricsMiddleware:
+    """
+    records latency, response size and the split between database and application time of all http requests by route.
+
+    optionally the timings are reported to the client in a Server-Timing header, as measured until the response
+    headers are sent.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = False) -> None:
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+        response_size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        _server_timing(time.perf_counter() - start, request_queries),
+                    )
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        request_metrics.in_flight += 1
+        try:
+            with query_metrics.track_request() as request_queries:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            request_metrics.in_flight -= 1
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            request_metrics.observe(
+                method=scope["method"],
+                route=route.path if route is not None else "unmatched",
+                status=status,
+                duration=time.perf_counter() - start,
+                response_size=response_size,
+                request_queries=request_queries,
+            )
@@ -1,4 +1,4 @@
-from datetime import date
+from datetime import date, datetime
 from typing import List, Optional, Dict
 
 from fastapi import APIRouter, Depends, status
@@ -28,10 +28,13 @@ router = APIRouter(
 )
 async def list_accounts(
     group_id: int,
+    as_of: Optional[datetime] = None,
     user: User = Depends(get_current_user),
     account_service: AccountService = Depends(get_account_service),
 ):
-    return await account_service.list_accounts(user=user, group_id=group_id)
+    return await account_service.list_accounts(
+        user=user, group_id=group_id, as_of=as_of
+    )
 
 
 class BaseAccountPayload(BaseModel):
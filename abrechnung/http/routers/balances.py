@@ -0,0 +1,34 @@
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, status
+
+from abrechnung.application.balances import BalanceService
+from abrechnung.domain.balances import AccountBalance
+from abrechnung.domain.users import User
+from abrechnung.http.auth import get_current_user
+from abrechnung.http.dependencies import get_balance_service
+
+router = APIRouter(
+    prefix="/api",
+    tags=["balances"],
+    responses={
+        status.HTTP_401_UNAUTHORIZED: {"description": "unauthorized"},
+        status.HTTP_403_FORBIDDEN: {"description": "forbidden"},
+        status.HTTP_404_NOT_FOUND: {"description": "Not found"},
+    },
+)
+
+
+@router.get(
+    r"/v1/groups/{group_id}/balances",
+    summary="balances of all accounts in a group with clearing accounts resolved",
+    response_model=List[AccountBalance],
+)
+async def get_balances(
+    group_id: int,
+    as_of: Optional[datetime] = None,
+    user: User = Depends(get_current_user),
+    balance_service: BalanceService = Depends(get_balance_service),
+):
+    return await balance_service.get_balances(user=user, group_id=group_id, as_of=as_of)
@@ -1,7 +1,17 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 
 from abrechnung import __version__, MAJOR_VERSION, MINOR_VERSION, PATCH_VERSION
+from abrechnung.config import Config
+from abrechnung.framework.database import MetricsPool
+from abrechnung.framework.metrics import render_metrics
+from abrechnung.framework.loop_monitor import LoopLagMonitor
+from abrechnung.http.dependencies import (
+    get_config,
+    get_db_pools,
+    get_loop_lag_monitor,
+)
 
 router = APIRouter(
     prefix="/api",
@@ -34,3 +44,18 @@ async def version():
         "minor_version": MINOR_VERSION,
         "patch_version": PATCH_VERSION,
     }
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(
+    config: Config = Depends(get_config),
+    db_pools: dict[str, MetricsPool] = Depends(get_db_pools),
+    loop_lag_monitor: LoopLagMonitor = Depends(get_loop_lag_monitor),
+):
+    """query, request, connection pool and event loop metrics of this api worker in the prometheus text format"""
+    if not config.api.enable_metrics:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return render_metrics(
+        {name: pool.metrics() for name, pool in db_pools.items()},
+        loop_lag=loop_lag_monitor.percentiles(),
+    )
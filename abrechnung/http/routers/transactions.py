@@ -51,6 +51,7 @@ async def list_transactions(
     group_id: int,
     min_last_changed: Optional[datetime] = None,
     transaction_ids: Optional[str] = None,
+    as_of: Optional[datetime] = None,
     user: User = Depends(get_current_user),
     transaction_service: TransactionService = Depends(get_transaction_service),
 ):
@@ -69,6 +70,7 @@ async def list_transactions(
         group_id=group_id,
         min_last_changed=min_last_changed,
         additional_transactions=forced_transaction_ids,
+        as_of=as_of,
     )
 
 
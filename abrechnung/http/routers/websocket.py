@@ -2,6 +2,7 @@ import asyncio
 import json
 import logging
 import traceback
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import asyncpg
@@ -10,6 +11,7 @@ from fastapi import APIRouter, WebSocket, Request, status, WebSocketException
 
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
+from abrechnung.framework.database import create_db_connection, create_db_pool
 from abrechnung.http.utils import encode_json
 
 router = APIRouter(
@@ -29,6 +31,16 @@ CLIENT_SCHEMA = schema.Schema(
             "token": str,
             "data": {"subscription_type": str, "element_id": int},
         },
+        {
+            "type": "subscribe_many",
+            "token": str,
+            "data": [{"subscription_type": str, "element_id": int}],
+        },
+        {
+            "type": "unsubscribe_many",
+            "token": str,
+            "data": [{"subscription_type": str, "element_id": int}],
+        },
     )
 )
 
@@ -56,10 +68,35 @@ SERVER_SCHEMA = schema.Schema(
                 "element_id": int,
             },
         },
+        {
+            "type": "resync",
+            "data": {"groups": [{"group_id": int, "last_seen": schema.Or(str, None)}]},
+        },
+        {
+            "type": "subscribe_many_success",
+            "data": [{"subscription_type": str, "element_id": int}],
+        },
+        {
+            "type": "unsubscribe_many_success",
+            "data": [{"subscription_type": str, "element_id": int}],
+        },
     )
 )
 
 
+# subscription types whose element_id is a group id
+GROUP_SUBSCRIPTION_TYPES = {
+    "account",
+    "group_member",
+    "group_invite",
+    "group_log",
+    "transaction",
+}
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
 def make_error_msg(code: int, msg: str) -> dict:
     return {"type": "error", "data": {"code": code, "msg": msg}}
 
@@ -71,31 +108,193 @@ class NotificationManager:
 
         # map of connection_id to websocket
         self.active_connections: dict[int, WebSocket] = {}
+        # subscriptions of each connection, (subscription_type, element_id) -> user_id,
+        # these are replayed to the database after a reconnect
+        self.subscriptions: dict[int, dict[tuple[str, int], int]] = {}
+        # per connection the last_changed time of the latest change in a group the client was notified about,
+        # None if there was none yet. sent to clients on a resync such that they can refetch the group.
+        self.last_seen: dict[int, dict[int, Optional[datetime]]] = {}
+
+        # notifications per connection_id which are waiting for the debounce window to pass,
+        # keyed by their serialized content such that identical notifications are only sent once
+        self.pending_notifications: dict[int, dict[str, dict]] = {}
+        self.debounce_interval = self.config.api.notification_debounce.total_seconds()
+        self.debounce_tasks: set[asyncio.Task] = set()
 
         # psql notification channel id,
         # we get this when booting from the db.
         self.channel_id: Optional[int] = None
         self.channel_name: Optional[str] = None
 
+        # small pool dedicated to websocket connection handling such that websocket traffic
+        # does not compete with the http request handling for database connections
         self.db_pool: Optional[asyncpg.Pool] = None
+        # dedicated, non pooled connection which LISTENs on our notification channel
         self.connection: Optional[asyncpg.Connection] = None
+        self.reconnect_task: Optional[asyncio.Task] = None
+        self.shutting_down = False
 
-    async def initialize(self, db_pool: asyncpg.Pool):
-        self.db_pool = db_pool
-        self.connection = await self.db_pool.acquire()
-        await self.connection.set_type_codec(
-            "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
-        )
-        await self.connection.set_type_codec(
-            "jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+    async def initialize(self):
+        self.shutting_down = False
+        self.db_pool = await create_db_pool(
+            self.config.database, n_connections=self.config.api.websocket_db_connections
         )
+        await self._connect_listener()
         await self._register_forwarder(self.connection, forwarder_id=self.config.api.id)
 
     async def teardown(self):
-        await self._unregister_forwarder(
-            self.connection, forwarder_id=self.config.api.id
+        self.shutting_down = True
+        for task in self.debounce_tasks:
+            task.cancel()
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+        if self.connection is not None and not self.connection.is_closed():
+            await self._unregister_forwarder(
+                self.connection, forwarder_id=self.config.api.id
+            )
+            await self.connection.close()
+        else:
+            async with self.db_pool.acquire() as connection:
+                await connection.execute(
+                    "select * from forwarder_stop($1)", self.config.api.id
+                )
+        await self.db_pool.close()
+
+    async def _connect_listener(self):
+        self.connection = await create_db_connection(self.config.database)
+        self.connection.add_termination_listener(self._on_listener_terminated)
+
+    def _on_listener_terminated(self, connection: asyncpg.Connection):
+        if self.shutting_down or connection is not self.connection:
+            return
+
+        self.logger.warning(
+            "Lost database connection listening for notifications, reconnecting"
+        )
+        self.reconnect_task = asyncio.create_task(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        """
+        re-establish the LISTEN connection and re-boot our forwarder.
+
+        booting the forwarder drops all its connections and subscriptions in the database,
+        therefore the still connected websocket clients are registered again under their
+        previous connection ids, their subscriptions are replayed and each client is sent a
+        resync message, as notifications might have been lost while we were disconnected.
+        """
+        retry_delay = 0.5
+        while not self.shutting_down:
+            try:
+                await self._connect_listener()
+                await self._register_forwarder(
+                    self.connection, forwarder_id=self.config.api.id
+                )
+                await self._restore_connections()
+                break
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+            ) as exc:
+                self.logger.warning(
+                    f"Reconnecting to the database failed: {exc!r}, retrying in {retry_delay} seconds"
+                )
+                self._detach_listener()
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            except Exception:
+                self.logger.exception(
+                    "Reconnecting to the database failed, giving up. "
+                    "Websocket clients will not receive notifications until the server is restarted"
+                )
+                self._detach_listener()
+                return
+
+        for connection_id in list(self.active_connections.keys()):
+            await self._send_resync(connection_id)
+
+    def _detach_listener(self):
+        if self.connection is not None:
+            # detach first such that closing it does not trigger another reconnect
+            connection, self.connection = self.connection, None
+            connection.terminate()
+
+    async def _restore_connections(self):
+        async with self.db_pool.acquire() as connection:
+            for connection_id in list(self.active_connections.keys()):
+                async with connection.transaction():
+                    await connection.execute(
+                        "call client_reconnected($1, $2)",
+                        connection_id,
+                        self.channel_id,
+                    )
+                    subscriptions = self.subscriptions.get(connection_id, {})
+                    for (subscription_type, element_id), user_id in list(
+                        subscriptions.items()
+                    ):
+                        try:
+                            async with connection.transaction():
+                                await connection.execute(
+                                    "call subscribe($1, $2, $3, $4)",
+                                    connection_id,
+                                    user_id,
+                                    subscription_type,
+                                    element_id,
+                                )
+                        except asyncpg.RaiseError as exc:
+                            # e.g. the user has left the group in the meantime
+                            self.logger.info(
+                                f"[{connection_id}] dropping subscription to {subscription_type} "
+                                f"{element_id} after reconnect: {exc}"
+                            )
+                            subscriptions.pop((subscription_type, element_id))
+
+        self.logger.info(
+            f"Restored {len(self.active_connections)} websocket connections after reconnect"
         )
-        await self.connection.close()
+
+    async def _send_resync(self, connection_id: int):
+        last_seen = self.last_seen.get(connection_id, {})
+        message = {
+            "type": "resync",
+            "data": {
+                "groups": [
+                    {
+                        "group_id": group_id,
+                        "last_seen": None if seen is None else seen.isoformat(),
+                    }
+                    for group_id, seen in last_seen.items()
+                ]
+            },
+        }
+        await self._send_notification(connection_id, message)
+
+    def track_subscriptions(
+        self, connection_id: int, user_id: int, subscriptions: list[dict]
+    ):
+        tracked = self.subscriptions.setdefault(connection_id, {})
+        last_seen = self.last_seen.setdefault(connection_id, {})
+        for sub in subscriptions:
+            tracked[(sub["subscription_type"], sub["element_id"])] = user_id
+            if sub["subscription_type"] in GROUP_SUBSCRIPTION_TYPES:
+                last_seen.setdefault(sub["element_id"], None)
+
+    def untrack_subscriptions(self, connection_id: int, subscriptions: list[dict]):
+        tracked = self.subscriptions.get(connection_id, {})
+        for sub in subscriptions:
+            tracked.pop((sub["subscription_type"], sub["element_id"]), None)
+
+        # only forget the last seen time of groups without any remaining subscription
+        subscribed_groups = {
+            element_id
+            for subscription_type, element_id in tracked
+            if subscription_type in GROUP_SUBSCRIPTION_TYPES
+        }
+        last_seen = self.last_seen.get(connection_id, {})
+        for group_id in list(last_seen.keys()):
+            if group_id not in subscribed_groups:
+                del last_seen[group_id]
 
     async def _on_psql_notification(
         self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
@@ -116,6 +315,10 @@ class NotificationManager:
 
             -- event-specific args
             "args": ...
+
+            -- time of the database transaction which caused the notification,
+            -- in microseconds since the epoch
+            "changed_at": 1234567890123456
         }
 
         """
@@ -135,19 +338,65 @@ class NotificationManager:
         payload_json = json.loads(payload)
         event = payload_json.pop("event")
         connections = payload_json["connections"]
+        changed_at = EPOCH + timedelta(microseconds=payload_json.pop("changed_at"))
         for connection_id in connections:
+            if event in GROUP_SUBSCRIPTION_TYPES and connection_id in self.last_seen:
+                group_last_seen = self.last_seen[connection_id]
+                group_id = payload_json["data"]["element_id"]
+                seen = group_last_seen.get(group_id)
+                if seen is None or seen < changed_at:
+                    group_last_seen[group_id] = changed_at
             message = {
                 "type": "notification",
                 "data": {"subscription_type": event, **payload_json["data"]},
             }
-            try:
-                await self.active_connections[connection_id].send_json(message)
-            except KeyError:
-                pass  # websocket
-            except asyncio.QueueFull:
-                self.logger.warning(
-                    f"[{connection_id}] tx queue full, skipping notification"
+            if self.debounce_interval <= 0:
+                await self._send_notification(connection_id, message)
+            else:
+                self._queue_notification(connection_id, message)
+
+    def _queue_notification(self, connection_id: int, message: dict):
+        """
+        schedule a notification to be sent at the end of the debounce window of this connection.
+        identical notifications arriving within the window are dropped, notifications about changed transactions
+        of the same group are merged into one listing all of them.
+        """
+        data = message["data"]
+        merged_ids = data.get("transaction_ids")
+        key = json.dumps(
+            {k: v for k, v in data.items() if k != "transaction_ids"},
+            sort_keys=True,
+            default=encode_json,
+        )
+        pending = self.pending_notifications.get(connection_id)
+        if pending is not None:
+            queued = pending.setdefault(key, message)
+            if queued is not message and merged_ids is not None:
+                queued["data"]["transaction_ids"] = sorted(
+                    set(queued["data"]["transaction_ids"]) | set(merged_ids)
                 )
+            return
+
+        self.pending_notifications[connection_id] = {key: message}
+        task = asyncio.create_task(self._flush_notifications(connection_id))
+        self.debounce_tasks.add(task)
+        task.add_done_callback(self.debounce_tasks.discard)
+
+    async def _flush_notifications(self, connection_id: int):
+        await asyncio.sleep(self.debounce_interval)
+        pending = self.pending_notifications.pop(connection_id, {})
+        for message in pending.values():
+            await self._send_notification(connection_id, message)
+
+    async def _send_notification(self, connection_id: int, message: dict):
+        try:
+            await self.active_connections[connection_id].send_json(message)
+        except KeyError:
+            pass  # websocket
+        except asyncio.QueueFull:
+            self.logger.warning(
+                f"[{connection_id}] tx queue full, skipping notification"
+            )
 
     async def _register_forwarder(
         self, connection: asyncpg.Connection, forwarder_id: str
@@ -195,6 +444,9 @@ class NotificationManager:
 
     async def disconnect(self, connection_id: int, websocket: WebSocket):
         del self.active_connections[connection_id]
+        self.pending_notifications.pop(connection_id, None)
+        self.subscriptions.pop(connection_id, None)
+        self.last_seen.pop(connection_id, None)
 
         if self.db_pool is None:
             raise WebSocketException(code=status.WS_1011_INTERNAL_ERROR)
@@ -205,6 +457,27 @@ class NotificationManager:
         self.logger.debug(f"websocket client with id {connection_id} disconnected")
 
 
+def worker_forwarder_id(api_id: str, worker_index: int) -> str:
+    return f"{api_id}-{worker_index}"
+
+
+async def remove_stale_forwarders(
+    connection: asyncpg.Connection, api_id: str, n_workers: int
+) -> int:
+    """
+    remove the forwarders this api instance registers, i.e. the one of the given api id and the ones of its worker
+    processes, e.g. left over after a crash. forwarders of other instances are never touched, even if their ids share
+    a prefix with ours. returns the number of removed forwarders
+    """
+    own_ids = [api_id] + [worker_forwarder_id(api_id, i) for i in range(n_workers)]
+    forwarder_ids = await connection.fetch(
+        "select id from forwarder where id = any($1::text[])", own_ids
+    )
+    for row in forwarder_ids:
+        await connection.execute("select * from forwarder_stop($1)", row["id"])
+    return len(forwarder_ids)
+
+
 def get_notification_manager(request: Request) -> NotificationManager:
     return request.state.notification_manager
 
@@ -217,7 +490,7 @@ async def websocket_endpoint(
     how to talk over a websocket connection.
     """
     notification_manager = ws.state.notification_manager
-    db_pool = ws.state.db_pool
+    db_pool = notification_manager.db_pool
     user_service = ws.state.user_service
 
     connection_id = await notification_manager.connect(websocket=ws)
@@ -229,7 +502,11 @@ async def websocket_endpoint(
             try:
                 async with db_pool.acquire() as connection:
                     response = await ws_message(
-                        connection, connection_id, msg, user_service
+                        connection,
+                        connection_id,
+                        msg,
+                        user_service,
+                        notification_manager,
                     )
             except (
                 asyncpg.DataError,
@@ -255,6 +532,7 @@ async def ws_message(
     connection_id: int,
     msg: dict,
     user_service: UserService,
+    notification_manager: NotificationManager,
 ) -> dict:
     """
     the websocket client sent a message. handle it.
@@ -277,6 +555,7 @@ async def ws_message(
                 data["subscription_type"],
                 data["element_id"],
             )
+            notification_manager.track_subscriptions(connection_id, user_id, [data])
             return {"type": "subscribe_success", "data": data}
         except (asyncpg.RaiseError, asyncpg.PostgresError) as exc:
             # a specific error was raised in the db
@@ -290,9 +569,27 @@ async def ws_message(
                 data["subscription_type"],
                 data["element_id"],
             )
+            notification_manager.untrack_subscriptions(connection_id, [data])
             return {"type": "unsubscribe_success", "data": data}
         except (asyncpg.RaiseError, asyncpg.PostgresError) as exc:
             return make_error_msg(code=status.HTTP_400_BAD_REQUEST, msg=str(exc))
+    elif msg_type in ("subscribe_many", "unsubscribe_many"):
+        # all subscriptions are checked and stored with a single statement
+        try:
+            await connection.execute(
+                f"call {msg_type}($1, $2, $3, $4)",
+                connection_id,
+                user_id,
+                [sub["subscription_type"] for sub in data],
+                [sub["element_id"] for sub in data],
+            )
+            if msg_type == "subscribe_many":
+                notification_manager.track_subscriptions(connection_id, user_id, data)
+            else:
+                notification_manager.untrack_subscriptions(connection_id, data)
+            return {"type": f"{msg_type}_success", "data": data}
+        except (asyncpg.RaiseError, asyncpg.PostgresError) as exc:
+            return make_error_msg(code=status.HTTP_400_BAD_REQUEST, msg=str(exc))
 
     else:
         return make_error_msg(
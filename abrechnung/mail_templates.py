@@ -0,0 +1,155 @@
+"""
+Templates for the mails sent by the mailer.
+
+Templates use string.Template placeholders ($name), they are compiled once when the registry is created
+and rendered in batches for many recipients at once.
+"""
+
+import string
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+DEFAULT_LOCALE = "en"
+
+# locale -> template name -> (subject, body)
+# every body is wrapped in the greeting and closing of its locale
+MAIL_TEMPLATES: dict[str, dict[str, tuple[str, str]]] = {
+    "en": {
+        "greeting": ("", "Beloved $dest_name,\n\n"),
+        "closing": ("", "\n\nThoughtfully yours\n\n    $service_name"),
+        "confirm_registration": (
+            "Confirm user account",
+            "it looks like you are attempting to create a user account.\n"
+            "\n"
+            "To complete your registration, visit\n"
+            "\n"
+            "$service_url/confirm-registration/$token\n"
+            "\n"
+            "Your request will time out $valid_until.\n"
+            "If you do not want to create a user account, just ignore this email.",
+        ),
+        "password_recovery": (
+            "Reset password",
+            "it looks like you forgot your password; how embarrasing.\n"
+            "\n"
+            "To set a new one, visit\n"
+            "\n"
+            "$service_url/confirm-password-recovery/$token\n"
+            "\n"
+            "Your request will time out $valid_until.\n"
+            "If you do not want to reset your password, just ignore this email.",
+        ),
+        "email_change_old_address": (
+            "Change email",
+            "you want to change your email address\n"
+            "\n"
+            "Your current email is: $old_email\n"
+            "You want to change it to: $new_email\n"
+            "\n"
+            "To confirm, see the mail that was sent to the new address.\n"
+            "\n"
+            "Your request will time out $valid_until.\n"
+            "If you do not want to change your email, just ignore this email.",
+        ),
+        "email_change_new_address": (
+            "Change email",
+            "you want to change your email address\n"
+            "\n"
+            "Your current email is: $old_email\n"
+            "You want to change it to: $new_email\n"
+            "\n"
+            "To confirm, visit\n"
+            "\n"
+            "$service_url/confirm-email-change/$token\n"
+            "\n"
+            "Your request will time out $valid_until.\n"
+            "If you do not want to change your email, just ignore this email.",
+        ),
+        "group_digest": (
+            "Group activity",
+            "this is what happened in your groups since our last mail:\n"
+            "\n"
+            "$activity\n"
+            "\n"
+            "Visit $service_url to see all the details.",
+        ),
+    }
+}
+
+
+@dataclass(frozen=True)
+class MailTemplate:
+    subject: string.Template
+    body: string.Template
+
+    def render(self, params: dict) -> tuple[str, str]:
+        """returns the rendered subject and body, raises a KeyError if a placeholder is not given"""
+        return self.subject.substitute(params), self.body.substitute(params)
+
+
+class MailTemplateRegistry:
+    def __init__(
+        self,
+        service_name: str,
+        service_url: str,
+        default_locale: str = DEFAULT_LOCALE,
+        templates: Optional[dict[str, dict[str, tuple[str, str]]]] = None,
+    ):
+        templates = templates or MAIL_TEMPLATES
+        if default_locale not in templates:
+            raise ValueError(
+                f"no mail templates exist for default locale {default_locale}"
+            )
+
+        self.default_locale = default_locale
+        # values which are the same for every mail are substituted once at compile time,
+        # escaped as they are part of the template afterwards
+        self._common_params = {
+            "service_name": service_name.replace("$", "$$"),
+            "service_url": service_url.replace("$", "$$"),
+        }
+        self._templates: dict[str, dict[str, MailTemplate]] = {
+            locale: self._compile_locale(locale_templates)
+            for locale, locale_templates in templates.items()
+        }
+
+    def _compile_locale(
+        self, templates: dict[str, tuple[str, str]]
+    ) -> dict[str, MailTemplate]:
+        _, greeting = templates.get("greeting", ("", ""))
+        _, closing = templates.get("closing", ("", ""))
+        compiled = {}
+        for name, (subject, body) in templates.items():
+            if name in ("greeting", "closing"):
+                continue
+            compiled[name] = MailTemplate(
+                subject=string.Template(
+                    string.Template(f"[$service_name] {subject}").safe_substitute(
+                        self._common_params
+                    )
+                ),
+                body=string.Template(
+                    string.Template(greeting + body + closing).safe_substitute(
+                        self._common_params
+                    )
+                ),
+            )
+        return compiled
+
+    def get(self, name: str, locale: Optional[str] = None) -> MailTemplate:
+        """look up a template, falling back to the default locale if it does not exist for the given one"""
+        locale_templates = self._templates.get(locale or self.default_locale)
+        if locale_templates is not None and name in locale_templates:
+            return locale_templates[name]
+        return self._templates[self.default_locale][name]
+
+    def render(
+        self, name: str, params: dict, locale: Optional[str] = None
+    ) -> tuple[str, str]:
+        return self.get(name, locale).render(params)
+
+    def render_many(
+        self, name: str, params: Iterable[dict], locale: Optional[str] = None
+    ) -> list[tuple[str, str]]:
+        template = self.get(name, locale)
+        return [template.render(p) for p in params]
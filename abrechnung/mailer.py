@@ -1,9 +1,10 @@
 import asyncio
 import email.message
 import email.utils
-import itertools
 import logging
 import smtplib
+from dataclasses import dataclass
+from datetime import timedelta
 from typing import Optional
 
 import asyncpg
@@ -11,16 +12,41 @@ import asyncpg
 from . import subcommand
 from .config import Config
 from abrechnung.framework.database import create_db_pool
+from abrechnung.framework.loop_monitor import LoopMonitor
+from abrechnung.framework.smtp import SMTPConnectionPool
+from abrechnung.mail_templates import MailTemplateRegistry
+
+# claimed mails are not picked up by other mailer instances for this long
+MAIL_CLAIM_TIMEOUT = timedelta(minutes=10)
+# number of mails claimed from the outbox at once
+MAIL_CLAIM_BATCH_SIZE = 100
+
+
+@dataclass
+class OutgoingMail:
+    dest_address: str
+    dest_name: str
+    subject: str
+    body: str
 
 
 class MailerCli(subcommand.SubCommand):
-    def __init__(self, config: Config, **args):  # pylint: disable=super-init-not-called
+    def __init__(
+        self, config: Config, debug: bool = False, **args
+    ):  # pylint: disable=super-init-not-called
         del args  # unused
 
         self.config = config
+        self.debug = debug
         self.events: Optional[asyncio.Queue] = None
         self.psql = None
-        self.mailer = None
+        self.smtp_pool: Optional[SMTPConnectionPool] = None
+        self.templates = MailTemplateRegistry(
+            service_name=self.config.service.name, service_url=self.config.service.url
+        )
+        self.msgid_domain = self.config.email.address.split("@")[-1]
+        # wakes the mailer up once the next failed mail is due for a retry
+        self.retry_timer: Optional[asyncio.TimerHandle] = None
         self.logger = logging.getLogger(__name__)
 
         self.event_handlers = {
@@ -33,11 +59,22 @@ class MailerCli(subcommand.SubCommand):
                 "pending_password_recovery",
             ): self.on_user_password_recovery_notification,
             ("mailer", "pending_email_change"): self.on_user_email_update_notification,
+            ("mailer", "mail_outbox"): self.on_mail_outbox_notification,
         }
+        if self.config.email.digest_interval is not None:
+            self.event_handlers[("mailer", "group_digest")] = self.on_group_digest
 
     async def run(self):
+        loop_monitor = LoopMonitor(self.config.monitoring, debug=self.debug)
+        loop_monitor.start()
+
+        self.smtp_pool = SMTPConnectionPool(
+            self.get_mailer_instance,
+            max_connections=self.config.email.max_connections,
+            idle_timeout=self.config.email.connection_idle_timeout.total_seconds(),
+        )
         # just try to connect to the mailing server once
-        _ = self.get_mailer_instance()
+        await self.smtp_pool.connect()
         # only initialize the event queue once we are in a proper async context otherwise weird errors happen
         self.events = asyncio.Queue()
 
@@ -54,20 +91,41 @@ class MailerCli(subcommand.SubCommand):
         for handler in self.event_handlers.values():
             await handler()
 
+        sweeper = asyncio.create_task(self.sweep_periodically())
+
         # handle events
         while True:
-            event = await self.events.get()
-            if event is StopIteration:
+            events = [await self.events.get()]
+            # a burst of notifications only needs to be handled once, as every handler processes
+            # everything that is pending, hence handle all queued events together without duplicates
+            while not self.events.empty():
+                events.append(self.events.get_nowait())
+            if StopIteration in events:
                 break
-            handler = self.event_handlers.get(event)
-            if handler is None:
-                self.logger.info(f"unhandled event {event!r}")
-            else:
-                await handler()
 
+            for event in dict.fromkeys(events):
+                handler = self.event_handlers.get(event)
+                if handler is None:
+                    self.logger.info(f"unhandled event {event!r}")
+                else:
+                    await handler()
+
+        sweeper.cancel()
+
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
         await self.psql.remove_listener("mailer", self.notification_callback)
         await self.psql.close()
         await db_pool.close()
+        await self.smtp_pool.close()
+        await loop_monitor.stop()
+
+    async def sweep_periodically(self):
+        """regularly check for pending mails in case we missed a notification"""
+        while True:
+            await asyncio.sleep(self.config.email.sweep_interval.total_seconds())
+            for event in self.event_handlers:
+                self.events.put_nowait(event)
 
     def get_mailer_instance(self):
         mode = self.config.email.mode
@@ -120,164 +178,310 @@ class MailerCli(subcommand.SubCommand):
         assert connection is self.psql
         self.logger.info(f"psql log message: {message}")
 
-    def send_email(
-        self, *text_lines: str, subject: str, dest_address: str, dest_name: str
-    ):
-        self.logger.info(f"sending email to {dest_address}, subject: {subject}")
+    def render_mails(
+        self, template: str, recipients: list[tuple[str, str, dict]]
+    ) -> list[OutgoingMail]:
+        """render a mail template for a batch of (dest_address, dest_name, template params)"""
+        rendered = self.templates.render_many(
+            template,
+            ({"dest_name": dest_name, **params} for _, dest_name, params in recipients),
+        )
+        return [
+            OutgoingMail(
+                dest_address=dest_address,
+                dest_name=dest_name,
+                subject=subject,
+                body=body,
+            )
+            for (dest_address, dest_name, _), (subject, body) in zip(
+                recipients, rendered
+            )
+        ]
+
+    async def enqueue_mails(self, mails: list[OutgoingMail]):
+        """store rendered mails in the outbox, they are delivered once the insert is committed"""
+        await self.psql.execute(
+            "insert into mail_outbox (dest_address, dest_name, subject, body) "
+            "select * from unnest($1::text[], $2::text[], $3::text[], $4::text[])",
+            [mail.dest_address for mail in mails],
+            [mail.dest_name for mail in mails],
+            [mail.subject for mail in mails],
+            [mail.body for mail in mails],
+        )
 
-        # we do this to not have one long hanging open connection with the mail server
-        mailer = self.get_mailer_instance()
+    async def send_email(self, mail: asyncpg.Record) -> Optional[str]:
+        """deliver a mail from the outbox, returns an error message if delivery failed"""
+        self.logger.info(
+            f"sending email to {mail['dest_address']}, subject: {mail['subject']}"
+        )
 
-        from_addr = self.config.email.address
         msg = email.message.EmailMessage()
-        msg.set_content(
-            "\n".join(
-                itertools.chain(
-                    self.greeting_lines(dest_name),
-                    text_lines,
-                    self.closing_lines(),
-                )
+        msg.set_content(mail["body"])
+        msg["Subject"] = mail["subject"]
+        msg["To"] = mail["dest_address"]
+        msg["From"] = self.config.email.address
+        msg["Date"] = email.utils.localtime()
+        msg["Message-ID"] = email.utils.make_msgid(domain=self.msgid_domain)
+        try:
+            await self.smtp_pool.send_message(msg)
+            return None
+        except (smtplib.SMTPException, OSError) as e:
+            self.logger.warning(
+                f"Failed to send email to {mail['dest_address']} (attempt {mail['attempts']}): {e}"
             )
+            return str(e)
+
+    def retry_delay(self, attempts: int) -> timedelta:
+        """exponential backoff for the next delivery attempt after the given number of failed attempts"""
+        return min(
+            self.config.email.retry_delay * 2 ** (attempts - 1),
+            self.config.email.max_retry_delay,
         )
-        msg["Subject"] = f"[{self.config.service.name}] {subject}"
-        msg["To"] = dest_address
-        msg["From"] = from_addr
-        msg["Date"] = email.utils.localtime()
-        msg["Message-ID"] = email.utils.make_msgid(domain=from_addr.split("@")[-1])
-        mailer.send_message(msg)  # type: ignore
 
-    def greeting_lines(self, name: str):
-        return f"Beloved {name},", ""
+    async def on_mail_outbox_notification(self):
+        while True:
+            # claim a batch of due mails, SKIP LOCKED lets concurrent mailer instances claim disjoint batches
+            mails = await self.psql.fetch(
+                "update mail_outbox set attempts = attempts + 1, next_attempt_at = now() + $2::interval "
+                "where id in ("
+                "   select id from mail_outbox "
+                "   where sent_at is null and next_attempt_at <= now() and attempts < $3 "
+                "   order by next_attempt_at "
+                "   limit $1 "
+                "   for update skip locked"
+                ") "
+                "returning id, dest_address, dest_name, subject, body, attempts",
+                MAIL_CLAIM_BATCH_SIZE,
+                MAIL_CLAIM_TIMEOUT,
+                self.config.email.max_attempts,
+            )
+            if not mails:
+                break
 
-    def closing_lines(self):
-        return "", "Thoughtfully yours", "", f"    {self.config.service.name}"
+            errors = await asyncio.gather(*(self.send_email(mail) for mail in mails))
+
+            sent_ids = [
+                mail["id"] for mail, error in zip(mails, errors) if error is None
+            ]
+            failed = [
+                (mail, error) for mail, error in zip(mails, errors) if error is not None
+            ]
+            for mail, _ in failed:
+                if mail["attempts"] >= self.config.email.max_attempts:
+                    self.logger.error(
+                        f"Giving up sending email {mail['id']} to {mail['dest_address']} "
+                        f"after {mail['attempts']} attempts"
+                    )
+
+            await self.psql.execute(
+                "update mail_outbox set sent_at = now(), last_error = null where id = any($1::bigint[])",
+                sent_ids,
+            )
+            await self.psql.execute(
+                "update mail_outbox o set last_error = f.error, next_attempt_at = now() + f.delay "
+                "from unnest($1::bigint[], $2::text[], $3::interval[]) f(id, error, delay) "
+                "where o.id = f.id",
+                [mail["id"] for mail, _ in failed],
+                [error for _, error in failed],
+                [self.retry_delay(mail["attempts"]) for mail, _ in failed],
+            )
 
-    async def on_pending_registration_notification(self):
-        unsent_mails = await self.psql.fetch(
-            "select usr.id, usr.email, usr.username, pr.token, pr.valid_until "
-            "from pending_registration pr join usr on usr.id = pr.user_id "
-            "where pr.mail_next_attempt is not null and pr.mail_next_attempt < NOW() and pr.valid_until > NOW()"
+        await self.schedule_retry()
+
+    async def schedule_retry(self):
+        """make sure we wake up once the next pending mail is due"""
+        next_attempt_in = await self.psql.fetchval(
+            "select extract(epoch from min(next_attempt_at) - now()) "
+            "from mail_outbox where sent_at is null and attempts < $1",
+            self.config.email.max_attempts,
+        )
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+            self.retry_timer = None
+        if next_attempt_in is None:
+            return
+
+        self.retry_timer = asyncio.get_running_loop().call_later(
+            max(float(next_attempt_in), 0),
+            self.events.put_nowait,
+            ("mailer", "mail_outbox"),
         )
 
-        if not unsent_mails:
-            self.logger.info("no pending_registration mails are pending")
-
-        for row in unsent_mails:
-            try:
-                self.send_email(
-                    "it looks like you are attempting to create a user account.",
-                    "",
-                    "To complete your registration, visit",
-                    "",
-                    f"{self.config.service.url}/confirm-registration/{row['token']}",
-                    "",
-                    f"Your request will time out {row['valid_until']}.",
-                    "If you do not want to create a user account, just ignore this email.",
-                    subject="Confirm user account",
-                    dest_address=row["email"],
-                    dest_name=row["username"],
-                )
+    async def on_pending_registration_notification(self):
+        async with self.psql.transaction():
+            # claiming the rows by resetting mail_next_attempt makes sure each mail is only enqueued once
+            unsent_mails = await self.psql.fetch(
+                "update pending_registration pr set mail_next_attempt = null "
+                "from usr "
+                "where usr.id = pr.user_id "
+                "   and pr.mail_next_attempt is not null and pr.mail_next_attempt < NOW() and pr.valid_until > NOW() "
+                "returning usr.id, usr.email, usr.username, pr.token, pr.valid_until"
+            )
 
-                await self.psql.execute(
-                    "update pending_registration "
-                    "set mail_next_attempt = null "
-                    "where token = $1",
-                    row["token"],
-                )
-            except smtplib.SMTPException as e:
-                self.logger.warning(
-                    f"Failed to send email to user {row['username']} with email {row['email']}: {e}"
+            if not unsent_mails:
+                self.logger.info("no pending_registration mails are pending")
+                return
+
+            await self.enqueue_mails(
+                self.render_mails(
+                    "confirm_registration",
+                    [
+                        (
+                            row["email"],
+                            row["username"],
+                            {"token": row["token"], "valid_until": row["valid_until"]},
+                        )
+                        for row in unsent_mails
+                    ],
                 )
+            )
 
     async def on_user_password_recovery_notification(self):
-        unsent_mails = await self.psql.fetch(
-            "select usr.id, usr.username, usr.email, ppr.token, ppr.valid_until "
-            "from pending_password_recovery ppr join usr on usr.id = ppr.user_id "
-            "where ppr.mail_next_attempt is not null and ppr.mail_next_attempt < NOW() and ppr.valid_until > NOW()"
-        )
-
-        if not unsent_mails:
-            self.logger.info("no user_password_recovery mails are pending")
-
-        for row in unsent_mails:
-            try:
-                self.send_email(
-                    "it looks like you forgot your password; how embarrasing.",
-                    "",
-                    "To set a new one, visit",
-                    "",
-                    f"{self.config.service.url}/confirm-password-recovery/{row['token']}",
-                    "",
-                    f"Your request will time out {row['valid_until']}.",
-                    "If you do not want to reset your password, just ignore this email.",
-                    subject="Reset password",
-                    dest_address=row["email"],
-                    dest_name=row["username"],
-                )
+        async with self.psql.transaction():
+            unsent_mails = await self.psql.fetch(
+                "update pending_password_recovery ppr set mail_next_attempt = null "
+                "from usr "
+                "where usr.id = ppr.user_id "
+                "   and ppr.mail_next_attempt is not null and ppr.mail_next_attempt < NOW() and ppr.valid_until > NOW() "
+                "returning usr.id, usr.username, usr.email, ppr.token, ppr.valid_until"
+            )
 
-                await self.psql.execute(
-                    "update pending_password_recovery "
-                    "set mail_next_attempt = null "
-                    "where token = $1",
-                    row["token"],
-                )
-            except smtplib.SMTPException as e:
-                self.logger.warning(
-                    f"Failed to send email to user {row['username']} with email {row['email']}: {e}"
+            if not unsent_mails:
+                self.logger.info("no user_password_recovery mails are pending")
+                return
+
+            await self.enqueue_mails(
+                self.render_mails(
+                    "password_recovery",
+                    [
+                        (
+                            row["email"],
+                            row["username"],
+                            {"token": row["token"], "valid_until": row["valid_until"]},
+                        )
+                        for row in unsent_mails
+                    ],
                 )
+            )
 
     async def on_user_email_update_notification(self):
-        unsent_mails = await self.psql.fetch(
-            "select usr.id, usr.username, usr.email as old_email, pec.new_email as new_email, pec.token, "
-            "   pec.valid_until "
-            "from pending_email_change pec join usr on usr.id = pec.user_id "
-            "where pec.mail_next_attempt is not null and pec.mail_next_attempt < NOW() and pec.valid_until > NOW()"
-        )
+        async with self.psql.transaction():
+            unsent_mails = await self.psql.fetch(
+                "update pending_email_change pec set mail_next_attempt = null "
+                "from usr "
+                "where usr.id = pec.user_id "
+                "   and pec.mail_next_attempt is not null and pec.mail_next_attempt < NOW() and pec.valid_until > NOW() "
+                "returning usr.id, usr.username, usr.email as old_email, pec.new_email as new_email, pec.token, "
+                "   pec.valid_until"
+            )
 
-        if not unsent_mails:
-            self.logger.info("no user_email_update mails are pending")
-
-        for row in unsent_mails:
-            try:
-                self.send_email(
-                    "you want to change your email address",
-                    "",
-                    f"Your current email is: {row['old_email']}",
-                    f"You want to change it to: {row['new_email']}",
-                    "",
-                    "To confirm, see the mail that was sent to the new address.",
-                    "",
-                    f"Your request will time out {row['valid_until']}.",
-                    "If you do not want to change your email, just ignore this email.",
-                    subject="Change email",
-                    dest_address=row["old_email"],
-                    dest_name=row["username"],
+            if not unsent_mails:
+                self.logger.info("no user_email_update mails are pending")
+                return
+
+            params = [
+                {
+                    "old_email": row["old_email"],
+                    "new_email": row["new_email"],
+                    "token": row["token"],
+                    "valid_until": row["valid_until"],
+                }
+                for row in unsent_mails
+            ]
+            await self.enqueue_mails(
+                self.render_mails(
+                    "email_change_old_address",
+                    [
+                        (row["old_email"], row["username"], p)
+                        for row, p in zip(unsent_mails, params)
+                    ],
                 )
-
-                self.send_email(
-                    "you want to change your email address",
-                    "",
-                    f"Your current email is: {row['old_email']}",
-                    f"You want to change it to: {row['new_email']}",
-                    "",
-                    "To confirm, visit",
-                    "",
-                    f"{self.config.service.url}/confirm-email-change/{row['token']}",
-                    "",
-                    f"Your request will time out {row['valid_until']}.",
-                    "If you do not want to change your email, just ignore this email.",
-                    subject="Change email",
-                    dest_address=row["new_email"],
-                    dest_name=row["username"],
+                + self.render_mails(
+                    "email_change_new_address",
+                    [
+                        (row["new_email"], row["username"], p)
+                        for row, p in zip(unsent_mails, params)
+                    ],
                 )
+            )
 
-                await self.psql.execute(
-                    "update pending_email_change "
-                    "set mail_next_attempt = null "
-                    "where token = $1",
-                    row["token"],
-                )
-            except smtplib.SMTPException as e:
-                self.logger.warning(
-                    f"Failed to send email to user {row['username']} with email {row['email']}: {e}"
+    async def on_group_digest(self):
+        digest_interval = self.config.email.digest_interval
+        async with self.psql.transaction():
+            # users without a digest so far get one covering the last interval
+            await self.psql.execute(
+                "insert into group_digest_state (user_id, last_digest_at) "
+                "select id, now() - $1::interval from usr "
+                "where not pending and not deleted and not is_guest_user "
+                "on conflict do nothing",
+                digest_interval,
+            )
+            # claim all due digests and collect the activity in all groups of their users at once,
+            # the log entries and transaction changes of each group are looked up via the indexes on
+            # group_log (group_id, logged_at) and transaction_revision (committed)
+            digests = await self.psql.fetch(
+                "with due as ("
+                "   update group_digest_state ds set last_digest_at = now() "
+                "   from ("
+                "       select user_id, last_digest_at from group_digest_state "
+                "       where last_digest_at <= now() - $1::interval "
+                "       for update skip locked"
+                "   ) prev "
+                "   where ds.user_id = prev.user_id "
+                "   returning ds.user_id, prev.last_digest_at as since"
+                "), activity as ("
+                "   select "
+                "       due.user_id, "
+                "       grp.name as group_name, "
+                "       ("
+                "           select count(distinct tr.transaction_id) "
+                "           from transaction_revision tr join transaction t on tr.transaction_id = t.id "
+                "           where t.group_id = grp.id and tr.committed > due.since and tr.user_id != due.user_id"
+                "       ) as n_transactions, "
+                "       ("
+                "           select count(*) from group_log gl "
+                "           where gl.group_id = grp.id and gl.logged_at > due.since and gl.user_id != due.user_id "
+                "               and gl.type != 'transaction-committed'"
+                "       ) as n_log_entries "
+                "   from due "
+                "   join group_membership gm on gm.user_id = due.user_id "
+                "   join grp on grp.id = gm.group_id"
+                ") "
+                "select "
+                "   usr.email, usr.username, "
+                "   array_agg(a.group_name order by a.group_name) as group_names, "
+                "   array_agg(a.n_transactions order by a.group_name) as n_transactions, "
+                "   array_agg(a.n_log_entries order by a.group_name) as n_log_entries "
+                "from activity a join usr on usr.id = a.user_id "
+                "where a.n_transactions > 0 or a.n_log_entries > 0 "
+                "group by usr.id",
+                digest_interval,
+            )
+
+            if not digests:
+                self.logger.info("no group digests are due")
+                return
+
+            await self.enqueue_mails(
+                self.render_mails(
+                    "group_digest",
+                    [
+                        (
+                            row["email"],
+                            row["username"],
+                            {
+                                "activity": "\n".join(
+                                    f"  {group_name}: {n_transactions} changed transaction(s), "
+                                    f"{n_log_entries} other update(s)"
+                                    for group_name, n_transactions, n_log_entries in zip(
+                                        row["group_names"],
+                                        row["n_transactions"],
+                                        row["n_log_entries"],
+                                    )
+                                )
+                            },
+                        )
+                        for row in digests
+                    ],
                 )
+            )
@@ -0,0 +1,5 @@
+"""
+Benchmarks of the abrechnung backend against a local PostgreSQL database.
+
+Run via ``python -m benchmarks -c abrechnung.yaml``, see ``python -m benchmarks --help``.
+"""
@@ -0,0 +1,225 @@
+"""
+Seed a reproducible large group via bulk COPY and benchmark the backend against it.
+
+The results are written as json such that they can be compared between commits.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from abrechnung import __version__
+from abrechnung.config import read_config
+from abrechnung.http.cli import ApiCli
+from .cases import (
+    CASES,
+    bench_commit_purchase,
+    bench_sync_transactions,
+    bench_websocket_fanout,
+    summarize,
+)
+from .datasets import DatasetSpec, seed_dataset
+
+logger = logging.getLogger("benchmarks")
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(
+    config_path: str,
+    spec: DatasetSpec,
+    cases: list[str],
+    repeat: int,
+    sync_batch_size: int,
+    positions: int,
+    ws_clients: int,
+    ws_port: int,
+) -> dict:
+    config = read_config(Path(config_path))
+    started_at = datetime.now(timezone.utc)
+    api = ApiCli(config=config)
+    await api._setup()  # pylint: disable=protected-access
+
+    try:
+        name = f"benchmark-{int(time.time())}"
+        logger.info(
+            f"Seeding group {name} with {spec.n_accounts} accounts and {spec.n_transactions} transactions"
+        )
+        start = time.perf_counter()
+        dataset = await seed_dataset(
+            api.db_pool, api.user_service, api.group_service, spec, name
+        )
+        seed_duration = time.perf_counter() - start
+        logger.info(f"Seeding took {seed_duration:.1f}s")
+
+        case_funcs = dict(CASES)
+        case_funcs["sync_transactions"] = functools.partial(
+            bench_sync_transactions, batch_size=sync_batch_size
+        )
+        case_funcs["commit_purchase"] = functools.partial(
+            bench_commit_purchase, n_positions=positions
+        )
+        case_funcs["websocket_fanout"] = functools.partial(
+            bench_websocket_fanout, n_clients=ws_clients, port=ws_port
+        )
+
+        rng = random.Random(spec.seed)
+        results = {}
+        for case in cases:
+            logger.info(f"Running {case}")
+            durations = await case_funcs[case](api, dataset, rng, repeat)
+            results[case] = summarize(durations)
+            logger.info(
+                f"{case}: p50 {results[case].get('p50_ms', 0):.1f} ms, p99 {results[case].get('p99_ms', 0):.1f} ms"
+            )
+    finally:
+        await api._teardown()  # pylint: disable=protected-access
+
+    return {
+        "version": __version__,
+        "git_revision": _git_revision(),
+        "started_at": started_at.isoformat(),
+        "dataset": {
+            **spec.as_dict(),
+            "group_id": dataset.group_id,
+            "seed_seconds": seed_duration,
+        },
+        "parameters": {
+            "repeat": repeat,
+            "sync_batch_size": sync_batch_size,
+            "purchase_positions": positions,
+            "websocket_clients": ws_clients,
+            "notification_debounce_ms": config.api.notification_debounce.total_seconds()
+            * 1000,
+        },
+        "results": results,
+    }
+
+
+def parse_args():
+    cli = argparse.ArgumentParser(description=__doc__)
+    cli.add_argument(
+        "-c",
+        "--config-path",
+        default="/etc/abrechnung/abrechnung.yaml",
+        help="config file, default: %(default)s",
+    )
+    cli.add_argument(
+        "--cases",
+        nargs="+",
+        choices=list(CASES.keys()),
+        default=list(CASES.keys()),
+        help="benchmark cases to run, default: all",
+    )
+    cli.add_argument(
+        "--transactions",
+        type=int,
+        default=10_000,
+        help="number of transactions to seed, default: %(default)s",
+    )
+    cli.add_argument(
+        "--accounts",
+        type=int,
+        default=1000,
+        help="number of accounts to seed, default: %(default)s",
+    )
+    cli.add_argument(
+        "--clearing-depth",
+        type=int,
+        default=8,
+        help="length of the chains of clearing accounts, default: %(default)s",
+    )
+    cli.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="random seed of the generated dataset, default: %(default)s",
+    )
+    cli.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="number of measurements per case, default: %(default)s",
+    )
+    cli.add_argument(
+        "--sync-batch-size",
+        type=int,
+        default=20,
+        help="number of transactions uploaded per sync, default: %(default)s",
+    )
+    cli.add_argument(
+        "--positions",
+        type=int,
+        default=100,
+        help="number of positions of the purchases committed by commit_purchase, default: %(default)s",
+    )
+    cli.add_argument(
+        "--ws-clients",
+        type=int,
+        default=50,
+        help="number of websocket clients receiving notifications, default: %(default)s",
+    )
+    cli.add_argument(
+        "--ws-port",
+        type=int,
+        default=8765,
+        help="local port the api is served on for the websocket benchmark, default: %(default)s",
+    )
+    cli.add_argument(
+        "-o",
+        "--output",
+        default="-",
+        help="file the json results are written to, default: stdout",
+    )
+    return cli.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="[%(asctime)s] %(message)s", stream=sys.stderr
+    )
+    logging.getLogger("abrechnung").setLevel(logging.WARNING)
+
+    result = asyncio.run(
+        main(
+            config_path=args.config_path,
+            spec=DatasetSpec(
+                n_transactions=args.transactions,
+                n_accounts=args.accounts,
+                clearing_depth=args.clearing_depth,
+                seed=args.seed,
+            ),
+            cases=args.cases,
+            repeat=args.repeat,
+            sync_batch_size=args.sync_batch_size,
+            positions=args.positions,
+            ws_clients=args.ws_clients,
+            ws_port=args.ws_port,
+        )
+    )
+    serialized = json.dumps(result, indent=2)
+    if args.output == "-":
+        print(serialized)
+    else:
+        Path(args.output).write_text(serialized + "\n", encoding="utf-8")
@@ -0,0 +1,401 @@
+"""
+The individual benchmark cases, each returns the measured durations in seconds.
+"""
+
+import asyncio
+import json
+import random
+import time
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable
+
+import uvicorn
+import websockets
+
+from abrechnung.application import balances
+from abrechnung.application.transactions import RawTransaction
+from abrechnung.domain.transactions import TransactionPosition
+from abrechnung.http.cli import ApiCli
+from .datasets import Dataset
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def summarize(durations: list[float]) -> dict:
+    """statistics of a list of durations in seconds, reported in milliseconds"""
+    if not durations:
+        return {"n": 0}
+    samples = sorted(durations)
+    stats = {
+        "n": len(samples),
+        "min_ms": samples[0] * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+    for q in QUANTILES:
+        stats[f"p{q * 100:g}_ms"] = (
+            samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+        )
+    return stats
+
+
+async def _time(func: Callable[[], Awaitable], repeat: int) -> list[float]:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _random_transfer(
+    rng: random.Random, dataset: Dataset, transaction_id: int
+) -> RawTransaction:
+    creditor, debitor = rng.sample(dataset.personal_account_ids, k=2)
+    return RawTransaction(
+        id=transaction_id,
+        group_id=dataset.group_id,
+        type="transfer",
+        name=f"Benchmark transfer {transaction_id}",
+        description=None,
+        value=round(rng.uniform(1, 200), 2),
+        currency_symbol="€",
+        currency_conversion_rate=1.0,
+        billed_at=date.today(),
+        deleted=False,
+        creditor_shares={creditor: 1.0},
+        debitor_shares={debitor: 1.0},
+        tags=[],
+        positions=[],
+    )
+
+
+async def _sync_transfers(
+    api: ApiCli, dataset: Dataset, rng: random.Random, n: int
+) -> None:
+    batch = [_random_transfer(rng, dataset, -(i + 1)) for i in range(n)]
+    id_map = await api.transaction_service.sync_transactions(
+        user=dataset.user, group_id=dataset.group_id, transactions=batch
+    )
+    dataset.benchmark_transaction_ids.extend(id_map.values())
+
+
+async def _update_random_transfer(
+    api: ApiCli, dataset: Dataset, rng: random.Random, perform_commit: bool
+) -> int:
+    """
+    change one of the transfers created while benchmarking, these have personal accounts as creditor and debitor
+    which allows to change them without knowing their type
+    """
+    if not dataset.benchmark_transaction_ids:
+        await _sync_transfers(api, dataset, rng, 20)
+    transaction_id = rng.choice(dataset.benchmark_transaction_ids)
+    transfer = _random_transfer(rng, dataset, transaction_id)
+    await api.transaction_service.update_transaction(
+        user=dataset.user,
+        transaction_id=transaction_id,
+        value=transfer.value,
+        name=transfer.name,
+        description=transfer.description,
+        billed_at=transfer.billed_at,
+        currency_symbol=transfer.currency_symbol,
+        currency_conversion_rate=transfer.currency_conversion_rate,
+        tags=transfer.tags,
+        creditor_shares=transfer.creditor_shares,
+        debitor_shares=transfer.debitor_shares,
+        perform_commit=perform_commit,
+    )
+    return transaction_id
+
+
+async def bench_list_transactions(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    del rng  # unused
+    return await _time(
+        lambda: api.transaction_service.list_transactions(
+            user=dataset.user, group_id=dataset.group_id
+        ),
+        repeat,
+    )
+
+
+async def bench_list_accounts(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    del rng  # unused
+    return await _time(
+        lambda: api.account_service.list_accounts(
+            user=dataset.user, group_id=dataset.group_id
+        ),
+        repeat,
+    )
+
+
+async def bench_balances(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    del rng  # unused
+    return await _time(
+        lambda: api.balance_service.get_balances(
+            user=dataset.user, group_id=dataset.group_id
+        ),
+        repeat,
+    )
+
+
+async def bench_balances_as_of(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    """balances at an explicit point in time, the clearing graph is looked up instead of cached"""
+    del rng  # unused
+    return await _time(
+        lambda: api.balance_service.get_balances(
+            user=dataset.user,
+            group_id=dataset.group_id,
+            as_of=datetime.now(timezone.utc),
+        ),
+        repeat,
+    )
+
+
+async def _bench_balance_computation(
+    api: ApiCli, dataset: Dataset, repeat: int, compute
+) -> list[float]:
+    """time only the in-memory computation of the balances, the data is fetched once"""
+    async with api.db_pool.acquire() as conn:
+        data = await balances.fetch_balance_data(conn, dataset.group_id)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compute(data)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def bench_balance_computation_python(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    del rng  # unused
+    return await _bench_balance_computation(
+        api, dataset, repeat, balances.compute_balances_python
+    )
+
+
+async def bench_balance_computation_numpy(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    del rng  # unused
+    if balances.np is None:
+        return []
+    return await _bench_balance_computation(
+        api, dataset, repeat, balances.compute_balances_numpy
+    )
+
+
+async def bench_sync_transactions(
+    api: ApiCli,
+    dataset: Dataset,
+    rng: random.Random,
+    repeat: int,
+    batch_size: int = 20,
+) -> list[float]:
+    """upload batches of new transfers as an offline client does, the created transfers are kept for later cases"""
+    return await _time(
+        lambda: _sync_transfers(api, dataset, rng, batch_size),
+        repeat,
+    )
+
+
+async def bench_commit(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    """time only the commit of a pending change"""
+    durations = []
+    for _ in range(repeat):
+        transaction_id = await _update_random_transfer(
+            api, dataset, rng, perform_commit=False
+        )
+        start = time.perf_counter()
+        await api.transaction_service.commit_transaction(
+            user=dataset.user, transaction_id=transaction_id
+        )
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def bench_commit_purchase(
+    api: ApiCli,
+    dataset: Dataset,
+    rng: random.Random,
+    repeat: int,
+    n_positions: int = 100,
+) -> list[float]:
+    """time only the commit of a new purchase with n_positions positions"""
+    durations = []
+    for i in range(repeat):
+        creditor = rng.choice(dataset.personal_account_ids)
+        positions = [
+            TransactionPosition(
+                id=-(j + 1),
+                name=f"Item {j}",
+                price=round(rng.uniform(0.5, 20), 2),
+                communist_shares=0,
+                usages={
+                    account: 1.0
+                    for account in rng.sample(dataset.personal_account_ids, k=2)
+                },
+            )
+            for j in range(n_positions)
+        ]
+        transaction_id = await api.transaction_service.create_transaction(
+            user=dataset.user,
+            group_id=dataset.group_id,
+            type="purchase",
+            name=f"Benchmark purchase {i}",
+            description=None,
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            value=round(sum(position.price for position in positions), 2),
+            tags=[],
+            creditor_shares={creditor: 1.0},
+            debitor_shares={creditor: 1.0},
+            positions=positions,
+        )
+        start = time.perf_counter()
+        await api.transaction_service.commit_transaction(
+            user=dataset.user, transaction_id=transaction_id
+        )
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def bench_commit_clearing_account(
+    api: ApiCli, dataset: Dataset, rng: random.Random, repeat: int
+) -> list[float]:
+    """change the shares of random clearing accounts to random personal accounts, each change is committed directly"""
+    personal_account_ids = set(dataset.personal_account_ids)
+    clearing_account_ids = [
+        account_id
+        for account_id in dataset.account_ids
+        if account_id not in personal_account_ids
+    ]
+
+    async def update():
+        account_id = rng.choice(clearing_account_ids)
+        await api.account_service.update_account(
+            user=dataset.user,
+            account_id=account_id,
+            name=f"Event {account_id}",
+            description="",
+            date_info=date.today(),
+            clearing_shares={
+                account: float(rng.randint(1, 3))
+                for account in rng.sample(dataset.personal_account_ids, k=3)
+            },
+        )
+
+    return await _time(update, repeat)
+
+
+async def bench_websocket_fanout(
+    api: ApiCli,
+    dataset: Dataset,
+    rng: random.Random,
+    repeat: int,
+    n_clients: int = 50,
+    port: int = 8765,
+) -> list[float]:
+    """
+    time from committing a change until each of n_clients websocket clients subscribed to the group received its
+    notification, this includes the notification debounce interval of the api.
+    """
+    server = uvicorn.Server(
+        uvicorn.Config(api.api, host="127.0.0.1", port=port, log_level="warning")
+    )
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            await server_task
+            raise RuntimeError("api server did not start")
+        await asyncio.sleep(0.01)
+
+    _, _, session_token = await api.user_service.login_user(
+        username=dataset.user.username,
+        password=dataset.password,
+        session_name="benchmark",
+    )
+    token = await api.user_service.get_access_token_from_session_token(session_token)
+
+    clients = []
+    queues: list[asyncio.Queue] = []
+    readers = []
+
+    async def read(client, queue: asyncio.Queue):
+        async for message in client:
+            if json.loads(message)["type"] == "notification":
+                queue.put_nowait(time.perf_counter())
+
+    durations = []
+    try:
+        for _ in range(n_clients):
+            client = await websockets.connect(f"ws://127.0.0.1:{port}/api/v1/ws")
+            await client.send(
+                json.dumps(
+                    {
+                        "type": "subscribe",
+                        "token": token,
+                        "data": {
+                            "subscription_type": "transaction",
+                            "element_id": dataset.group_id,
+                        },
+                    }
+                )
+            )
+            response = json.loads(await client.recv())
+            if response["type"] != "subscribe_success":
+                raise RuntimeError(f"websocket subscription failed: {response}")
+            queue: asyncio.Queue = asyncio.Queue()
+            clients.append(client)
+            queues.append(queue)
+            readers.append(asyncio.create_task(read(client, queue)))
+
+        # leave enough time between changes such that the notifications of one change are not debounced into the next
+        settle_time = 2 * api.cfg.api.notification_debounce.total_seconds() + 0.1
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await _update_random_transfer(api, dataset, rng, perform_commit=True)
+            received = await asyncio.wait_for(
+                asyncio.gather(*(queue.get() for queue in queues)), timeout=30
+            )
+            durations.extend(t - start for t in received)
+
+            await asyncio.sleep(settle_time)
+            for queue in queues:
+                while not queue.empty():
+                    queue.get_nowait()
+    finally:
+        for reader in readers:
+            reader.cancel()
+        for client in clients:
+            await client.close()
+        server.should_exit = True
+        await server_task
+
+    return durations
+
+
+CASES = {
+    "list_transactions": bench_list_transactions,
+    "list_accounts": bench_list_accounts,
+    "balances": bench_balances,
+    "balances_as_of": bench_balances_as_of,
+    "balance_computation_python": bench_balance_computation_python,
+    "balance_computation_numpy": bench_balance_computation_numpy,
+    "sync_transactions": bench_sync_transactions,
+    "commit_transaction": bench_commit,
+    "commit_purchase": bench_commit_purchase,
+    "commit_clearing_account": bench_commit_clearing_account,
+    "websocket_fanout": bench_websocket_fanout,
+}
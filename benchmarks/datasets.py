@@ -0,0 +1,199 @@
+"""
+Reproducible large groups for benchmarking.
+
+All data is generated from a single seed, the same dataset spec and seed always produce the same accounts and
+transactions. Transactions are generated and bulk loaded in chunks to keep memory usage bounded for large datasets.
+"""
+
+import random
+from dataclasses import asdict, dataclass, field
+from datetime import date, timedelta
+from typing import Iterator
+
+import asyncpg
+
+from abrechnung.application.groups import GroupService
+from abrechnung.application.users import UserService
+from abrechnung.database.bulk import (
+    BulkAccount,
+    BulkPosition,
+    BulkTransaction,
+    bulk_load_accounts,
+    bulk_load_transactions,
+)
+from abrechnung.domain.users import User
+
+BENCHMARK_PASSWORD = "benchmark"
+
+FIRST_BILLING_DATE = date(2020, 1, 1)
+BILLING_DAYS = 3 * 365
+
+
+@dataclass
+class DatasetSpec:
+    n_transactions: int = 10_000
+    n_accounts: int = 1000
+    # every n-th account is a clearing account
+    clearing_account_ratio: int = 10
+    # clearing accounts are arranged in chains of this length, each one distributing to the next
+    clearing_depth: int = 8
+    # fraction of purchases which have positions
+    position_ratio: float = 0.2
+    seed: int = 0
+    chunk_size: int = 50_000
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class Dataset:
+    user: User
+    password: str
+    group_id: int
+    account_ids: list[int]
+    personal_account_ids: list[int]
+    transaction_ids: list[int]
+    # transfers between personal accounts created while benchmarking, these are the ones changed by later cases
+    benchmark_transaction_ids: list[int] = field(default_factory=list)
+
+
+def generate_accounts(spec: DatasetSpec, rng: random.Random) -> list[BulkAccount]:
+    """
+    personal accounts first, followed by the clearing accounts. clearing accounts are generated in chains
+    where each account distributes to a few personal accounts and the previous account of its chain.
+    """
+    n_clearing = spec.n_accounts // spec.clearing_account_ratio
+    n_personal = spec.n_accounts - n_clearing
+    accounts = [BulkAccount(name=f"Account {i}") for i in range(n_personal)]
+    for i in range(n_clearing):
+        index = n_personal + i
+        shares = {
+            account: float(rng.randint(1, 3))
+            for account in rng.sample(range(n_personal), k=min(n_personal, 3))
+        }
+        if i % spec.clearing_depth != 0:
+            shares[index - 1] = float(rng.randint(1, 3))
+        accounts.append(
+            BulkAccount(
+                name=f"Event {i}",
+                type="clearing",
+                date_info=FIRST_BILLING_DATE
+                + timedelta(days=rng.randrange(BILLING_DAYS)),
+                clearing_shares=shares,
+            )
+        )
+    return accounts
+
+
+def _random_shares(rng: random.Random, n_accounts: int, k: int) -> dict[int, float]:
+    return {
+        account: float(rng.randint(1, 3))
+        for account in rng.sample(range(n_accounts), k=min(n_accounts, k))
+    }
+
+
+def generate_transactions(
+    spec: DatasetSpec, rng: random.Random, n_accounts: int
+) -> Iterator[list[BulkTransaction]]:
+    """yields chunks of at most spec.chunk_size transactions, 70% purchases, 20% transfers and 10% mimos"""
+    for chunk_start in range(0, spec.n_transactions, spec.chunk_size):
+        chunk = []
+        for i in range(
+            chunk_start, min(chunk_start + spec.chunk_size, spec.n_transactions)
+        ):
+            kind = rng.random()
+            billed_at = FIRST_BILLING_DATE + timedelta(days=rng.randrange(BILLING_DAYS))
+            value = round(rng.uniform(1, 200), 2)
+            if kind < 0.7:
+                positions = []
+                if rng.random() < spec.position_ratio:
+                    positions = [
+                        BulkPosition(
+                            name=f"Item {j}",
+                            price=round(rng.uniform(0.5, 20), 2),
+                            communist_shares=float(rng.random() < 0.3),
+                            usages=_random_shares(rng, n_accounts, rng.randint(1, 3)),
+                        )
+                        for j in range(rng.randint(1, 5))
+                    ]
+                transaction = BulkTransaction(
+                    type="purchase",
+                    name=f"Purchase {i}",
+                    value=value,
+                    billed_at=billed_at,
+                    creditor_shares={rng.randrange(n_accounts): 1.0},
+                    debitor_shares=_random_shares(rng, n_accounts, rng.randint(1, 6)),
+                    positions=positions,
+                )
+            elif kind < 0.9:
+                creditor, debitor = rng.sample(range(n_accounts), k=2)
+                transaction = BulkTransaction(
+                    type="transfer",
+                    name=f"Transfer {i}",
+                    value=value,
+                    billed_at=billed_at,
+                    creditor_shares={creditor: 1.0},
+                    debitor_shares={debitor: 1.0},
+                )
+            else:
+                transaction = BulkTransaction(
+                    type="mimo",
+                    name=f"Mimo {i}",
+                    value=value,
+                    billed_at=billed_at,
+                    creditor_shares=_random_shares(rng, n_accounts, rng.randint(1, 3)),
+                    debitor_shares=_random_shares(rng, n_accounts, rng.randint(1, 3)),
+                )
+            chunk.append(transaction)
+        yield chunk
+
+
+async def seed_dataset(
+    db_pool: asyncpg.Pool,
+    user_service: UserService,
+    group_service: GroupService,
+    spec: DatasetSpec,
+    name: str,
+) -> Dataset:
+    """create a benchmark user owning a new group filled with the generated dataset"""
+    rng = random.Random(spec.seed)
+    user_id = await user_service.demo_register_user(
+        username=name, email=f"{name}@benchmark.invalid", password=BENCHMARK_PASSWORD
+    )
+    user = await user_service.get_user(user_id=user_id)
+    group_id = await group_service.create_group(
+        user=user,
+        name=name,
+        description="benchmark group",
+        currency_symbol="€",
+        terms="",
+        add_user_account_on_join=False,
+    )
+
+    accounts = generate_accounts(spec, rng)
+    transaction_ids = []
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            account_ids = await bulk_load_accounts(conn, group_id, user.id, accounts)
+        for chunk in generate_transactions(spec, rng, len(account_ids)):
+            async with conn.transaction():
+                transaction_ids.extend(
+                    await bulk_load_transactions(
+                        conn, group_id, user.id, account_ids, chunk
+                    )
+                )
+        await conn.execute("analyze")
+
+    return Dataset(
+        user=user,
+        password=BENCHMARK_PASSWORD,
+        group_id=group_id,
+        account_ids=account_ids,
+        personal_account_ids=[
+            account_id
+            for account_id, account in zip(account_ids, accounts)
+            if account.type == "personal"
+        ],
+        transaction_ids=transaction_ids,
+    )
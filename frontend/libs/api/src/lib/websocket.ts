@@ -12,7 +12,8 @@ interface AccountChanged {
 interface TransactionChanged {
     type: "transaction";
     groupId: number;
-    transactionId: number;
+    // changes of transaction contents are coalesced per database statement and can affect many transactions
+    transactionIds: number[];
     revisionCommittedAt: string | null;
     revisionStartedAt: string;
     version: number;
@@ -53,6 +54,14 @@ export type NotificationPayload =
 type SubscriptionType = NotificationPayload["type"];
 type SubscriptionCallback = (payload: NotificationPayload) => void;
 
+// sent by the server after it lost its database connection, notifications might have been missed since lastSeen
+export interface GroupResync {
+    groupId: number;
+    // last_changed of the latest change the client was notified about, null if there was none
+    lastSeen: string | null;
+}
+type ResyncCallback = (groups: GroupResync[]) => void;
+
 const parseNotificationPayload = (
     subscriptionType: SubscriptionType,
     payload: any
@@ -71,7 +80,7 @@ const parseNotificationPayload = (
             return {
                 type: "transaction",
                 groupId: payload.element_id as number,
-                transactionId: payload.transaction_id as number,
+                transactionIds: (payload.transaction_ids ?? [payload.transaction_id]) as number[],
                 revisionCommittedAt: payload.revision_committed as string | null,
                 revisionStartedAt: payload.revision_started as string,
                 version: payload.version as number,
@@ -116,6 +125,7 @@ export class AbrechnungWebSocket {
         };
     } = {};
     private bareNotificationHandler: SubscriptionCallback[] = [];
+    private resyncHandlers: ResyncCallback[] = [];
 
     constructor(private url: string, private api: Api) {
         // cannot reuse init() here as otherwise ws will be uninitialized
@@ -146,11 +156,15 @@ export class AbrechnungWebSocket {
                 this.send(elem);
             }
         }
+        const subscriptions: { subscriptionType: string; elementId: number }[] = [];
         for (const subscriptionType in this.notificationHandlers) {
             for (const elementId in this.notificationHandlers[subscriptionType]) {
-                this.sendSubscriptionRequest(subscriptionType, Number(elementId));
+                subscriptions.push({ subscriptionType, elementId: Number(elementId) });
             }
         }
+        if (subscriptions.length > 0) {
+            this.sendBatchSubscriptionRequest(subscriptions);
+        }
     };
 
     private onclose = () => {
@@ -196,6 +210,14 @@ export class AbrechnungWebSocket {
                     }
                 }
             }
+        } else if (msg.type === "resync") {
+            const groups: GroupResync[] = msg.data.groups.map((group: any) => ({
+                groupId: group.group_id as number,
+                lastSeen: (group.last_seen ?? null) as string | null,
+            }));
+            for (const callback of this.resyncHandlers) {
+                callback(groups);
+            }
         } else {
             // console.log("WS received unhandled message", msg);
         }
@@ -228,6 +250,24 @@ export class AbrechnungWebSocket {
             });
     };
 
+    public sendBatchSubscriptionRequest = (subscriptions: { subscriptionType: string; elementId: number }[]) => {
+        this.api
+            .getToken()
+            .then((token: string) => {
+                return this.send({
+                    type: "subscribe_many",
+                    token: token,
+                    data: subscriptions.map((s) => ({
+                        subscription_type: s.subscriptionType,
+                        element_id: s.elementId,
+                    })),
+                });
+            })
+            .catch((err) => {
+                console.error("error while trying to send subscribe request", err);
+            });
+    };
+
     public sendUnsubscriptionRequest = (subscriptionType: string, elementId: number) => {
         this.api
             .getToken()
@@ -283,4 +323,11 @@ export class AbrechnungWebSocket {
         console.log("removing bare notification handler");
         this.bareNotificationHandler = this.bareNotificationHandler.filter((h) => h !== handler);
     };
+
+    public addResyncHandler = (handler: ResyncCallback) => {
+        this.resyncHandlers.push(handler);
+    };
+    public removeResyncHandler = (handler: ResyncCallback) => {
+        this.resyncHandlers = this.resyncHandlers.filter((h) => h !== handler);
+    };
 }
@@ -112,4 +112,39 @@ describe("computeAccountBalancesForTransaction", () => {
         const effect = computeTransactionBalanceEffect(t, positions);
         expect(effect).toStrictEqual(expectedEffect);
     });
+
+    it("should convert the balance effect to the group currency", () => {
+        const t = generateTransaction(0, "purchase", 100, { 1: 1 }, { 1: 1, 2: 1 }) as Purchase;
+        t.currencyConversionRate = 2.0;
+        t.positions = [1];
+        const positions: TransactionPosition[] = [
+            {
+                id: 1,
+                transactionID: 0,
+                price: 20,
+                name: "item1",
+                communistShares: 0,
+                usages: { 2: 1 },
+                deleted: false,
+            },
+        ];
+
+        const expectedEffect: TransactionBalanceEffect = {
+            1: {
+                commonCreditors: 200,
+                commonDebitors: 80,
+                positions: 0,
+                total: 120,
+            },
+            2: {
+                commonCreditors: 0,
+                commonDebitors: 80,
+                positions: 40,
+                total: -120,
+            },
+        };
+
+        const effect = computeTransactionBalanceEffect(t, positions);
+        expect(effect).toStrictEqual(expectedEffect);
+    });
 });
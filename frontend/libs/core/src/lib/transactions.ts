@@ -97,9 +97,14 @@ export const computeTransactionBalanceEffect = (
         }
     });
 
+    // the transaction value and position prices are given in the transaction currency, convert them to the group currency
+    const conversionRate = transaction.currencyConversionRate;
     for (const accountID in accountBalances) {
         const b = accountBalances[accountID];
-        accountBalances[accountID].total = b.commonCreditors - b.positions - b.commonDebitors;
+        b.positions *= conversionRate;
+        b.commonCreditors *= conversionRate;
+        b.commonDebitors *= conversionRate;
+        b.total = b.commonCreditors - b.positions - b.commonDebitors;
     }
 
     return accountBalances;
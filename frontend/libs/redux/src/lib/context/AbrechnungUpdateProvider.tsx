@@ -1,9 +1,9 @@
-import { AbrechnungWebSocket, Api, NotificationPayload } from "@abrechnung/api";
+import { AbrechnungWebSocket, Api, GroupResync, NotificationPayload } from "@abrechnung/api";
 import { Subscription } from "../types";
 import { useDispatch } from "react-redux";
 import React from "react";
-import { fetchAccount } from "../accounts";
-import { fetchTransaction } from "../transactions";
+import { fetchAccount, fetchAccounts } from "../accounts";
+import { fetchTransaction, fetchTransactions } from "../transactions";
 import { AnyAction, ThunkDispatch } from "@reduxjs/toolkit";
 import { IRootState } from "../types";
 import { subscribe, unsubscribe } from "../subscriptions";
@@ -38,7 +38,9 @@ export const AbrechnungUpdateProvider: React.FC<IAbrechnungUpdateProvider> = ({
                     dispatch(fetchAccount({ api, accountId: notificationPayload.accountId }));
                     break;
                 case "transaction":
-                    dispatch(fetchTransaction({ api, transactionId: notificationPayload.transactionId }));
+                    for (const transactionId of notificationPayload.transactionIds) {
+                        dispatch(fetchTransaction({ api, transactionId }));
+                    }
                     break;
                 case "group":
                     dispatch(fetchGroups({ api }));
@@ -55,8 +57,20 @@ export const AbrechnungUpdateProvider: React.FC<IAbrechnungUpdateProvider> = ({
             }
         };
 
+        // notifications might have been lost, refetch everything of the affected groups
+        const resyncCallback = (groups: GroupResync[]) => {
+            for (const { groupId } of groups) {
+                dispatch(fetchTransactions({ api, groupId, fetchAnyway: true }));
+                dispatch(fetchAccounts({ api, groupId, fetchAnyway: true }));
+            }
+        };
+
         websocket.addBareNotificationHandler(callback);
-        return () => websocket.removeBareNotificationHandler(callback);
+        websocket.addResyncHandler(resyncCallback);
+        return () => {
+            websocket.removeBareNotificationHandler(callback);
+            websocket.removeResyncHandler(resyncCallback);
+        };
     }, [dispatch, websocket, api]);
 
     return children;
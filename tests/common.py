@@ -25,6 +25,10 @@ def get_test_db_config() -> dict:
     }
 
 
+# a streaming replica of the test database, e.g. set up with pg_basebackup -R
+TEST_DB_REPLICA_HOST = os.environ.get("TEST_DB_REPLICA_HOST")
+TEST_DB_REPLICA_PORT = int(os.environ.get("TEST_DB_REPLICA_PORT", 5432))
+
 TEST_CONFIG = {
     "email": {
         "host": "localhost",
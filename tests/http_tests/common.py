@@ -9,7 +9,7 @@ from tests.common import BaseTestCase, TEST_CONFIG
 class HTTPTestCase(BaseTestCase):
     async def asyncSetUp(self) -> None:
         await super().asyncSetUp()
-        self.test_config = Config.parse_obj(TEST_CONFIG)
+        self.test_config = self._get_config()
         self.http_service = ApiCli(config=self.test_config)
         await self.http_service._setup()
 
@@ -20,6 +20,9 @@ class HTTPTestCase(BaseTestCase):
         self.account_service = self.http_service.account_service
         self.group_service = self.http_service.group_service
 
+    def _get_config(self) -> Config:
+        return Config.parse_obj(TEST_CONFIG)
+
     async def asyncTearDown(self) -> None:
         await self.http_service._teardown()
         await super().asyncTearDown()
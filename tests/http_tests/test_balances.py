@@ -0,0 +1,57 @@
+from datetime import date
+
+from tests.http_tests.common import HTTPAPITest
+
+
+class BalanceAPITest(HTTPAPITest):
+    async def test_get_balances(self):
+        group_id = await self.group_service.create_group(
+            user=self.test_user,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+            add_user_account_on_join=False,
+        )
+        account_ids = [
+            await self.account_service.create_account(
+                user=self.test_user,
+                group_id=group_id,
+                type="personal",
+                name=name,
+                description="",
+            )
+            for name in ("alice", "bob")
+        ]
+        await self.transaction_service.create_transaction(
+            user=self.test_user,
+            group_id=group_id,
+            type="transfer",
+            name="transfer",
+            description=None,
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=42,
+            creditor_shares={account_ids[0]: 1.0},
+            debitor_shares={account_ids[1]: 1.0},
+            perform_commit=True,
+        )
+
+        resp = await self._get(f"/api/v1/groups/{group_id}/balances")
+        self.assertEqual(200, resp.status_code)
+        balances = {balance["account_id"]: balance for balance in resp.json()}
+        self.assertEqual(42, balances[account_ids[0]]["balance"])
+        self.assertEqual(42, balances[account_ids[0]]["total_paid"])
+        self.assertEqual(-42, balances[account_ids[1]]["balance"])
+        self.assertEqual(42, balances[account_ids[1]]["total_consumed"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/balances?as_of=2000-01-01T00:00:00Z"
+        )
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([], resp.json())
+
+        resp = await self._get(f"/api/v1/groups/{group_id + 1}/balances")
+        self.assertEqual(404, resp.status_code)
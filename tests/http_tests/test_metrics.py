@@ -0,0 +1,70 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa,protected-access
+from httpx import AsyncClient
+
+from abrechnung.framework.metrics import request_metrics
+from abrechnung.http.cli import ApiCli
+from tests.http_tests.common import HTTPAPITest
+
+
+class MetricsTest(HTTPAPITest):
+    async def test_metrics_are_disabled_by_default(self):
+        resp = await self.client.get("/api/metrics")
+        self.assertEqual(404, resp.status_code)
+
+    async def test_metrics(self):
+        self.http_service.cfg.api.enable_metrics = True
+        resp = await self._get("/api/v1/groups")
+        self.assertEqual(200, resp.status_code)
+
+        resp = await self.client.get("/api/metrics")
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.headers["content-type"].startswith("text/plain"))
+        self.assertIn(
+            'abrechnung_http_responses_total{method="GET",route="/api/v1/groups",status="200"}',
+            resp.text,
+        )
+        self.assertIn(
+            'abrechnung_http_request_queries_count{method="GET",route="/api/v1/groups"}',
+            resp.text,
+        )
+        # the metrics request itself is still being handled
+        self.assertIn("abrechnung_http_requests_in_flight 1", resp.text)
+        self.assertIn('abrechnung_db_pool_max_size{pool="main"} 10', resp.text)
+        self.assertIn('method="GroupService.list_groups"', resp.text)
+        self.assertIn("# TYPE abrechnung_event_loop_lag_seconds summary", resp.text)
+
+    async def test_request_metrics(self):
+        before = request_metrics.get("GET", "/api/v1/groups/{group_id}")
+        n_before = before.duration.count if before is not None else 0
+        resp = await self._get("/api/v1/groups/1337")
+        self.assertEqual(404, resp.status_code)
+
+        metric = request_metrics.get("GET", "/api/v1/groups/{group_id}")
+        self.assertEqual(n_before + 1, metric.duration.count)
+        self.assertEqual(n_before + 1, metric.queries.count)
+        self.assertGreater(metric.queries.sum, 0)
+        self.assertGreater(metric.db_time, 0)
+        self.assertGreater(metric.response_size.sum, 0)
+        self.assertGreaterEqual(metric.responses[404], 1)
+
+        resp = await self._get("/api/v1/does-not-exist")
+        self.assertEqual(404, resp.status_code)
+        self.assertIsNotNone(request_metrics.get("GET", "unmatched"))
+
+    async def test_server_timing(self):
+        resp = await self._get("/api/v1/groups")
+        self.assertNotIn("server-timing", resp.headers)
+
+        config = self.test_config.model_copy(deep=True)
+        config.api.server_timing = True
+        api = ApiCli(config=config)
+        await api._setup()
+        self.addAsyncCleanup(api._teardown)
+        self.client = AsyncClient(app=api.api, base_url="https://abrechnung.sft.lol")
+
+        resp = await self._get("/api/v1/groups")
+        self.assertEqual(200, resp.status_code)
+        self.assertRegex(
+            resp.headers["server-timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", app;dur=[\d.]+, total;dur=[\d.]+$',
+        )
@@ -0,0 +1,141 @@
+# pylint: disable=attribute-defined-outside-init
+import asyncio
+from datetime import date
+import unittest
+from contextlib import asynccontextmanager
+
+from abrechnung.config import Config
+from tests.common import TEST_CONFIG, TEST_DB_REPLICA_HOST, TEST_DB_REPLICA_PORT
+from tests.http_tests.common import HTTPTestCase
+
+
+@unittest.skipIf(
+    TEST_DB_REPLICA_HOST is None, "TEST_DB_REPLICA_HOST is not set, no replica to test"
+)
+class ReplicaAPITest(HTTPTestCase):
+    """requests right after a change have to see it even if the replica lags behind"""
+
+    def _get_config(self) -> Config:
+        config = dict(TEST_CONFIG)
+        config["database"] = dict(
+            TEST_CONFIG["database"],
+            replicas=[{"host": TEST_DB_REPLICA_HOST, "port": TEST_DB_REPLICA_PORT}],
+        )
+        return Config.parse_obj(config)
+
+    async def _wait_for_replay(self):
+        lsn = await self.db_conn.fetchval("select pg_current_wal_lsn()")
+        async with self.http_service.replica_router.replicas[0].acquire() as conn:
+            while not await conn.fetchval(
+                "select pg_last_wal_replay_lsn() >= $1::pg_lsn", lsn
+            ):
+                await asyncio.sleep(0.05)
+
+    @asynccontextmanager
+    async def _replica_lagging(self):
+        await self._wait_for_replay()
+        async with self.http_service.replica_router.replicas[0].acquire() as conn:
+            await conn.execute("select pg_wal_replay_pause()")
+            try:
+                yield
+            finally:
+                await conn.execute("select pg_wal_replay_resume()")
+
+    async def _login(self) -> str:
+        resp = await self.client.post(
+            "/api/v1/auth/login",
+            json={"username": "user", "password": self.password, "session_name": "s"},
+        )
+        self.assertEqual(200, resp.status_code)
+        return resp.json()["access_token"]
+
+    async def _fetch_profile(self, token: str):
+        return await self.client.get(
+            "/api/v1/profile", headers={"Authorization": f"Bearer {token}"}
+        )
+
+    async def test_sessions_are_checked_on_the_primary(self):
+        _, self.password = await self._create_test_user("user", "user@email.stuff")
+
+        async with self._replica_lagging():
+            token = await self._login()
+            resp = await self._fetch_profile(token)
+            self.assertEqual(200, resp.status_code)
+
+            resp = await self.client.post(
+                "/api/v1/auth/logout", headers={"Authorization": f"Bearer {token}"}
+            )
+            self.assertEqual(204, resp.status_code)
+            resp = await self._fetch_profile(token)
+            self.assertEqual(401, resp.status_code)
+
+    async def test_reads_see_writes_of_the_session(self):
+        user, self.password = await self._create_test_user("user", "user@email.stuff")
+        group_id = await self.group_service.create_group(
+            user=user,
+            name="group",
+            description="",
+            currency_symbol="€",
+            terms="",
+            add_user_account_on_join=False,
+        )
+        account_id = await self.account_service.create_account(
+            user=user, group_id=group_id, type="personal", name="a", description="account"
+        )
+        transaction_id = await self.transaction_service.create_transaction(
+            user=user,
+            group_id=group_id,
+            type="transfer",
+            name="t",
+            description="transfer",
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=10,
+            creditor_shares={account_id: 1.0},
+            debitor_shares={account_id: 1.0},
+            perform_commit=True,
+        )
+        token = await self._login()
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async with self._replica_lagging():
+            # the write methods only know the transaction or account, not the group
+            resp = await self.client.post(
+                f"/api/v1/transactions/{transaction_id}",
+                headers=headers,
+                json={
+                    "name": "t",
+                    "description": "transfer",
+                    "value": 20,
+                    "billed_at": date.today().isoformat(),
+                    "currency_symbol": "€",
+                    "currency_conversion_rate": 1.0,
+                    "tags": [],
+                    "creditor_shares": {account_id: 1.0},
+                    "debitor_shares": {account_id: 1.0},
+                },
+            )
+            self.assertEqual(200, resp.status_code)
+            resp = await self.client.post(
+                f"/api/v1/transactions/{transaction_id}/commit", headers=headers
+            )
+            self.assertEqual(200, resp.status_code)
+            resp = await self.client.get(
+                f"/api/v1/transactions/{transaction_id}", headers=headers
+            )
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual(20, resp.json()["committed_details"]["value"])
+
+            resp = await self.client.post(
+                f"/api/v1/accounts/{account_id}",
+                headers=headers,
+                json={"name": "renamed", "description": "account"},
+            )
+            self.assertEqual(200, resp.status_code)
+            resp = await self.client.get(
+                f"/api/v1/groups/{group_id}/accounts", headers=headers
+            )
+            self.assertEqual(200, resp.status_code)
+            self.assertEqual("renamed", resp.json()[0]["committed_details"]["name"])
@@ -0,0 +1,80 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+from datetime import datetime
+
+from tests.http_tests.common import HTTPAPITest
+
+
+class RoundTripTest(HTTPAPITest):
+    """guards against regressions in the number of database round trips of read only endpoints"""
+
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.group_id = await self.group_service.create_group(
+            user=self.test_user,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+            add_user_account_on_join=False,
+        )
+        account1_id = await self.account_service.create_account(
+            user=self.test_user,
+            group_id=self.group_id,
+            type="personal",
+            name="account1",
+            description="",
+        )
+        account2_id = await self.account_service.create_account(
+            user=self.test_user,
+            group_id=self.group_id,
+            type="personal",
+            name="account2",
+            description="",
+        )
+        self.transaction_id = await self.transaction_service.create_transaction(
+            user=self.test_user,
+            group_id=self.group_id,
+            type="purchase",
+            name="foo",
+            description="foo",
+            billed_at=datetime.now().date(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=33,
+            debitor_shares={account1_id: 1.0},
+            creditor_shares={account2_id: 1.0},
+            perform_commit=True,
+        )
+
+        self.queries: list[str] = []
+        # pylint: disable=protected-access
+        for holder in self.http_service.db_pool._holders:
+            if holder._con is not None:
+                holder._con.add_query_logger(
+                    lambda record: self.queries.append(record.query)
+                )
+
+    async def _count_round_trips(self, url: str) -> list[str]:
+        """returns the executed queries"""
+        self.queries.clear()
+        resp = await self._get(url)
+        self.assertEqual(200, resp.status_code)
+        return list(self.queries)
+
+    async def test_read_endpoints(self):
+        # authenticating a request takes three queries (session, user, user sessions), every connection
+        # is reset by the pool once it is released, the rest are the permission check and the actual data
+        expected_round_trips = {
+            "/api/v1/groups": 6,
+            f"/api/v1/groups/{self.group_id}": 7,
+            f"/api/v1/groups/{self.group_id}/members": 7,
+            f"/api/v1/groups/{self.group_id}/logs": 7,
+            f"/api/v1/groups/{self.group_id}/accounts": 7,
+            f"/api/v1/groups/{self.group_id}/transactions": 7,
+            f"/api/v1/transactions/{self.transaction_id}": 7,
+        }
+        for url, expected in expected_round_trips.items():
+            queries = await self._count_round_trips(url)
+            self.assertNotIn("BEGIN;", queries, url)
+            self.assertEqual(expected, len(queries), f"{url}: {queries}")
@@ -1,5 +1,7 @@
 from datetime import date, datetime
 
+from abrechnung.domain.transactions import TransactionPosition
+
 from .common import HTTPAPITest
 
 
@@ -199,6 +201,136 @@ class TransactionAPITest(HTTPAPITest):
         ret_data = resp.json()
         self.assertEqual(1, len(ret_data))
 
+    async def test_list_transactions_as_of(self):
+        group_id = await self._create_group()
+        account1_id = await self._create_account(group_id=group_id, name="account1")
+        account2_id = await self._create_account(group_id=group_id, name="account2")
+        transaction_id = await self.transaction_service.create_transaction(
+            user=self.test_user,
+            group_id=group_id,
+            type="purchase",
+            name="name123",
+            description="description123",
+            currency_symbol="€",
+            tags=["food"],
+            billed_at=date.today(),
+            currency_conversion_rate=1.22,
+            value=122.22,
+            creditor_shares={account1_id: 1.0},
+            debitor_shares={account1_id: 1.0, account2_id: 2.0},
+            positions=[
+                TransactionPosition(
+                    id=-1,
+                    name="carrots",
+                    price=12.22,
+                    communist_shares=1,
+                    usages={account2_id: 1.0},
+                )
+            ],
+            perform_commit=True,
+        )
+        committed_at = await self.db_conn.fetchval("select now()")
+
+        await self.transaction_service.update_transaction(
+            user=self.test_user,
+            transaction_id=transaction_id,
+            name="name123",
+            description="description123",
+            currency_symbol="€",
+            tags=["food"],
+            billed_at=date.today(),
+            currency_conversion_rate=1.22,
+            value=200,
+            creditor_shares={account1_id: 1.0},
+            debitor_shares={account1_id: 1.0},
+            perform_commit=True,
+        )
+        # pending changes are not part of the committed state
+        await self._create_change(transaction_id)
+
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+        self.assertEqual(200, resp.status_code)
+        current = resp.json()
+        self.assertTrue(current[0]["is_wip"])
+
+        # the committed state as of now matches the committed state of the regular listing
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={"as_of": datetime.now().astimezone().isoformat()},
+        )
+        self.assertEqual(200, resp.status_code)
+        as_of_now = resp.json()
+        self.assertEqual(1, len(as_of_now))
+        for key in ("id", "type", "committed_details", "committed_positions"):
+            self.assertEqual(current[0][key], as_of_now[0][key], key)
+        self.assertFalse(as_of_now[0]["is_wip"])
+        self.assertIsNone(as_of_now[0]["pending_details"])
+        self.assertIsNone(as_of_now[0]["pending_positions"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={"as_of": committed_at.isoformat()},
+        )
+        self.assertEqual(200, resp.status_code)
+        ret_data = resp.json()
+        self.assertEqual(1, len(ret_data))
+        details = ret_data[0]["committed_details"]
+        self.assertEqual(122.22, details["value"])
+        self.assertEqual(["food"], details["tags"])
+        self.assertEqual(
+            {str(account1_id): 1.0, str(account2_id): 2.0}, details["debitor_shares"]
+        )
+        self.assertEqual(1, len(ret_data[0]["committed_positions"]))
+        self.assertEqual(
+            {str(account2_id): 1.0}, ret_data[0]["committed_positions"][0]["usages"]
+        )
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={"as_of": "2000-01-01T00:00:00+00:00"},
+        )
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual([], resp.json())
+
+        # transactions with pending changes of the user are not part of a past state
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={
+                "as_of": committed_at.isoformat(),
+                "transaction_ids": str(transaction_id),
+            },
+        )
+        self.assertEqual(400, resp.status_code)
+
+        # accounts
+        await self.account_service.update_account(
+            user=self.test_user,
+            account_id=account1_id,
+            name="renamed",
+            description="",
+        )
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/accounts",
+            params={"as_of": committed_at.isoformat()},
+        )
+        self.assertEqual(200, resp.status_code)
+        accounts = {a["id"]: a for a in resp.json()}
+        self.assertEqual({account1_id, account2_id}, set(accounts.keys()))
+        self.assertEqual("account1", accounts[account1_id]["committed_details"]["name"])
+        self.assertEqual(
+            "account account1 description",
+            accounts[account1_id]["committed_details"]["description"],
+        )
+        self.assertIsNone(accounts[account1_id]["pending_details"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/accounts",
+            params={"as_of": datetime.now().astimezone().isoformat()},
+        )
+        self.assertEqual(200, resp.status_code)
+        accounts = {a["id"]: a for a in resp.json()}
+        self.assertEqual("renamed", accounts[account1_id]["committed_details"]["name"])
+
     async def test_get_transaction(self):
         group_id = await self._create_group()
         transaction_id = await self.transaction_service.create_transaction(
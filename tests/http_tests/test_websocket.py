@@ -1,11 +1,25 @@
 import asyncio
+import json
 import unittest
 from datetime import datetime, timedelta, date
+from unittest.mock import patch
 
+import asyncpg
 from fastapi.testclient import TestClient
 
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.groups import GroupService
+from abrechnung.application.transactions import TransactionService
+from abrechnung.application.users import UserService
 from abrechnung.config import Config
+from abrechnung.framework.database import create_db_connection
 from abrechnung.http.cli import ApiCli
+from abrechnung.http.routers.websocket import (
+    NotificationManager,
+    remove_stale_forwarders,
+    worker_forwarder_id,
+    ws_message,
+)
 from tests.common import BaseTestCase, TEST_CONFIG
 
 
@@ -285,3 +299,525 @@ class WebsocketAPITest(BaseTestCase):
                     },
                 },
             )
+
+
+class DummyWebSocket:
+    def __init__(self):
+        self.messages: list[dict] = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, data: dict):
+        self.messages.append(data)
+
+
+class NotificationManagerTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.test_config = Config.parse_obj(TEST_CONFIG)
+        self.notification_manager = NotificationManager(config=self.test_config)
+        await self.notification_manager.initialize()
+
+        self.group_service = GroupService(self.db_pool, config=self.test_config)
+        self.user_service = UserService(self.db_pool, config=self.test_config)
+        self.account_service = AccountService(self.db_pool, config=self.test_config)
+        self.transaction_service = TransactionService(
+            self.db_pool, config=self.test_config
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.notification_manager.teardown()
+        await super().asyncTearDown()
+
+    async def test_bulk_changes_are_coalesced(self):
+        user, _ = await self._create_test_user("user", "user@email.stuff")
+        group_id = await self.group_service.create_group(
+            user=user,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+        account_ids = [
+            await self.account_service.create_account(
+                user=user,
+                group_id=group_id,
+                type="personal",
+                name=f"account{i}",
+                description="",
+            )
+            for i in range(2)
+        ]
+        transaction_ids = [
+            await self.transaction_service.create_transaction(
+                user=user,
+                group_id=group_id,
+                type="transfer",
+                value=10,
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                billed_at=date.today(),
+                name=f"transfer {i}",
+                description="asdf",
+                tags=[],
+                creditor_shares={account_ids[0]: 1.0},
+                debitor_shares={account_ids[1]: 1.0},
+                perform_commit=True,
+            )
+            for i in range(3)
+        ]
+
+        ws = DummyWebSocket()
+        connection_id = await self.notification_manager.connect(websocket=ws)
+        await self.db_conn.execute(
+            "call subscribe($1, $2, $3, $4)",
+            connection_id,
+            user.id,
+            "transaction",
+            group_id,
+        )
+
+        # count the notifications about transaction contents sent by postgres to the forwarder,
+        # the revisions of the changed transactions additionally notify about their new last_changed
+        notifications = []
+
+        def on_notification(connection, pid, channel, payload):
+            del connection, pid, channel  # unused
+            if "transaction_ids" in json.loads(payload)["data"]:
+                notifications.append(payload)
+
+        listener = await self.db_pool.acquire()
+        await listener.add_listener(
+            self.notification_manager.channel_name, on_notification
+        )
+
+        # one statement changing different transactions, i.e. notifications with distinct payloads per row
+        await self.db_conn.execute(
+            "update transaction_history set description = description || ' changed' where id = any($1)",
+            transaction_ids,
+        )
+        await asyncio.sleep(
+            2 * self.test_config.api.notification_debounce.total_seconds()
+        )
+        await listener.remove_listener(
+            self.notification_manager.channel_name, on_notification
+        )
+        await self.db_pool.release(listener)
+
+        self.assertEqual(1, len(notifications))
+        content_notifications = [
+            msg for msg in ws.messages if "transaction_ids" in msg["data"]
+        ]
+        self.assertEqual(
+            [
+                {
+                    "type": "notification",
+                    "data": {
+                        "subscription_type": "transaction",
+                        "element_id": group_id,
+                        "transaction_ids": sorted(transaction_ids),
+                    },
+                }
+            ],
+            content_notifications,
+        )
+
+        # separate statements within the debounce window are merged into one websocket message
+        ws.messages.clear()
+        for transaction_id in transaction_ids[:2]:
+            await self.db_conn.execute(
+                "update transaction_history set description = 'asdf' where id = $1",
+                transaction_id,
+            )
+        await asyncio.sleep(
+            2 * self.test_config.api.notification_debounce.total_seconds()
+        )
+        content_notifications = [
+            msg for msg in ws.messages if "transaction_ids" in msg["data"]
+        ]
+        self.assertEqual(1, len(content_notifications))
+        self.assertEqual(
+            sorted(transaction_ids[:2]),
+            content_notifications[0]["data"]["transaction_ids"],
+        )
+
+        await self.notification_manager.disconnect(
+            connection_id=connection_id, websocket=ws
+        )
+
+    async def test_subscribe_many(self):
+        user, password = await self._create_test_user("user", "user@email.stuff")
+        other_user, _ = await self._create_test_user("other", "other@email.stuff")
+        _, _, session_token = await self.user_service.login_user(
+            username="user", password=password, session_name="session1"
+        )
+        token = await self.user_service.get_access_token_from_session_token(
+            session_token
+        )
+        group_id = await self.group_service.create_group(
+            user=user,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+        other_group_id = await self.group_service.create_group(
+            user=other_user,
+            name="group2",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+
+        ws = DummyWebSocket()
+        connection_id = await self.notification_manager.connect(websocket=ws)
+
+        subscriptions = [
+            {"subscription_type": "group", "element_id": user.id},
+            {"subscription_type": "account", "element_id": group_id},
+            {"subscription_type": "transaction", "element_id": group_id},
+            {"subscription_type": "group_member", "element_id": group_id},
+            {"subscription_type": "group_invite", "element_id": group_id},
+            {"subscription_type": "group_log", "element_id": group_id},
+        ]
+        resp = await ws_message(
+            self.db_conn,
+            connection_id,
+            {"type": "subscribe_many", "token": token, "data": subscriptions},
+            self.user_service,
+            self.notification_manager,
+        )
+        self.assertEqual(
+            {"type": "subscribe_many_success", "data": subscriptions}, resp
+        )
+        n_subscriptions = await self.db_conn.fetchval(
+            "select count(*) from subscription where connection_id = $1", connection_id
+        )
+        self.assertEqual(len(subscriptions), n_subscriptions)
+
+        # subscribing again is idempotent
+        resp = await ws_message(
+            self.db_conn,
+            connection_id,
+            {"type": "subscribe_many", "token": token, "data": subscriptions},
+            self.user_service,
+            self.notification_manager,
+        )
+        self.assertEqual("subscribe_many_success", resp["type"])
+
+        # a single group the user is not a member of rejects the whole batch
+        resp = await ws_message(
+            self.db_conn,
+            connection_id,
+            {
+                "type": "subscribe_many",
+                "token": token,
+                "data": [
+                    {"subscription_type": "account", "element_id": other_group_id},
+                ],
+            },
+            self.user_service,
+            self.notification_manager,
+        )
+        self.assertEqual("error", resp["type"])
+        n_other_subscriptions = await self.db_conn.fetchval(
+            "select count(*) from subscription where connection_id = $1 and element_id = $2",
+            connection_id,
+            other_group_id,
+        )
+        self.assertEqual(0, n_other_subscriptions)
+
+        resp = await ws_message(
+            self.db_conn,
+            connection_id,
+            {"type": "unsubscribe_many", "token": token, "data": subscriptions[1:]},
+            self.user_service,
+            self.notification_manager,
+        )
+        self.assertEqual("unsubscribe_many_success", resp["type"])
+        n_subscriptions = await self.db_conn.fetchval(
+            "select count(*) from subscription where connection_id = $1", connection_id
+        )
+        self.assertEqual(1, n_subscriptions)
+
+        await self.notification_manager.disconnect(
+            connection_id=connection_id, websocket=ws
+        )
+
+    async def test_listener_reconnects(self):
+        user, password = await self._create_test_user("user", "user@email.stuff")
+        _, _, session_token = await self.user_service.login_user(
+            username="user", password=password, session_name="session1"
+        )
+        token = await self.user_service.get_access_token_from_session_token(
+            session_token
+        )
+        group_id = await self.group_service.create_group(
+            user=user,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+        ws = DummyWebSocket()
+        connection_id = await self.notification_manager.connect(websocket=ws)
+        resp = await ws_message(
+            self.db_conn,
+            connection_id,
+            {
+                "type": "subscribe_many",
+                "token": token,
+                "data": [
+                    {"subscription_type": "group", "element_id": user.id},
+                    {"subscription_type": "account", "element_id": group_id},
+                ],
+            },
+            self.user_service,
+            self.notification_manager,
+        )
+        self.assertEqual("subscribe_many_success", resp["type"])
+
+        account_id = await self.account_service.create_account(
+            user=user,
+            group_id=group_id,
+            type="personal",
+            name="account",
+            description="",
+        )
+        await asyncio.sleep(
+            2 * self.test_config.api.notification_debounce.total_seconds()
+        )
+        account_changed_at = await self.db_conn.fetchval(
+            "select max(last_changed) from account_revision where account_id = $1",
+            account_id,
+        )
+
+        old_listener = self.notification_manager.connection
+        await self.db_conn.execute(
+            "select pg_terminate_backend($1)", old_listener.get_server_pid()
+        )
+        for _ in range(50):
+            if (
+                self.notification_manager.reconnect_task is not None
+                and self.notification_manager.reconnect_task.done()
+            ):
+                break
+            await asyncio.sleep(0.1)
+        self.assertIsNot(old_listener, self.notification_manager.connection)
+        self.assertFalse(self.notification_manager.connection.is_closed())
+
+        # the forwarder was booted again and our connection and its subscriptions restored
+        n_subscriptions = await self.db_conn.fetchval(
+            "select count(*) from subscription s join connection c on s.connection_id = c.id "
+            "where c.id = $1 and c.channel_id = $2",
+            connection_id,
+            self.notification_manager.channel_id,
+        )
+        self.assertEqual(2, n_subscriptions)
+
+        resyncs = [msg for msg in ws.messages if msg["type"] == "resync"]
+        self.assertEqual(1, len(resyncs))
+        # the client is told the last change it has seen in each group, as recorded by the database
+        groups = resyncs[0]["data"]["groups"]
+        self.assertEqual([group_id], [g["group_id"] for g in groups])
+        self.assertEqual(
+            account_changed_at, datetime.fromisoformat(groups[0]["last_seen"])
+        )
+
+        other_group_id = await self.group_service.create_group(
+            user=user,
+            name="group2",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+        await asyncio.sleep(
+            2 * self.test_config.api.notification_debounce.total_seconds()
+        )
+        self.assertIn(
+            {
+                "type": "notification",
+                "data": {
+                    "subscription_type": "group",
+                    "element_id": user.id,
+                    "group_id": other_group_id,
+                },
+            },
+            ws.messages,
+        )
+
+        await self.notification_manager.disconnect(
+            connection_id=connection_id, websocket=ws
+        )
+
+    async def _terminate_listener(self, create_db_connection):
+        with patch(
+            "abrechnung.http.routers.websocket.create_db_connection",
+            side_effect=create_db_connection,
+        ) as mock:
+            old_listener = self.notification_manager.connection
+            await self.db_conn.execute(
+                "select pg_terminate_backend($1)", old_listener.get_server_pid()
+            )
+            for _ in range(50):
+                if (
+                    self.notification_manager.reconnect_task is not None
+                    and self.notification_manager.reconnect_task.done()
+                ):
+                    break
+                await asyncio.sleep(0.1)
+            self.assertTrue(self.notification_manager.reconnect_task.done())
+            return mock.call_count
+
+    async def test_listener_reconnect_retries_interface_errors(self):
+        real_create_db_connection = create_db_connection
+        failures = [
+            asyncpg.ConnectionDoesNotExistError("connection was closed"),
+            asyncio.TimeoutError(),
+        ]
+
+        async def flaky_create_db_connection(config):
+            if failures:
+                raise failures.pop(0)
+            return await real_create_db_connection(config)
+
+        n_attempts = await self._terminate_listener(flaky_create_db_connection)
+        self.assertEqual(3, n_attempts)
+        self.assertFalse(self.notification_manager.connection.is_closed())
+
+    async def test_listener_reconnect_gives_up_on_unexpected_errors(self):
+        async def broken_create_db_connection(config):
+            raise RuntimeError("boom")
+
+        with self.assertLogs("abrechnung.http.routers.websocket", "ERROR") as logs:
+            n_attempts = await self._terminate_listener(broken_create_db_connection)
+        self.assertEqual(1, n_attempts)
+        self.assertIsNone(self.notification_manager.connection)
+        self.assertIn("RuntimeError: boom", logs.output[0])
+
+    async def test_changed_at_with_short_fraction(self):
+        ws = DummyWebSocket()
+        connection_id = await self.notification_manager.connect(ws)
+        self.notification_manager.track_subscriptions(
+            connection_id,
+            user_id=1,
+            subscriptions=[{"subscription_type": "account", "element_id": 42}],
+        )
+
+        # postgres renders this as 08:10:33.12 in json, which datetime.fromisoformat cannot parse before python 3.11
+        changed_at = await self.db_conn.fetchval(
+            "select (extract(epoch from '2026-10-19 08:10:33.12+00'::timestamptz) * 1000000)::bigint"
+        )
+        payload = json.dumps(
+            {
+                "connections": [connection_id],
+                "event": "account",
+                "data": {"element_id": 42},
+                "changed_at": changed_at,
+            }
+        )
+        await self.notification_manager._on_psql_notification(
+            self.notification_manager.connection,
+            0,
+            self.notification_manager.channel_name,
+            payload,
+        )
+
+        await self.notification_manager._send_resync(connection_id)
+        resyncs = [msg for msg in ws.messages if msg["type"] == "resync"]
+        self.assertEqual(
+            [{"group_id": 42, "last_seen": "2026-10-19T08:10:33.120000+00:00"}],
+            resyncs[0]["data"]["groups"],
+        )
+
+        await self.notification_manager.disconnect(
+            connection_id=connection_id, websocket=ws
+        )
+
+    async def test_notifications_are_routed_across_workers(self):
+        user, _ = await self._create_test_user("user", "user@email.stuff")
+        group_id = await self.group_service.create_group(
+            user=user,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+            add_user_account_on_join=False,
+        )
+
+        worker_config = self.test_config.model_copy(deep=True)
+        worker_config.api.id = worker_forwarder_id(self.test_config.api.id, 1)
+        other_manager = NotificationManager(config=worker_config)
+        await other_manager.initialize()
+        self.assertNotEqual(
+            self.notification_manager.channel_id, other_manager.channel_id
+        )
+
+        websockets = []
+        for manager in (self.notification_manager, other_manager):
+            ws = DummyWebSocket()
+            connection_id = await manager.connect(websocket=ws)
+            await self.db_conn.execute(
+                "call subscribe($1, $2, $3, $4)",
+                connection_id,
+                user.id,
+                "account",
+                group_id,
+            )
+            websockets.append((manager, connection_id, ws))
+
+        account_id = await self.account_service.create_account(
+            user=user,
+            group_id=group_id,
+            type="personal",
+            name="account",
+            description="",
+        )
+        await asyncio.sleep(
+            2 * self.test_config.api.notification_debounce.total_seconds()
+        )
+
+        for manager, connection_id, ws in websockets:
+            account_notifications = [
+                msg["data"]
+                for msg in ws.messages
+                if msg["type"] == "notification"
+                and msg["data"]["subscription_type"] == "account"
+            ]
+            self.assertTrue(len(account_notifications) > 0)
+            for notification in account_notifications:
+                self.assertEqual(account_id, notification["account_id"])
+            await manager.disconnect(connection_id=connection_id, websocket=ws)
+
+        await other_manager.teardown()
+
+    async def test_remove_stale_forwarders(self):
+        forwarder_ids = [
+            "api",
+            "api-0",
+            "api-1",
+            "api-3",
+            "api-eu",
+            "api-eu-0",
+            "other",
+        ]
+        for forwarder_id in forwarder_ids:
+            await self.db_conn.fetchval(
+                "select channel_id from forwarder_boot($1)", forwarder_id
+            )
+
+        # only the forwarders of our own two workers are removed, not the ones of other instances sharing the prefix
+        n_removed = await remove_stale_forwarders(self.db_conn, "api", n_workers=2)
+        self.assertEqual(3, n_removed)
+        remaining = await self.db_conn.fetch(
+            "select id from forwarder where id = any($1::text[])", forwarder_ids
+        )
+        self.assertEqual(
+            {"api-3", "api-eu", "api-eu-0", "other"}, {row["id"] for row in remaining}
+        )
@@ -0,0 +1,42 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+import sys
+import time
+from datetime import timedelta
+from unittest import IsolatedAsyncioTestCase as TestCase
+
+from abrechnung.config import Config
+from abrechnung.http.cli import ApiCli
+from tests.common import TEST_CONFIG
+
+
+def _crash_on_start(**kwargs):
+    del kwargs  # unused
+    sys.exit(3)
+
+
+class WorkerSupervisionTest(TestCase):
+    async def test_workers_crashing_on_start_are_given_up(self):
+        config = Config.parse_obj(TEST_CONFIG)
+        config.api.port = 0
+        config.api.workers = 2
+        config.api.worker_restart_delay = timedelta(milliseconds=200)
+        config.api.worker_max_restarts = 4
+        api = ApiCli(config=config)
+
+        start = time.monotonic()
+        with self.assertLogs("abrechnung.http.cli", "WARNING") as logs:
+            self.assertFalse(await api._run_workers(worker_target=_crash_on_start))
+        elapsed = time.monotonic() - start
+
+        restarts = [line for line in logs.output if "restarting in" in line]
+        self.assertEqual(4, len(restarts))
+        # each worker is restarted twice, first after the initial delay and then after twice the initial delay
+        for worker_index in range(2):
+            for delay in (0.2, 0.4):
+                self.assertIn(
+                    f"WARNING:abrechnung.http.cli:Api worker {worker_index} exited with code 3, "
+                    f"restarting in {delay} seconds",
+                    restarts,
+                )
+        self.assertIn("giving up", logs.output[-1])
+        self.assertGreaterEqual(elapsed, 0.6)
@@ -0,0 +1,318 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+import asyncio
+import random
+from datetime import date, datetime
+from unittest import TestCase, skipIf
+
+from abrechnung.application import balances as balances_module
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.balances import (
+    BalancePosition,
+    BalanceService,
+    ClearingResolver,
+    GroupBalanceData,
+    ShareMatrix,
+    compute_balances_numpy,
+    compute_balances_python,
+    transaction_balance_effect,
+)
+from abrechnung.application.groups import GroupService
+from abrechnung.application.transactions import TransactionService
+from abrechnung.domain.transactions import TransactionPosition
+from .common import BaseTestCase
+
+
+class ClearingResolverTest(TestCase):
+    def test_resolve_nested_clearing_accounts(self):
+        # 10 distributes to 1 and 11, 11 distributes to 2 and 3 twice as much to 3
+        resolver = ClearingResolver({10: {1: 1.0, 11: 1.0}, 11: {2: 1.0, 3: 2.0}})
+        self.assertEqual([10, 11], resolver.order)
+        self.assertEqual({1: 0.5, 2: 0.5 / 3, 3: 1 / 3}, resolver.flattened[10])
+
+        resolved = resolver.resolve({10: 60.0, 11: 30.0, 1: 5.0})
+        self.assertAlmostEqual(35.0, resolved[1])
+        self.assertAlmostEqual(20.0, resolved[2])
+        self.assertAlmostEqual(40.0, resolved[3])
+        self.assertNotIn(10, resolved)
+        self.assertNotIn(11, resolved)
+
+    def test_reject_cycles(self):
+        with self.assertRaises(RuntimeError):
+            ClearingResolver({10: {11: 1.0}, 11: {10: 1.0}})
+
+    def test_transaction_balance_effect(self):
+        effect = transaction_balance_effect(
+            value=100.0,
+            currency_conversion_rate=2.0,
+            creditor_shares={1: 1.0},
+            debitor_shares={1: 1.0, 2: 3.0},
+            positions=[
+                # 10 are used by account 2 alone, 5 of the 20 are shared by all debitors
+                BalancePosition(price=10.0, communist_shares=0.0, usages={2: 1.0}),
+                BalancePosition(
+                    price=20.0, communist_shares=1.0, usages={1: 1.0, 2: 2.0}
+                ),
+            ],
+        )
+        self.assertEqual({1: 200.0}, effect.paid)
+        self.assertAlmostEqual(2 * (5.0 + 75.0 / 4), effect.consumed[1])
+        self.assertAlmostEqual(2 * (10.0 + 10.0 + 75.0 * 3 / 4), effect.consumed[2])
+
+
+def _random_balance_data(rng: random.Random, n_transactions: int) -> GroupBalanceData:
+    accounts = list(range(1, 21))
+    data = GroupBalanceData(
+        transaction_ids=list(range(1, n_transactions + 1)),
+        values=[round(rng.uniform(1, 200), 2) for _ in range(n_transactions)],
+        currency_conversion_rates=[
+            rng.choice([1.0, 0.5, 1.3]) for _ in range(n_transactions)
+        ],
+        creditor_shares=ShareMatrix([], [], []),
+        debitor_shares=ShareMatrix([], [], []),
+        position_ids=[],
+        position_transaction_ids=[],
+        position_prices=[],
+        position_communist_shares=[],
+        usages=ShareMatrix([], [], []),
+    )
+    for transaction_id in data.transaction_ids:
+        for matrix, n in ((data.creditor_shares, 1), (data.debitor_shares, 4)):
+            for account_id in rng.sample(accounts, rng.randint(1, n)):
+                matrix.row_ids.append(transaction_id)
+                matrix.account_ids.append(account_id)
+                matrix.shares.append(float(rng.randint(1, 3)))
+        for _ in range(rng.randint(0, 3)):
+            position_id = len(data.position_ids) + 1
+            data.position_ids.append(position_id)
+            data.position_transaction_ids.append(transaction_id)
+            data.position_prices.append(round(rng.uniform(0, 20), 2))
+            data.position_communist_shares.append(float(rng.randint(0, 2)))
+            # some positions are not used at all
+            for account_id in rng.sample(accounts, rng.randint(0, 3)):
+                data.usages.row_ids.append(position_id)
+                data.usages.account_ids.append(account_id)
+                data.usages.shares.append(float(rng.randint(1, 3)))
+    return data
+
+
+@skipIf(balances_module.np is None, "numpy is not installed")
+class ComputeBalancesTest(TestCase):
+    def test_numpy_matches_python(self):
+        data = _random_balance_data(random.Random(0), 500)
+        paid, consumed = compute_balances_python(data)
+        np_paid, np_consumed = compute_balances_numpy(data)
+        for expected, actual in ((paid, np_paid), (consumed, np_consumed)):
+            for account_id in expected.keys() | actual.keys():
+                self.assertAlmostEqual(
+                    expected.get(account_id, 0.0), actual.get(account_id, 0.0)
+                )
+        # whatever was paid is consumed by someone
+        self.assertAlmostEqual(sum(np_paid.values()), sum(np_consumed.values()))
+
+    def test_empty_group(self):
+        data = GroupBalanceData(
+            [],
+            [],
+            [],
+            *([ShareMatrix([], [], [])] * 2),
+            [],
+            [],
+            [],
+            [],
+            ShareMatrix([], [], []),
+        )
+        self.assertEqual(({}, {}), compute_balances_numpy(data))
+
+
+class BalanceServiceTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.group_service = GroupService(self.db_pool, config=self.test_config)
+        self.account_service = AccountService(self.db_pool, config=self.test_config)
+        self.transaction_service = TransactionService(
+            self.db_pool, config=self.test_config
+        )
+        self.balance_service = BalanceService(self.db_pool, config=self.test_config)
+
+        self.user, _ = await self._create_test_user("test", "test@test.test")
+        self.group_id = await self.group_service.create_group(
+            user=self.user,
+            name="test group",
+            description="",
+            currency_symbol="€",
+            terms="",
+            add_user_account_on_join=False,
+        )
+
+    async def _create_account(
+        self, name: str, clearing_shares: dict[int, float] = None
+    ) -> int:
+        return await self.account_service.create_account(
+            user=self.user,
+            group_id=self.group_id,
+            type="personal" if clearing_shares is None else "clearing",
+            name=name,
+            description="",
+            date_info=None if clearing_shares is None else date.today(),
+            clearing_shares=clearing_shares,
+        )
+
+    async def _balances(self, as_of: datetime = None) -> dict[int, float]:
+        balances = await self.balance_service.get_balances(
+            user=self.user, group_id=self.group_id, as_of=as_of
+        )
+        return {balance.account_id: balance.balance for balance in balances}
+
+    async def test_balances_resolve_clearing_accounts(self):
+        alice = await self._create_account("alice")
+        bob = await self._create_account("bob")
+        carol = await self._create_account("carol")
+        drinks = await self._create_account("drinks", {bob: 1.0, carol: 1.0})
+        party = await self._create_account("party", {alice: 1.0, drinks: 1.0})
+
+        transaction_id = await self.transaction_service.create_transaction(
+            user=self.user,
+            group_id=self.group_id,
+            type="purchase",
+            name="party supplies",
+            description=None,
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=100,
+            creditor_shares={alice: 1.0},
+            debitor_shares={party: 1.0},
+            positions=[
+                TransactionPosition(
+                    id=-1, name="cake", price=20, communist_shares=0, usages={carol: 1}
+                )
+            ],
+            perform_commit=True,
+        )
+        balances = await self._balances()
+        self.assertAlmostEqual(60.0, balances[alice])
+        self.assertAlmostEqual(-20.0, balances[bob])
+        self.assertAlmostEqual(-40.0, balances[carol])
+        self.assertAlmostEqual(0.0, balances[drinks])
+        self.assertAlmostEqual(0.0, balances[party])
+        created_at = await self.db_conn.fetchval("select now()")
+
+        # changing the clearing shares invalidates the cached resolver of the group
+        await self.account_service.update_account(
+            user=self.user,
+            account_id=drinks,
+            name="drinks",
+            description="",
+            date_info=date.today(),
+            clearing_shares={bob: 1.0},
+        )
+        balances = await self._balances()
+        self.assertAlmostEqual(60.0, balances[alice])
+        self.assertAlmostEqual(-40.0, balances[bob])
+        self.assertAlmostEqual(-20.0, balances[carol])
+
+        # earlier states of the group are looked up by the validity ranges of the committed revisions
+        shares_changed_at = await self.db_conn.fetchval("select now()")
+        await self.transaction_service.update_transaction(
+            user=self.user,
+            transaction_id=transaction_id,
+            value=130,
+            name="party supplies",
+            description=None,
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            creditor_shares={alice: 1.0},
+            debitor_shares={party: 1.0},
+            perform_commit=True,
+        )
+        balances = await self._balances()
+        self.assertAlmostEqual(75.0, balances[alice])
+        self.assertAlmostEqual(-55.0, balances[bob])
+        self.assertAlmostEqual(-20.0, balances[carol])
+
+        balances = await self._balances(as_of=shares_changed_at)
+        self.assertAlmostEqual(60.0, balances[alice])
+        self.assertAlmostEqual(-40.0, balances[bob])
+        self.assertAlmostEqual(-20.0, balances[carol])
+
+        balances = await self._balances(as_of=created_at)
+        self.assertAlmostEqual(60.0, balances[alice])
+        self.assertAlmostEqual(-20.0, balances[bob])
+        self.assertAlmostEqual(-40.0, balances[carol])
+
+        self.assertEqual({}, await self._balances(as_of=datetime(2000, 1, 1)))
+
+        # every commit closes the previous validity range of the transaction and opens a new one
+        ranges = await self.db_conn.fetch(
+            "select lower(valid_during) as valid_from, upper(valid_during) as valid_until "
+            "from transaction_state_validity where transaction_id = $1 order by lower(valid_during)",
+            transaction_id,
+        )
+        self.assertEqual(2, len(ranges))
+        self.assertEqual(ranges[1]["valid_from"], ranges[0]["valid_until"])
+        self.assertIsNone(ranges[1]["valid_until"])
+        self.assertEqual(
+            1,
+            await self.db_conn.fetchval(
+                "select count(*) from purchase_item_state_validity where transaction_id = $1",
+                transaction_id,
+            ),
+        )
+
+    async def test_concurrent_commits_keep_validity_ranges_ordered(self):
+        account_id = await self._create_account("alice")
+
+        async def start_revision(conn, name: str) -> datetime:
+            await conn.execute("begin")
+            started = await conn.fetchval("select now()")
+            revision_id = await conn.fetchval(
+                "insert into account_revision (user_id, account_id, committed) values ($1, $2, now()) "
+                "returning id",
+                self.user.id,
+                account_id,
+            )
+            await conn.execute(
+                "insert into account_history (id, revision_id, name, description, owning_user_id) "
+                "values ($1, $2, $3, '', null)",
+                account_id,
+                revision_id,
+                name,
+            )
+            return started
+
+        # the revision of the earlier database transaction commits last
+        async with self.db_pool.acquire() as early, self.db_pool.acquire() as late:
+            early_committed = await start_revision(early, "early")
+            late_committed = await start_revision(late, "late")
+            # write the validity ranges of the later revision, but keep its row lock
+            await late.execute("set constraints account_state_validity_trig immediate")
+
+            early_commit = asyncio.create_task(early.execute("commit"))
+            await asyncio.sleep(0.2)
+            self.assertFalse(early_commit.done())
+
+            await late.execute("commit")
+            await early_commit
+
+        ranges = await self.db_conn.fetch(
+            "select ah.name, lower(v.valid_during) as valid_from, upper(v.valid_during) as valid_until "
+            "from account_state_validity v join account_history ah "
+            "   on ah.id = v.account_id and ah.revision_id = v.revision_id "
+            "where v.account_id = $1 order by lower(v.valid_during)",
+            account_id,
+        )
+        self.assertEqual(["alice", "early", "late"], [r["name"] for r in ranges])
+        self.assertEqual(early_committed, ranges[0]["valid_until"])
+        self.assertEqual(early_committed, ranges[1]["valid_from"])
+        self.assertEqual(late_committed, ranges[1]["valid_until"])
+        self.assertEqual(late_committed, ranges[2]["valid_from"])
+        self.assertIsNone(ranges[2]["valid_until"])
+
+        # the current state is the revision with the latest commit time
+        account = await self.account_service.get_account(
+            user=self.user, account_id=account_id
+        )
+        self.assertEqual("late", account.committed_details.name)
@@ -0,0 +1,203 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+from datetime import date
+from unittest.mock import patch
+
+import asyncpg
+
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.groups import GroupService
+from abrechnung.application.transactions import TransactionService
+from abrechnung.core.errors import InvalidCommand
+from abrechnung.database.bulk import (
+    BulkAccount,
+    BulkPosition,
+    BulkTransaction,
+    bulk_load_accounts,
+    bulk_load_transactions,
+)
+from .common import BaseTestCase
+
+
+class BulkLoadTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.group_service = GroupService(self.db_pool, config=self.test_config)
+        self.account_service = AccountService(self.db_pool, config=self.test_config)
+        self.transaction_service = TransactionService(
+            self.db_pool, config=self.test_config
+        )
+
+        self.user, _ = await self._create_test_user("test", "test@test.test")
+        self.group_id = await self.group_service.create_group(
+            user=self.user,
+            name="test group",
+            description="",
+            currency_symbol="€",
+            terms="",
+            add_user_account_on_join=False,
+        )
+
+    async def _load(
+        self, accounts: list[BulkAccount], transactions: list[BulkTransaction]
+    ) -> tuple[list[int], list[int]]:
+        async with self.db_conn.transaction():
+            account_ids = await bulk_load_accounts(
+                self.db_conn, self.group_id, self.user.id, accounts
+            )
+            transaction_ids = await bulk_load_transactions(
+                self.db_conn, self.group_id, self.user.id, account_ids, transactions
+            )
+        return account_ids, transaction_ids
+
+    async def test_bulk_load(self):
+        accounts = [
+            BulkAccount(name="alice"),
+            BulkAccount(name="bob"),
+            BulkAccount(
+                name="clearing",
+                type="clearing",
+                date_info=date(2022, 1, 1),
+                clearing_shares={0: 1.0, 1: 2.0},
+            ),
+            BulkAccount(
+                name="nested clearing",
+                type="clearing",
+                date_info=date(2022, 1, 1),
+                clearing_shares={2: 1.0},
+            ),
+        ]
+        transactions = [
+            BulkTransaction(
+                type="transfer",
+                name="transfer",
+                value=10.0,
+                billed_at=date(2022, 1, 2),
+                creditor_shares={0: 1.0},
+                debitor_shares={1: 1.0},
+            ),
+            BulkTransaction(
+                type="purchase",
+                name="purchase",
+                value=20.0,
+                billed_at=date(2022, 1, 3),
+                creditor_shares={1: 1.0},
+                debitor_shares={3: 1.0},
+                positions=[
+                    BulkPosition(name="item", price=5.0, usages={0: 1.0}),
+                    BulkPosition(name="common item", price=3.0, communist_shares=1.0),
+                ],
+            ),
+        ]
+        account_ids, transaction_ids = await self._load(accounts, transactions)
+
+        loaded_accounts = {
+            a.id: a
+            for a in await self.account_service.list_accounts(
+                user=self.user, group_id=self.group_id
+            )
+        }
+        self.assertEqual(set(account_ids), set(loaded_accounts.keys()))
+        nested = loaded_accounts[account_ids[3]]
+        self.assertFalse(nested.is_wip)
+        self.assertEqual(
+            {account_ids[2]: 1.0}, nested.committed_details.clearing_shares
+        )
+
+        loaded_transactions = {
+            t.id: t
+            for t in await self.transaction_service.list_transactions(
+                user=self.user, group_id=self.group_id
+            )
+        }
+        self.assertEqual(set(transaction_ids), set(loaded_transactions.keys()))
+        purchase = loaded_transactions[transaction_ids[1]]
+        self.assertFalse(purchase.is_wip)
+        self.assertEqual(
+            {account_ids[1]: 1.0}, purchase.committed_details.creditor_shares
+        )
+        self.assertEqual(
+            {account_ids[3]: 1.0}, purchase.committed_details.debitor_shares
+        )
+        self.assertEqual(
+            {"item", "common item"}, {p.name for p in purchase.committed_positions}
+        )
+
+        # the current states are valid from their commit on
+        for table, column, ids in (
+            ("account_state_validity", "account_id", account_ids),
+            ("transaction_state_validity", "transaction_id", transaction_ids),
+        ):
+            open_ranges = await self.db_conn.fetchval(
+                f"select count(*) from {table} where {column} = any($1) and upper_inf(valid_during)",
+                ids,
+            )
+            self.assertEqual(len(ids), open_ranges)
+        self.assertEqual(
+            2,
+            await self.db_conn.fetchval(
+                "select count(*) from purchase_item_state_validity where transaction_id = $1",
+                transaction_ids[1],
+            ),
+        )
+
+        # bulk loaded transactions can be edited like any other transaction
+        await self.transaction_service.update_transaction(
+            user=self.user,
+            transaction_id=transaction_ids[0],
+            value=12.0,
+            name="transfer",
+            description=None,
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            billed_at=date(2022, 1, 2),
+            tags=[],
+            creditor_shares={account_ids[0]: 1.0},
+            debitor_shares={account_ids[1]: 1.0},
+            perform_commit=True,
+        )
+        transaction = await self.transaction_service.get_transaction(
+            user=self.user, transaction_id=transaction_ids[0]
+        )
+        self.assertEqual(12.0, transaction.committed_details.value)
+
+    async def test_bulk_load_rejects_invalid_data(self):
+        accounts = [
+            BulkAccount(
+                name="clearing 1",
+                type="clearing",
+                date_info=date(2022, 1, 1),
+                clearing_shares={1: 1.0},
+            ),
+            BulkAccount(
+                name="clearing 2",
+                type="clearing",
+                date_info=date(2022, 1, 1),
+                clearing_shares={0: 1.0},
+            ),
+        ]
+        with self.assertRaises(InvalidCommand):
+            await self._load(accounts, [])
+
+        accounts = [BulkAccount(name="alice"), BulkAccount(name="bob")]
+        transfer = BulkTransaction(
+            type="transfer",
+            name="transfer",
+            value=10.0,
+            billed_at=date(2022, 1, 2),
+            creditor_shares={0: 1.0, 1: 1.0},
+            debitor_shares={1: 1.0},
+        )
+        with self.assertRaises(InvalidCommand):
+            await self._load(accounts, [transfer])
+
+        # the commit checks of the database are evaluated as well
+        with patch("abrechnung.database.bulk._check_transactions"):
+            with self.assertRaises(asyncpg.RaiseError):
+                await self._load(accounts, [transfer])
+
+        self.assertEqual(
+            [],
+            await self.transaction_service.list_transactions(
+                user=self.user, group_id=self.group_id
+            ),
+        )
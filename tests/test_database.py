@@ -0,0 +1,339 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+import asyncio
+import contextlib
+import unittest
+from unittest import IsolatedAsyncioTestCase as TestCase
+
+from abrechnung.application.groups import GroupService
+from abrechnung.framework.database import (
+    ACQUIRE_LATENCY_BUCKETS,
+    DatabaseConfig,
+    PoolConfig,
+    ReplicaRouter,
+    SessionCommit,
+    create_db_connection,
+    create_db_pool,
+    current_session_commit,
+)
+from abrechnung.framework.decorators import with_db_read_connection
+from abrechnung.framework.queries import QueryRegistry
+from .common import (
+    BaseTestCase,
+    TEST_DB_REPLICA_HOST,
+    TEST_DB_REPLICA_PORT,
+    get_test_db_config,
+)
+
+
+class MetricsPoolTest(TestCase):
+    async def asyncSetUp(self) -> None:
+        self.db_config = DatabaseConfig.model_validate(get_test_db_config())
+        self.pool = await create_db_pool(
+            self.db_config, pool_config=PoolConfig(min_size=1, max_size=1)
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.pool.close()
+
+    async def test_pool_config_is_applied(self):
+        pool = await create_db_pool(
+            self.db_config,
+            pool_config=PoolConfig(min_size=1, max_size=3, command_timeout=5),
+        )
+        try:
+            metrics = pool.metrics()
+            self.assertEqual(1, metrics.size)
+            self.assertEqual(3, metrics.max_size)
+            async with pool.acquire() as conn:
+                self.assertEqual(
+                    5, conn._config.command_timeout
+                )  # pylint: disable=protected-access
+        finally:
+            await pool.close()
+
+    async def test_metrics_track_utilization(self):
+        metrics = self.pool.metrics()
+        self.assertEqual(0, metrics.in_use)
+        self.assertEqual(0, metrics.waiting)
+        self.assertEqual(0, metrics.acquire_count)
+
+        conn = await self.pool.acquire()
+        waiter = asyncio.ensure_future(self.pool.acquire())
+        await asyncio.sleep(0.1)
+
+        metrics = self.pool.metrics()
+        self.assertEqual(1, metrics.in_use)
+        self.assertEqual(0, metrics.idle)
+        self.assertEqual(1, metrics.waiting)
+        self.assertEqual(1, metrics.acquire_count)
+
+        await self.pool.release(conn)
+        conn = await waiter
+        await self.pool.release(conn)
+
+        metrics = self.pool.metrics()
+        self.assertEqual(0, metrics.in_use)
+        self.assertEqual(0, metrics.waiting)
+        self.assertEqual(2, metrics.acquire_count)
+        # the second acquire had to wait for at least 100ms
+        self.assertGreaterEqual(metrics.acquire_latency_sum, 0.1)
+        self.assertEqual(1, metrics.acquire_latency_buckets[0.05])
+        self.assertEqual(
+            2, metrics.acquire_latency_buckets[ACQUIRE_LATENCY_BUCKETS[-1]]
+        )
+
+    async def test_acquires_opening_a_connection_do_not_wait(self):
+        pool = await create_db_pool(
+            self.db_config, pool_config=PoolConfig(min_size=1, max_size=2)
+        )
+        try:
+            async with pool.acquire():
+                # the pool has room for a second connection, opening it is not waiting for the pool
+                opening = asyncio.ensure_future(pool.acquire())
+                await asyncio.sleep(0)
+                self.assertFalse(opening.done())
+                self.assertEqual(0, pool.metrics().waiting)
+                conn = await opening
+                await pool.release(conn)
+
+            metrics = pool.metrics()
+            self.assertEqual(2, metrics.size)
+            self.assertEqual(2, metrics.acquire_count)
+        finally:
+            await pool.close()
+
+
+class ReadService:
+    def __init__(self, db_pool):
+        self.read_db_pool = db_pool
+        self.replica_router = None
+
+    @with_db_read_connection
+    async def read(self, *, conn):
+        return conn.is_in_transaction()
+
+    @with_db_read_connection(snapshot=True)
+    async def read_snapshot(self, *, conn):
+        return conn.is_in_transaction(), await conn.fetchval(
+            "select current_setting('transaction_isolation') || ' ' || current_setting('transaction_read_only')"
+        )
+
+
+class ReadConnectionTest(TestCase):
+    async def asyncSetUp(self) -> None:
+        db_config = DatabaseConfig.model_validate(get_test_db_config())
+        self.pool = await create_db_pool(
+            db_config, pool_config=PoolConfig(min_size=1, max_size=1)
+        )
+        self.service = ReadService(self.pool)
+
+    async def asyncTearDown(self) -> None:
+        await self.pool.close()
+
+    async def test_reads_run_without_transaction(self):
+        self.assertFalse(await self.service.read())
+
+    async def test_snapshot_reads(self):
+        self.assertEqual(
+            (True, "repeatable read on"), await self.service.read_snapshot()
+        )
+
+
+class QueryRegistryTest(TestCase):
+    async def asyncSetUp(self) -> None:
+        db_config = DatabaseConfig.model_validate(get_test_db_config())
+        self.conn = await create_db_connection(db_config)
+        self.registry = QueryRegistry()
+
+    async def asyncTearDown(self) -> None:
+        await self.conn.close()
+
+    async def _prepared_statements(self, conn) -> list[str]:
+        return [
+            row["statement"]
+            for row in await conn.fetch(
+                "select statement from pg_prepared_statements order by statement"
+            )
+        ]
+
+    async def test_statements_are_prepared_once(self):
+        query = self.registry.register("add_one", "select $1::int + 1")
+        self.assertEqual(2, await query.fetchval(self.conn, 1))
+        prepared = await self._prepared_statements(self.conn)
+        self.assertIn("select $1::int + 1", prepared)
+
+        self.assertEqual(3, await query.fetchval(self.conn, 2))
+        self.assertEqual(prepared, await self._prepared_statements(self.conn))
+
+        stats = self.registry.stats()["add_one"]
+        self.assertEqual(2, stats.calls)
+        self.assertGreater(stats.total_time, 0)
+
+    async def test_statements_are_reused_across_pool_acquires(self):
+        query = self.registry.register("add_one", "select $1::int + 1")
+        pool = await create_db_pool(
+            DatabaseConfig.model_validate(get_test_db_config()),
+            pool_config=PoolConfig(min_size=1, max_size=1),
+        )
+        try:
+            async with pool.acquire() as conn:
+                # statements are only prepared once they are used
+                self.assertNotIn(
+                    "select $1::int + 1", await self._prepared_statements(conn)
+                )
+            for i in range(3):
+                async with pool.acquire() as conn:
+                    self.assertEqual(i + 1, await query.fetchval(conn, i))
+            async with pool.acquire() as conn:
+                prepared = await self._prepared_statements(conn)
+            self.assertEqual(1, prepared.count("select $1::int + 1"))
+        finally:
+            await pool.close()
+
+    async def test_statements_are_not_prepared_without_statement_cache(self):
+        query = self.registry.register("add_one", "select $1::int + 1")
+        pool = await create_db_pool(
+            DatabaseConfig.model_validate(get_test_db_config()),
+            pool_config=PoolConfig(min_size=1, max_size=1, statement_cache_size=0),
+        )
+        try:
+            async with pool.acquire() as conn:
+                self.assertEqual(2, await query.fetchval(conn, 1))
+                self.assertNotIn(
+                    "select $1::int + 1", await self._prepared_statements(conn)
+                )
+        finally:
+            await pool.close()
+
+    async def test_statements_are_prepared_again_after_schema_changes(self):
+        query = self.registry.register("values", "select * from registry_test")
+        await self.conn.execute("create temporary table registry_test (a int)")
+        await self.conn.execute("insert into registry_test (a) values (1)")
+        self.assertEqual([(1,)], [tuple(r) for r in await query.fetch(self.conn)])
+
+        # the statement is prepared again after a schema change
+        await self.conn.execute("alter table registry_test add column b int")
+        self.assertEqual([(1, None)], [tuple(r) for r in await query.fetch(self.conn)])
+
+    def test_register_conflicting_query(self):
+        self.registry.register("query", "select 1")
+        self.registry.register("query", "select 1")
+        with self.assertRaises(ValueError):
+            self.registry.register("query", "select 2")
+
+
+@unittest.skipIf(
+    TEST_DB_REPLICA_HOST is None, "TEST_DB_REPLICA_HOST is not set, no replica to test"
+)
+class ReplicaRouterTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.db_config = DatabaseConfig.model_validate(get_test_db_config())
+        pool_config = PoolConfig(min_size=1, max_size=2)
+        self.primary = await create_db_pool(self.db_config, pool_config=pool_config)
+        self.replica = await create_db_pool(
+            self.db_config.model_copy(
+                update={"host": TEST_DB_REPLICA_HOST, "port": TEST_DB_REPLICA_PORT}
+            ),
+            pool_config=pool_config,
+        )
+        self.router = ReplicaRouter(primary=self.primary, replicas=[self.replica])
+
+    async def asyncTearDown(self) -> None:
+        await self.router.close()
+        await self.primary.close()
+        await super().asyncTearDown()
+
+    async def _is_replica(self, session_commit: SessionCommit = None) -> bool:
+        async with self.router.acquire(session_commit) as conn:
+            return await conn.fetchval("select pg_is_in_recovery()")
+
+    async def _create_session(self, user) -> SessionCommit:
+        session_id = await self.db_conn.fetchval(
+            "insert into session (user_id, name) values ($1, 'session') returning id",
+            user.id,
+        )
+        return SessionCommit(session_id=session_id)
+
+    async def _wait_for_replay(self):
+        async with self.primary.acquire() as conn:
+            lsn = await conn.fetchval("select pg_current_wal_lsn()")
+        async with self.replica.acquire() as conn:
+            while not await conn.fetchval(
+                "select pg_last_wal_replay_lsn() >= $1::pg_lsn", lsn
+            ):
+                await asyncio.sleep(0.05)
+
+    @contextlib.asynccontextmanager
+    async def _replica_lagging(self):
+        await self._wait_for_replay()
+        async with self.replica.acquire() as conn:
+            await conn.execute("select pg_wal_replay_pause()")
+            try:
+                yield
+            finally:
+                await conn.execute("select pg_wal_replay_resume()")
+
+    async def test_reads_are_routed_to_replica(self):
+        self.assertTrue(await self._is_replica())
+        self.assertTrue(await self._is_replica(SessionCommit(session_id=1)))
+
+    async def test_reads_after_writes_wait_for_replay(self):
+        user, _ = await self._create_test_user("user", "user@email.stusta.de")
+        session = await self._create_session(user)
+        other_session = await self._create_session(user)
+
+        async with self._replica_lagging():
+            async with self.primary.acquire() as conn:
+                async with conn.transaction():
+                    # transactions which did not write anything are not recorded
+                    await conn.fetchval("select 1")
+                    self.assertIsNone(
+                        await self.router.record_commit(conn, other_session)
+                    )
+                async with conn.transaction():
+                    await conn.execute(
+                        "update usr set username = 'changed' where id = $1", user.id
+                    )
+                    session.commit_lsn = await self.router.record_commit(conn, session)
+            self.assertIsNotNone(session.commit_lsn)
+
+            self.assertFalse(await self._is_replica(session))
+            # reads of other sessions are not affected
+            self.assertTrue(await self._is_replica(other_session))
+            self.assertTrue(await self._is_replica())
+
+            # other api workers learn about the commit when authenticating the session
+            commit_lsn = await self.db_conn.fetchval(
+                "select commit_lsn from session_last_commit where session_id = $1",
+                session.session_id,
+            )
+            other_router = ReplicaRouter(primary=self.primary, replicas=[self.replica])
+            async with other_router.acquire(
+                SessionCommit(session_id=session.session_id, commit_lsn=commit_lsn)
+            ) as conn:
+                self.assertFalse(await conn.fetchval("select pg_is_in_recovery()"))
+
+        await self._wait_for_replay()
+        self.assertTrue(await self._is_replica(session))
+
+    async def test_services_read_their_own_writes(self):
+        group_service = GroupService(
+            self.primary, config=self.test_config, replica_router=self.router
+        )
+        user, _ = await self._create_test_user("user", "user@email.stusta.de")
+        token = current_session_commit.set(await self._create_session(user))
+        try:
+            async with self._replica_lagging():
+                group_id = await group_service.create_group(
+                    user=user,
+                    name="group",
+                    description="",
+                    currency_symbol="€",
+                    terms="",
+                    add_user_account_on_join=False,
+                )
+                groups = await group_service.list_groups(user=user)
+                self.assertIn(group_id, [g.id for g in groups])
+        finally:
+            current_session_commit.reset(token)
@@ -0,0 +1,56 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase as TestCase
+
+from abrechnung.framework.loop_monitor import BlockingCallWatchdog, LoopLagMonitor
+
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+
+class LoopLagMonitorTest(TestCase):
+    async def test_lag_is_measured(self):
+        monitor = LoopLagMonitor(sample_interval=0.01)
+        self.assertEqual({}, monitor.percentiles())
+        monitor.start()
+        try:
+            await asyncio.sleep(0.05)
+            block_the_loop(0.2)
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+
+        percentiles = monitor.percentiles()
+        self.assertEqual([0.5, 0.9, 0.99, 1.0], list(percentiles.keys()))
+        self.assertGreaterEqual(percentiles[1.0], 0.15)
+        self.assertLess(percentiles[0.5], 0.15)
+
+    async def test_lag_is_reported(self):
+        monitor = LoopLagMonitor(sample_interval=0.01, report_interval=0.02)
+        with self.assertLogs("abrechnung.framework.loop_monitor", level="INFO") as logs:
+            monitor.start()
+            await asyncio.sleep(0.1)
+            await monitor.stop()
+        self.assertRegex(logs.output[0], r"Event loop lag: p50 [\d.]+ ms, .*max")
+
+
+class BlockingCallWatchdogTest(TestCase):
+    async def test_blocking_calls_are_logged(self):
+        watchdog = BlockingCallWatchdog(threshold=0.05)
+        with self.assertLogs(
+            "abrechnung.framework.loop_monitor", level="WARNING"
+        ) as logs:
+            watchdog.start()
+            try:
+                await asyncio.sleep(0.1)
+                block_the_loop(0.3)
+                await asyncio.sleep(0.1)
+            finally:
+                watchdog.stop()
+
+        # a single stall is only reported once
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("Event loop blocked for more than", logs.output[0])
+        self.assertIn("in block_the_loop", logs.output[0])
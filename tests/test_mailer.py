@@ -1,13 +1,23 @@
 # pylint: disable=attribute-defined-outside-init,missing-kwoa
 import asyncio
+import email.message
+import smtplib
+import socket
+import unittest
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Optional
 
 from aiosmtpd import smtp
 from aiosmtpd.controller import Controller
 
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.groups import GroupService
+from abrechnung.application.transactions import TransactionService
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
+from abrechnung.framework.smtp import SMTPConnectionPool
+from abrechnung.mail_templates import MailTemplateRegistry
 from abrechnung.mailer import MailerCli
 from .common import BaseTestCase, TEST_CONFIG
 
@@ -25,6 +35,15 @@ class Mail:
 class DummySMTPHandler:
     def __init__(self):
         self.mail_queue = asyncio.Queue()
+        self.n_connections = 0
+        # number of following mails which will be rejected with a temporary failure
+        self.n_mails_to_reject = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        del server, envelope  # unused
+        self.n_connections += 1
+        session.host_name = hostname
+        return responses
 
     async def handle_RCPT(
         self, server, session, envelope: smtp.Envelope, address: str, rcpt_options
@@ -35,6 +54,9 @@ class DummySMTPHandler:
 
     async def handle_DATA(self, server, session, envelope: smtp.Envelope):
         del server, session  # unused
+        if self.n_mails_to_reject > 0:
+            self.n_mails_to_reject -= 1
+            return "451 Requested action aborted: try again later"
         await self.mail_queue.put(envelope)
         return "250 Message accepted for delivery"
 
@@ -53,6 +75,7 @@ class MailerTest(BaseTestCase):
                     "host": self.smtp.hostname,
                     "port": self.smtp.port,
                     "address": "abrechnung@stusta.de",
+                    "retry_delay": 1,
                 }
             }
         )
@@ -68,6 +91,55 @@ class MailerTest(BaseTestCase):
         self.mailer_task.cancel()
         self.smtp.stop()
 
+    async def test_failed_mails_are_retried(self):
+        self.smtp_handler.n_mails_to_reject = 1
+        user_email = "user@email.com"
+        await self._create_test_user(username="user", email=user_email)
+        await self.user_service.request_password_recovery(email=user_email)
+
+        await asyncio.sleep(0.3)
+        self.assertTrue(self.smtp_handler.mail_queue.empty())
+        mail = await self.db_conn.fetchrow(
+            "select attempts, last_error, sent_at from mail_outbox where dest_address = $1",
+            user_email,
+        )
+        self.assertEqual(1, mail["attempts"])
+        self.assertIsNotNone(mail["last_error"])
+        self.assertIsNone(mail["sent_at"])
+
+        await asyncio.sleep(1.2)
+        mail: smtp.Envelope = self.smtp_handler.mail_queue.get_nowait()
+        self.assertIn(user_email, mail.rcpt_tos)
+        mail = await self.db_conn.fetchrow(
+            "select attempts, last_error, sent_at from mail_outbox where dest_address = $1",
+            user_email,
+        )
+        self.assertEqual(2, mail["attempts"])
+        self.assertIsNone(mail["last_error"])
+        self.assertIsNotNone(mail["sent_at"])
+
+    async def test_concurrent_mailers_send_each_mail_once(self):
+        other_mailer = MailerCli(config=self.mailer_config)
+        other_mailer_task = asyncio.create_task(other_mailer.run())
+        await asyncio.sleep(0.2)
+
+        n_mails = 50
+        await self.db_conn.execute(
+            "insert into mail_outbox (dest_address, dest_name, subject, body) "
+            "select 'user' || i || '@email.com', 'user' || i, 'subject', 'body' "
+            "from generate_series(1, $1) i",
+            n_mails,
+        )
+        await asyncio.sleep(1)
+        other_mailer_task.cancel()
+
+        recipients = []
+        while not self.smtp_handler.mail_queue.empty():
+            mail: smtp.Envelope = self.smtp_handler.mail_queue.get_nowait()
+            recipients.extend(mail.rcpt_tos)
+        self.assertEqual(n_mails, len(recipients))
+        self.assertEqual(n_mails, len(set(recipients)))
+
     async def test_registration_mail_delivery(self):
         user_email = "user@email.com"
         await self.user_service.register_user(
@@ -110,3 +182,252 @@ class MailerTest(BaseTestCase):
         self.assertIsNotNone(mail)
         self.assertIn(user_email, mail.rcpt_tos)
         self.assertIn("[Test Abrechnung] Reset password", mail.content.decode("utf-8"))
+
+
+class MailTemplateRegistryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.registry = MailTemplateRegistry(
+            service_name="Test $Abrechnung",
+            service_url="https://abrechnung.example.lol",
+            templates={
+                "en": {
+                    "greeting": ("", "Hi $dest_name,\n"),
+                    "closing": ("", "\n$service_name"),
+                    "invite": ("Invite", "join at $service_url/$token"),
+                },
+                "de": {
+                    "greeting": ("", "Hallo $dest_name,\n"),
+                    "closing": ("", "\n$service_name"),
+                },
+            },
+        )
+
+    def test_render_many(self):
+        rendered = self.registry.render_many(
+            "invite",
+            [
+                {"dest_name": "user1", "token": "a"},
+                {"dest_name": "user2", "token": "b"},
+            ],
+        )
+        self.assertEqual(
+            [
+                (
+                    "[Test $Abrechnung] Invite",
+                    "Hi user1,\njoin at https://abrechnung.example.lol/a\nTest $Abrechnung",
+                ),
+                (
+                    "[Test $Abrechnung] Invite",
+                    "Hi user2,\njoin at https://abrechnung.example.lol/b\nTest $Abrechnung",
+                ),
+            ],
+            rendered,
+        )
+
+    def test_missing_locale_falls_back_to_default(self):
+        subject, body = self.registry.render(
+            "invite", {"dest_name": "user1", "token": "a"}, locale="de"
+        )
+        self.assertEqual("[Test $Abrechnung] Invite", subject)
+        self.assertTrue(body.startswith("Hi user1"))
+
+    def test_missing_parameter(self):
+        with self.assertRaises(KeyError):
+            self.registry.render("invite", {"dest_name": "user1"})
+
+
+class SMTPConnectionPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.smtp_handler = DummySMTPHandler()
+        self.smtp = Controller(self.smtp_handler)
+        self.smtp.start()
+
+        self.connections: list[smtplib.SMTP] = []
+
+    async def asyncTearDown(self) -> None:
+        self.smtp.stop()
+
+    def connect(self) -> smtplib.SMTP:
+        conn = smtplib.SMTP(host=self.smtp.hostname, port=self.smtp.port)
+        self.connections.append(conn)
+        return conn
+
+    @staticmethod
+    def make_message(i: int) -> email.message.EmailMessage:
+        msg = email.message.EmailMessage()
+        msg.set_content(f"mail {i}")
+        msg["Subject"] = f"mail {i}"
+        msg["To"] = f"user{i}@example.lol"
+        msg["From"] = "abrechnung@example.lol"
+        return msg
+
+    async def test_connections_are_reused(self):
+        pool = SMTPConnectionPool(self.connect, max_connections=2, idle_timeout=30)
+        await asyncio.gather(
+            *(pool.send_message(self.make_message(i)) for i in range(20))
+        )
+        await pool.close()
+
+        self.assertEqual(20, self.smtp_handler.mail_queue.qsize())
+        self.assertLessEqual(len(self.connections), 2)
+        self.assertEqual(len(self.connections), self.smtp_handler.n_connections)
+
+    async def test_reconnect_after_connection_loss(self):
+        pool = SMTPConnectionPool(self.connect, max_connections=1, idle_timeout=30)
+        await pool.send_message(self.make_message(0))
+        # simulate the server dropping the idle connection
+        self.connections[0].sock.shutdown(socket.SHUT_RDWR)
+        await pool.send_message(self.make_message(1))
+        await pool.close()
+
+        self.assertEqual(2, self.smtp_handler.mail_queue.qsize())
+        self.assertEqual(2, len(self.connections))
+
+    async def test_idle_connections_are_closed(self):
+        pool = SMTPConnectionPool(self.connect, max_connections=1, idle_timeout=0.1)
+        await pool.send_message(self.make_message(0))
+        await asyncio.sleep(0.3)
+        await pool.send_message(self.make_message(1))
+        await pool.close()
+
+        self.assertEqual(2, len(self.connections))
+        self.assertIsNone(self.connections[0].sock)
+
+
+class MailerEventCoalescingTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.smtp_handler = DummySMTPHandler()
+        self.smtp = Controller(self.smtp_handler)
+        self.smtp.start()
+
+        config = TEST_CONFIG.copy()
+        config.update(
+            {
+                "email": {
+                    "host": self.smtp.hostname,
+                    "port": self.smtp.port,
+                    "address": "abrechnung@stusta.de",
+                    "sweep_interval": 0.5,
+                }
+            }
+        )
+        self.mailer = MailerCli(config=Config.parse_obj(config))
+        self.n_handler_calls = 0
+        handler = self.mailer.event_handlers[("mailer", "pending_registration")]
+
+        async def counting_handler():
+            self.n_handler_calls += 1
+            await handler()
+
+        self.mailer.event_handlers[("mailer", "pending_registration")] = (
+            counting_handler
+        )
+        self.mailer_task = asyncio.create_task(self.mailer.run())
+
+    async def asyncTearDown(self) -> None:
+        await super().asyncTearDown()
+        self.mailer_task.cancel()
+        self.smtp.stop()
+
+    async def test_notification_bursts_are_coalesced(self):
+        await asyncio.sleep(0.2)
+        self.assertEqual(1, self.n_handler_calls)  # initial run on startup
+
+        for _ in range(500):
+            self.mailer.events.put_nowait(("mailer", "pending_registration"))
+        await asyncio.sleep(0.1)
+        self.assertEqual(2, self.n_handler_calls)
+
+        # the periodic sweep runs the handlers without any notification
+        await asyncio.sleep(0.6)
+        self.assertEqual(3, self.n_handler_calls)
+
+
+class GroupDigestTest(BaseTestCase):
+    async def asyncSetUp(self) -> None:
+        await super().asyncSetUp()
+        self.smtp_handler = DummySMTPHandler()
+        self.smtp = Controller(self.smtp_handler)
+        self.smtp.start()
+
+        config = TEST_CONFIG.copy()
+        config.update(
+            {
+                "email": {
+                    "host": self.smtp.hostname,
+                    "port": self.smtp.port,
+                    "address": "abrechnung@stusta.de",
+                    "digest_interval": 3600,
+                }
+            }
+        )
+        self.mailer = MailerCli(config=Config.parse_obj(config))
+        self.mailer_task: Optional[asyncio.Task] = None
+
+        self.group_service = GroupService(self.db_pool, config=self.test_config)
+        self.account_service = AccountService(self.db_pool, config=self.test_config)
+        self.transaction_service = TransactionService(
+            self.db_pool, config=self.test_config
+        )
+
+    async def asyncTearDown(self) -> None:
+        await super().asyncTearDown()
+        if self.mailer_task is not None:
+            self.mailer_task.cancel()
+        self.smtp.stop()
+
+    async def test_digest_covers_activity_of_other_members(self):
+        user1, _ = await self._create_test_user("user1", "user1@email.com")
+        user2, _ = await self._create_test_user("user2", "user2@email.com")
+        group_id = await self.group_service.create_group(
+            user=user1,
+            name="digest group",
+            description="",
+            currency_symbol="€",
+            terms="",
+            add_user_account_on_join=False,
+        )
+        await self.db_conn.execute(
+            "insert into group_membership (user_id, group_id, invited_by) values ($1, $2, $3)",
+            user2.id,
+            group_id,
+            user1.id,
+        )
+        account1_id = await self.account_service.create_account(
+            user=user1, group_id=group_id, type="personal", name="a1", description=""
+        )
+        account2_id = await self.account_service.create_account(
+            user=user1, group_id=group_id, type="personal", name="a2", description=""
+        )
+        await self.transaction_service.create_transaction(
+            user=user1,
+            group_id=group_id,
+            type="purchase",
+            name="foo",
+            description="foo",
+            billed_at=datetime.now().date(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=33,
+            debitor_shares={account1_id: 1.0},
+            creditor_shares={account2_id: 1.0},
+            perform_commit=True,
+        )
+
+        self.mailer_task = asyncio.create_task(self.mailer.run())
+        await asyncio.sleep(0.5)
+
+        # only user2 receives a digest, user1 did everything themselves
+        mail: smtp.Envelope = self.smtp_handler.mail_queue.get_nowait()
+        self.assertEqual(["user2@email.com"], mail.rcpt_tos)
+        content = mail.content.decode("utf-8")
+        self.assertIn("[Test Abrechnung] Group activity", content)
+        self.assertIn("digest group: 1 changed transaction(s)", content)
+        self.assertTrue(self.smtp_handler.mail_queue.empty())
+
+        # the next digest is only due after the digest interval
+        await self.mailer.on_group_digest()
+        await asyncio.sleep(0.5)
+        self.assertTrue(self.smtp_handler.mail_queue.empty())
@@ -0,0 +1,102 @@
+# pylint: disable=attribute-defined-outside-init,missing-kwoa
+from unittest import IsolatedAsyncioTestCase as TestCase
+
+from abrechnung.framework.database import (
+    DatabaseConfig,
+    PoolConfig,
+    create_db_connection,
+    create_db_pool,
+)
+from abrechnung.framework.decorators import with_db_connection
+from abrechnung.framework.metrics import query_fingerprint, query_metrics
+from .common import get_test_db_config
+
+
+class CountingService:
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+    @with_db_connection
+    async def count(self, *, conn, n: int):
+        return await conn.fetch("select generate_series(1, $1) as i", n)
+
+
+class QueryFingerprintTest(TestCase):
+    def test_literals_are_replaced(self):
+        fingerprint, normalized = query_fingerprint(
+            "select *\n  from usr where id = 42 and name = 'it''s' and x = $1"
+        )
+        self.assertEqual(
+            "select * from usr where id = ? and name = ? and x = $1", normalized
+        )
+        self.assertEqual(
+            fingerprint,
+            query_fingerprint(
+                "select * from usr where id = 1 and name = 'foo' and x = $1"
+            )[0],
+        )
+        self.assertNotEqual(
+            fingerprint,
+            query_fingerprint("select * from usr where id = 1 and x = $2")[0],
+        )
+
+
+class QueryMetricsTest(TestCase):
+    async def asyncSetUp(self) -> None:
+        self.db_config = DatabaseConfig.model_validate(get_test_db_config())
+        self.conn = await create_db_connection(self.db_config)
+
+    async def asyncTearDown(self) -> None:
+        await self.conn.close()
+
+    async def test_queries_are_recorded_per_service_method(self):
+        pool = await create_db_pool(
+            self.db_config, pool_config=PoolConfig(min_size=1, max_size=1)
+        )
+        try:
+            service = CountingService(pool)
+            await service.count(n=3)
+            await service.count(n=4)
+        finally:
+            await pool.close()
+
+        metric = query_metrics.get(
+            "select generate_series(1, $1) as i", "CountingService.count"
+        )
+        self.assertIsNotNone(metric)
+        self.assertEqual(2, metric.calls)
+        self.assertEqual(7, metric.rows)
+        self.assertEqual(2, metric.duration.count)
+
+    async def test_requests_count_their_queries(self):
+        with query_metrics.track_request() as request_queries:
+            await self.conn.fetchval("select 1")
+            await self.conn.execute("select 2")
+        await self.conn.execute("select 3")
+        self.assertEqual(2, request_queries.count)
+
+    async def test_slow_queries_are_logged(self):
+        self.conn.slow_query_threshold = 0.01
+        with self.assertLogs("abrechnung.framework.metrics", level="WARNING") as logs:
+            await self.conn.execute("select pg_sleep(0.02)")
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("select pg_sleep(?)", logs.output[0])
+
+    async def test_failed_queries_are_recorded(self):
+        with self.assertRaises(Exception):
+            await self.conn.execute("select 1 / $1", 0)
+        metric = query_metrics.get("select 1 / $1")
+        self.assertEqual(1, metric.errors)
+
+    async def test_render(self):
+        await self.conn.fetch("select 'metrics test'")
+        rendered = "\n".join(query_metrics.render())
+        fingerprint, _ = query_fingerprint("select 'metrics test'")
+        self.assertIn(
+            f'abrechnung_query_info{{fingerprint="{fingerprint}",query="select ?"}} 1',
+            rendered,
+        )
+        self.assertIn(
+            f'abrechnung_query_duration_seconds_count{{fingerprint="{fingerprint}",method=""}}',
+            rendered,
+        )
@@ -5,6 +5,7 @@ from datetime import datetime
 from abrechnung.application.accounts import AccountService
 from abrechnung.application.groups import GroupService
 from abrechnung.application.transactions import TransactionService
+from abrechnung.domain.transactions import TransactionPosition
 from .common import BaseTestCase
 
 
@@ -135,6 +136,165 @@ class TransactionLogicTest(BaseTestCase):
                 clearing_shares={account1_id: 1.0},
             )
 
+        # the cycle is rejected by the committing statement, not only at the end of the database transaction
+        async with self.db_pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            revision_id = await conn.fetchval(
+                "insert into account_revision (user_id, account_id) values ($1, $2) returning id",
+                self.user.id,
+                account1_id,
+            )
+            await conn.execute(
+                "insert into account_history (id, revision_id, name, date_info) values ($1, $2, 'account1', now())",
+                account1_id,
+                revision_id,
+            )
+            await conn.execute(
+                "insert into clearing_account_share (account_id, revision_id, share_account_id, shares) "
+                "values ($1, $2, $3, 1.0)",
+                account1_id,
+                revision_id,
+                account2_id,
+            )
+            with self.assertRaises(Exception) as ctx:
+                await conn.execute(
+                    "update account_revision set committed = now() where id = $1",
+                    revision_id,
+                )
+            await transaction.rollback()
+        self.assertIn(
+            "this change would result in a cyclic dependency between clearing accounts",
+            str(ctx.exception),
+        )
+
+    async def test_clearing_account_cycles_use_latest_revision(self):
+        account1_id, account2_id, account3_id = await self._create_accounts(
+            self.group_id, 3, account_type="clearing"
+        )
+        personal_account_id = (await self._create_accounts(self.group_id, 1))[0]
+
+        async def set_shares(account_id: int, shares: dict[int, float]):
+            await self.account_service.update_account(
+                user=self.user,
+                account_id=account_id,
+                name=f"account{account_id}",
+                description="",
+                date_info=datetime.now().date(),
+                clearing_shares=shares,
+            )
+
+        await set_shares(account1_id, {account2_id: 1.0})
+        await set_shares(account2_id, {account3_id: 1.0})
+        with self.assertRaises(Exception) as ctx:
+            await set_shares(account3_id, {account1_id: 1.0})
+        self.assertTrue(
+            "this change would result in a cyclic dependency between clearing accounts"
+            in str(ctx.exception)
+        )
+
+        # once account 1 no longer distributes to account 2 in its latest revision the former cycle is valid
+        await set_shares(account1_id, {personal_account_id: 1.0})
+        await set_shares(account3_id, {account1_id: 1.0})
+        account = await self.account_service.get_account(
+            user=self.user, account_id=account3_id
+        )
+        self.assertEqual({account1_id: 1.0}, account.committed_details.clearing_shares)
+
+        # deleted accounts are removed from the clearing graph
+        await set_shares(account3_id, {personal_account_id: 1.0})
+        await self.account_service.delete_account(
+            user=self.user, account_id=account1_id
+        )
+        async with self.db_pool.acquire() as conn:
+            self.assertEqual(
+                [],
+                await conn.fetch(
+                    "select * from clearing_account_edge where account_id = $1",
+                    account1_id,
+                ),
+            )
+            self.assertEqual(
+                [(account2_id, account3_id), (account3_id, personal_account_id)],
+                [
+                    tuple(row)
+                    for row in await conn.fetch(
+                        "select account_id, share_account_id from clearing_account_edge e "
+                        "join account a on a.id = e.account_id where a.group_id = $1 "
+                        "order by account_id",
+                        self.group_id,
+                    )
+                ],
+            )
+
+    async def test_commit_checks(self):
+        account1_id, account2_id = await self._create_accounts(self.group_id, 2)
+        transaction_id = await self.transaction_service.create_transaction(
+            user=self.user,
+            group_id=self.group_id,
+            type="purchase",
+            name="foo",
+            description="foo",
+            billed_at=datetime.now().date(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            value=33,
+            debitor_shares={account1_id: 1.0},
+            creditor_shares={account2_id: 1.0},
+            positions=[
+                TransactionPosition(
+                    id=-1,
+                    name="item",
+                    price=5,
+                    communist_shares=0,
+                    usages={},
+                )
+            ],
+        )
+        with self.assertRaises(Exception) as ctx:
+            await self.transaction_service.commit_transaction(
+                user=self.user, transaction_id=transaction_id
+            )
+        self.assertTrue(
+            "all transaction positions must have at least one account assigned"
+            in str(ctx.exception)
+        )
+
+        # the pending change can still be edited, only committing it is validated
+        transaction = await self.transaction_service.get_transaction(
+            user=self.user, transaction_id=transaction_id
+        )
+        position_id = transaction.pending_positions[0].id
+        await self.transaction_service.update_transaction(
+            user=self.user,
+            transaction_id=transaction_id,
+            value=33,
+            name="foo",
+            description="foo",
+            billed_at=datetime.now().date(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            tags=[],
+            debitor_shares={account1_id: 1.0},
+            creditor_shares={account2_id: 1.0},
+            positions=[
+                TransactionPosition(
+                    id=position_id,
+                    name="item",
+                    price=5,
+                    communist_shares=1,
+                    usages={},
+                )
+            ],
+            perform_commit=True,
+        )
+        transaction = await self.transaction_service.get_transaction(
+            user=self.user, transaction_id=transaction_id
+        )
+        self.assertFalse(transaction.is_wip)
+        self.assertEqual(1, transaction.committed_positions[0].communist_shares)
+
     async def test_file_upload(self):
         account1_id, account2_id = await self._create_accounts(self.group_id, 2)
         transaction_id = await self.transaction_service.create_transaction(
@@ -0,0 +1,112 @@
+"""
+Measure mail delivery throughput of the pooled smtp delivery against a local aiosmtpd stand-in.
+
+Compares sending with a fresh connection per mail (the previous behaviour of the mailer)
+to the SMTPConnectionPool with different levels of parallelism.
+"""
+
+import argparse
+import asyncio
+import email.message
+import smtplib
+import time
+
+from aiosmtpd.controller import Controller
+
+from abrechnung.framework.smtp import SMTPConnectionPool
+
+
+class CountingHandler:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.n_mails = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        del server, session, envelope  # unused
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.n_mails += 1
+        return "250 Message accepted for delivery"
+
+
+def make_message(i: int) -> email.message.EmailMessage:
+    msg = email.message.EmailMessage()
+    msg.set_content(f"benchmark mail {i}")
+    msg["Subject"] = f"benchmark mail {i}"
+    msg["To"] = f"user{i}@example.lol"
+    msg["From"] = "abrechnung@example.lol"
+    return msg
+
+
+async def send_unpooled(host: str, port: int, n_mails: int):
+    for i in range(n_mails):
+        mailer = smtplib.SMTP(host=host, port=port)
+        mailer.send_message(make_message(i))
+        mailer.quit()
+
+
+async def send_pooled(host: str, port: int, n_mails: int, parallelism: int):
+    pool = SMTPConnectionPool(
+        lambda: smtplib.SMTP(host=host, port=port), max_connections=parallelism
+    )
+    await asyncio.gather(*(pool.send_message(make_message(i)) for i in range(n_mails)))
+    await pool.close()
+
+
+async def main(n_mails: int, parallelism: list[int], latency: float, port: int):
+    handler = CountingHandler(latency=latency)
+    host = "127.0.0.1"
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+
+    try:
+        runs = [("connection per mail", send_unpooled(host, port, n_mails))]
+        for n in parallelism:
+            runs.append(
+                (f"pooled, {n} connections", send_pooled(host, port, n_mails, n))
+            )
+
+        for name, run in runs:
+            handler.n_mails = 0
+            start = time.perf_counter()
+            await run
+            duration = time.perf_counter() - start
+            print(
+                f"{name:<25} {handler.n_mails} mails in {duration:.2f}s, "
+                f"{handler.n_mails / duration:.1f} mails/s"
+            )
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--mails", type=int, default=1000, help="number of mails to send"
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="numbers of concurrent smtp connections to benchmark",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="simulated processing time of the mail server per mail in seconds",
+    )
+    parser.add_argument(
+        "--port", type=int, default=8025, help="port of the local smtp stand-in"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            n_mails=args.mails,
+            parallelism=args.parallelism,
+            latency=args.latency,
+            port=args.port,
+        )
+    )
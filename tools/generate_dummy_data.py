@@ -2,14 +2,25 @@
 import argparse
 import asyncio
 import random
+import time
 from datetime import datetime, timedelta, date
 from pathlib import Path
 
+import asyncpg
+
 from abrechnung.application.accounts import AccountService
 from abrechnung.application.groups import GroupService
 from abrechnung.application.transactions import TransactionService
 from abrechnung.application.users import UserService
 from abrechnung.config import read_config
+from abrechnung.database.bulk import (
+    BulkAccount,
+    BulkPosition,
+    BulkTransaction,
+    bulk_load_accounts,
+    bulk_load_transactions,
+)
+from abrechnung.domain.transactions import TransactionPosition
 from abrechnung.framework.database import create_db_pool
 
 
@@ -17,6 +28,109 @@ def random_date() -> date:
     return (datetime.now() + timedelta(days=random.randint(-50, 50))).date()
 
 
+def random_positions(
+    account_ids: list[int], n_positions: int
+) -> list[TransactionPosition]:
+    positions = []
+    for i in range(n_positions):
+        usages = random.choices(account_ids, k=random.randint(0, 3))
+        positions.append(
+            TransactionPosition(
+                id=-(i + 1),
+                name=f"Item {i}",
+                price=round(random.random() * 20, 2),
+                communist_shares=0.0 if usages else 1.0,
+                usages={k: 1.0 for k in usages},
+            )
+        )
+    return positions
+
+
+async def generate_bulk(
+    conn: asyncpg.Connection,
+    user_id: int,
+    group_id: int,
+    n_purchases: int,
+    n_transfers: int,
+    n_accounts: int,
+    n_events: int,
+    people_per_transaction: int,
+    positions_per_purchase: int,
+):
+    """
+    same distribution as the generation via the services, but all rows are written with COPY in a single
+    database transaction. Shares reference accounts by their index in the list of generated accounts.
+    """
+    print(f"Generating {n_accounts} accounts and {n_events} events")
+    accounts = [BulkAccount(name=f"Account {i}") for i in range(n_accounts)]
+    for i in range(n_events):
+        n_involved = random.randint(
+            max(2, people_per_transaction - 4),
+            min(n_accounts, people_per_transaction + 4),
+        )
+        shares = random.choices(range(n_accounts), k=n_involved)
+        accounts.append(
+            BulkAccount(
+                name=f"Event {i}",
+                type="clearing",
+                date_info=random_date(),
+                clearing_shares={k: 1.0 for k in shares},
+            )
+        )
+
+    print(f"Generating {n_purchases} purchases and {n_transfers} transfers")
+    account_indices = list(range(n_accounts + n_events))
+    transactions = []
+    for i in range(n_purchases):
+        n_involved = random.randint(
+            max(2, people_per_transaction - 4),
+            min(n_accounts + n_events, people_per_transaction + 4),
+        )
+        debitors = random.choices(account_indices, k=n_involved)
+        transactions.append(
+            BulkTransaction(
+                type="purchase",
+                name=f"Purchase {i}",
+                value=random.random() * 100,
+                billed_at=random_date(),
+                creditor_shares={random.choice(account_indices): 1.0},
+                debitor_shares={k: 1.0 for k in debitors},
+                positions=[
+                    BulkPosition(
+                        name=position.name,
+                        price=position.price,
+                        communist_shares=position.communist_shares,
+                        usages=position.usages,
+                    )
+                    for position in random_positions(
+                        account_indices, positions_per_purchase
+                    )
+                ],
+            )
+        )
+    for i in range(n_transfers):
+        transactions.append(
+            BulkTransaction(
+                type="transfer",
+                name=f"Transfer {i}",
+                value=random.random() * 200,
+                billed_at=random_date(),
+                creditor_shares={random.choice(account_indices): 1.0},
+                debitor_shares={random.choice(account_indices): 1.0},
+            )
+        )
+
+    print("Writing generated data")
+    start = time.perf_counter()
+    async with conn.transaction():
+        account_ids = await bulk_load_accounts(conn, group_id, user_id, accounts)
+        await bulk_load_transactions(conn, group_id, user_id, account_ids, transactions)
+    print(
+        f"Wrote {len(accounts)} accounts and {len(transactions)} transactions "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
 async def main(
     config_path: str,
     group_name: str,
@@ -25,7 +139,9 @@ async def main(
     n_accounts: int,
     n_events: int,
     people_per_transaction: int,
+    positions_per_purchase: int,
     user_id: int,
+    bulk: bool,
 ):
     config = read_config(Path(config_path))
 
@@ -46,6 +162,22 @@ async def main(
         terms="",
     )
 
+    if bulk:
+        async with db_pool.acquire() as conn:
+            await generate_bulk(
+                conn=conn,
+                user_id=user.id,
+                group_id=group_id,
+                n_purchases=n_purchases,
+                n_transfers=n_transfers,
+                n_accounts=n_accounts,
+                n_events=n_events,
+                people_per_transaction=people_per_transaction,
+                positions_per_purchase=positions_per_purchase,
+            )
+        print("Finished generating dummy data")
+        return
+
     account_ids = []
     print(f"Generating {n_accounts} accounts")
     for i in range(n_accounts):
@@ -98,13 +230,14 @@ async def main(
             type="purchase",
             value=random.random() * 100,
             name=f"Purchase {i}",
-            description="",
+            description=None,
             billed_at=random_date(),
             currency_symbol="€",
             currency_conversion_rate=1.0,
             tags=[],
             creditor_shares=creditor_shares,
             debitor_shares=debitor_shares,
+            positions=random_positions(account_ids, positions_per_purchase),
             perform_commit=True,
         )
         transaction_ids.append(transaction_id)
@@ -121,7 +254,7 @@ async def main(
             type="transfer",
             value=random.random() * 200,
             name=f"Transfer {i}",
-            description="",
+            description=None,
             billed_at=random_date(),
             currency_symbol="€",
             currency_conversion_rate=1.0,
@@ -186,6 +319,18 @@ def parse_args():
         default=3,
         help="average number of people participating in transactions",
     )
+    cli.add_argument(
+        "--positions-per-purchase",
+        type=int,
+        default=0,
+        help="number of positions to generate for each purchase",
+    )
+    cli.add_argument(
+        "--bulk",
+        action="store_true",
+        help="write all data directly via COPY instead of going through the services, "
+        "suited for generating large groups",
+    )
     return cli.parse_args()
 
 
@@ -201,5 +346,7 @@ if __name__ == "__main__":
             n_accounts=args.n_accounts,
             n_events=args.n_events,
             people_per_transaction=args.average_people_per_transaction,
+            positions_per_purchase=args.positions_per_purchase,
+            bulk=args.bulk,
         )
     )
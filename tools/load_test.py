@@ -0,0 +1,435 @@
+"""
+Simulate many concurrent users against a locally running ``abrechnung api``.
+
+A group with the given number of users is prepared directly in the database of the api. Every simulated user then
+logs in over http, subscribes to the transactions of the group over the websocket and alternates between polling the
+list endpoints and pushing edits via the sync endpoint, with exponentially distributed think times in between.
+
+Reports the throughput and latency percentiles per endpoint as well as the delay between an edit being sent and
+the other users being notified about it.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import websockets
+
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.groups import GroupService
+from abrechnung.application.users import UserService
+from abrechnung.config import read_config
+from abrechnung.database.bulk import BulkTransaction, bulk_load_transactions
+from abrechnung.framework.database import create_db_pool
+from benchmarks.cases import summarize
+
+PASSWORD = "load-test"
+
+# relative frequency of the actions of a simulated user
+ACTIONS = {
+    "list_transactions": 2,
+    "poll_transactions": 4,
+    "list_accounts": 2,
+    "sync_transactions": 2,
+}
+
+
+@dataclass
+class LoadTestGroup:
+    group_id: int
+    usernames: list[str]
+    account_ids: list[int]
+
+
+@dataclass
+class Stats:
+    # endpoint -> request durations in seconds
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    # (transaction id, user index, time the sync request was sent)
+    edits: list[tuple[int, int, float]] = field(default_factory=list)
+    # user index -> transaction id -> times a notification about it was received
+    notifications: dict[int, dict[int, list[float]]] = field(
+        default_factory=lambda: defaultdict(lambda: defaultdict(list))
+    )
+
+    def notification_lags(self) -> list[float]:
+        """for every edit and every other user the delay until the first notification about the edit"""
+        lags = []
+        for transaction_id, editor, sent_at in self.edits:
+            for user, received in self.notifications.items():
+                if user == editor:
+                    continue
+                arrivals = [t for t in received.get(transaction_id, []) if t >= sent_at]
+                if arrivals:
+                    lags.append(min(arrivals) - sent_at)
+        return lags
+
+
+async def prepare_group(
+    config_path: str, n_users: int, n_transactions: int
+) -> LoadTestGroup:
+    config = read_config(Path(config_path))
+    db_pool = await create_db_pool(config.database)
+    user_service = UserService(db_pool, config)
+    group_service = GroupService(db_pool, config)
+    account_service = AccountService(db_pool, config)
+
+    prefix = f"load-test-{int(time.time())}"
+    usernames = [f"{prefix}-{i}" for i in range(n_users)]
+    users = []
+    for username in usernames:
+        user_id = await user_service.demo_register_user(
+            username=username, email=f"{username}@load-test.invalid", password=PASSWORD
+        )
+        users.append(await user_service.get_user(user_id=user_id))
+
+    group_id = await group_service.create_group(
+        user=users[0],
+        name=prefix,
+        description="load test group",
+        currency_symbol="€",
+        terms="",
+        add_user_account_on_join=True,
+    )
+    invite_id = await group_service.create_invite(
+        user=users[0],
+        group_id=group_id,
+        description="load test",
+        single_use=False,
+        join_as_editor=True,
+        valid_until=datetime.now(timezone.utc) + timedelta(days=1),
+    )
+    async with db_pool.acquire() as conn:
+        invite_token = await conn.fetchval(
+            "select token from group_invite where id = $1", invite_id
+        )
+    for user in users[1:]:
+        await group_service.join_group(user=user, invite_token=invite_token)
+
+    accounts = await account_service.list_accounts(user=users[0], group_id=group_id)
+    account_ids = [account.id for account in accounts]
+    if len(account_ids) < 2:
+        raise ValueError("a load test needs at least two users")
+
+    # initial transactions such that the list endpoints return realistic amounts of data
+    transactions = [
+        BulkTransaction(
+            type="transfer",
+            name=f"Transfer {i}",
+            value=round(random.uniform(1, 200), 2),
+            billed_at=date.today() - timedelta(days=random.randrange(365)),
+            creditor_shares={creditor: 1.0},
+            debitor_shares={debitor: 1.0},
+        )
+        for i in range(n_transactions)
+        for creditor, debitor in [random.sample(range(len(account_ids)), k=2)]
+    ]
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            await bulk_load_transactions(
+                conn, group_id, users[0].id, account_ids, transactions
+            )
+        # bulk loading bypasses autovacuum's statistics, without them the list queries get pathological plans
+        await conn.execute("analyze")
+
+    await db_pool.close()
+    return LoadTestGroup(
+        group_id=group_id, usernames=usernames, account_ids=account_ids
+    )
+
+
+class SimulatedUser:
+    def __init__(
+        self,
+        index: int,
+        username: str,
+        group: LoadTestGroup,
+        api_url: str,
+        think_time: float,
+        stats: Stats,
+    ):
+        self.index = index
+        self.username = username
+        self.group = group
+        self.api_url = api_url
+        self.think_time = think_time
+        self.stats = stats
+        self.rng = random.Random(index)
+        self.client = httpx.AsyncClient(base_url=api_url, timeout=60)
+        self.access_token: Optional[str] = None
+        self.last_poll: Optional[datetime] = None
+        self.own_transaction_ids: list[int] = []
+
+    async def _request(self, name: str, method: str, url: str, **kwargs):
+        headers = {}
+        if self.access_token is not None:
+            headers["Authorization"] = f"Bearer {self.access_token}"
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=headers, **kwargs)
+            response.raise_for_status()
+        except httpx.HTTPError:
+            self.stats.errors[name] += 1
+            return None
+        self.stats.latencies[name].append(time.perf_counter() - start)
+        return response.json()
+
+    async def login(self):
+        token = await self._request(
+            "login",
+            "POST",
+            "/api/v1/auth/login",
+            json={
+                "username": self.username,
+                "password": PASSWORD,
+                "session_name": "load test",
+            },
+        )
+        if token is None:
+            raise RuntimeError(f"login of {self.username} failed")
+        self.access_token = token["access_token"]
+
+    async def listen(self, subscribed: asyncio.Event):
+        ws_url = self.api_url.replace("http", "ws", 1) + "/api/v1/ws"
+        async with websockets.connect(ws_url) as ws:
+            await ws.send(
+                json.dumps(
+                    {
+                        "type": "subscribe",
+                        "token": self.access_token,
+                        "data": {
+                            "subscription_type": "transaction",
+                            "element_id": self.group.group_id,
+                        },
+                    }
+                )
+            )
+            async for message in ws:
+                now = time.perf_counter()
+                message = json.loads(message)
+                if message["type"] == "subscribe_success":
+                    subscribed.set()
+                elif (
+                    message["type"] == "notification"
+                    and "transaction_id" in message["data"]
+                ):
+                    self.stats.notifications[self.index][
+                        message["data"]["transaction_id"]
+                    ].append(now)
+
+    def _transfer(self, transaction_id: int) -> dict:
+        creditor, debitor = self.rng.sample(self.group.account_ids, k=2)
+        return {
+            "id": transaction_id,
+            "group_id": self.group.group_id,
+            "type": "transfer",
+            "name": f"Load test transfer of {self.username}",
+            "description": None,
+            "value": round(self.rng.uniform(1, 200), 2),
+            "currency_symbol": "€",
+            "currency_conversion_rate": 1.0,
+            "billed_at": date.today().isoformat(),
+            "deleted": False,
+            "creditor_shares": {str(creditor): 1.0},
+            "debitor_shares": {str(debitor): 1.0},
+            "tags": [],
+            "positions": [],
+        }
+
+    async def act(self, action: str):
+        group_url = f"/api/v1/groups/{self.group.group_id}"
+        if action == "list_transactions":
+            await self._request(action, "GET", f"{group_url}/transactions")
+        elif action == "poll_transactions":
+            # changes since the last poll, like a client catching up after a notification
+            params = {}
+            if self.last_poll is not None:
+                params["min_last_changed"] = self.last_poll.isoformat()
+            self.last_poll = datetime.now(timezone.utc)
+            await self._request(
+                action, "GET", f"{group_url}/transactions", params=params
+            )
+        elif action == "list_accounts":
+            await self._request(action, "GET", f"{group_url}/accounts")
+        elif action == "sync_transactions":
+            # either change one of our own transfers or create a new one
+            if self.own_transaction_ids and self.rng.random() < 0.5:
+                transaction_id = self.rng.choice(self.own_transaction_ids)
+            else:
+                transaction_id = -1
+            sent_at = time.perf_counter()
+            id_map = await self._request(
+                action,
+                "POST",
+                f"{group_url}/transactions/sync",
+                json=[self._transfer(transaction_id)],
+            )
+            if id_map is not None:
+                new_id = id_map[str(transaction_id)]
+                if transaction_id < 0:
+                    self.own_transaction_ids.append(new_id)
+                self.stats.edits.append((new_id, self.index, sent_at))
+
+    async def run(self, until: float):
+        actions = list(ACTIONS.keys())
+        weights = list(ACTIONS.values())
+        while True:
+            think = self.rng.expovariate(1 / self.think_time)
+            if time.perf_counter() + think >= until:
+                break
+            await asyncio.sleep(think)
+            await self.act(self.rng.choices(actions, weights)[0])
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def main(
+    config_path: str,
+    api_url: str,
+    n_users: int,
+    n_transactions: int,
+    duration: float,
+    think_time: float,
+    ramp_up: float,
+    output: Optional[str],
+):
+    print(f"Preparing a group with {n_users} users and {n_transactions} transactions")
+    group = await prepare_group(config_path, n_users, n_transactions)
+
+    stats = Stats()
+    users = [
+        SimulatedUser(i, username, group, api_url, think_time, stats)
+        for i, username in enumerate(group.usernames)
+    ]
+
+    listeners = []
+    try:
+        print(f"Logging in and subscribing {n_users} users")
+        for user in users:
+            await user.login()
+            subscribed = asyncio.Event()
+            listeners.append(asyncio.create_task(user.listen(subscribed)))
+            await asyncio.wait_for(subscribed.wait(), timeout=30)
+            if ramp_up > 0:
+                await asyncio.sleep(ramp_up / n_users)
+
+        print(f"Running the load test for {duration:.0f}s")
+        start = time.perf_counter()
+        await asyncio.gather(*(user.run(until=start + duration) for user in users))
+        elapsed = time.perf_counter() - start
+        # give the last notifications some time to arrive
+        await asyncio.sleep(1)
+    finally:
+        for listener in listeners:
+            listener.cancel()
+        for user in users:
+            await user.close()
+
+    endpoints = {
+        name: {
+            **summarize(latencies),
+            "errors": stats.errors.get(name, 0),
+            "requests_per_second": len(latencies) / elapsed,
+        }
+        for name, latencies in stats.latencies.items()
+        if name != "login"
+    }
+    n_requests = sum(len(v) for k, v in stats.latencies.items() if k != "login")
+    results = {
+        "users": n_users,
+        "duration_seconds": elapsed,
+        "think_time_seconds": think_time,
+        "requests": n_requests,
+        "requests_per_second": n_requests / elapsed,
+        "errors": sum(stats.errors.values()),
+        "endpoints": endpoints,
+        "notification_lag": summarize(stats.notification_lags()),
+    }
+
+    print(
+        f"\n{n_requests} requests in {elapsed:.1f}s, {n_requests / elapsed:.1f} requests/s, "
+        f"{results['errors']} errors"
+    )
+    print(
+        f"{'endpoint':<22}{'n':>7}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+    )
+    rows = list(endpoints.items()) + [("notification lag", results["notification_lag"])]
+    for name, row in rows:
+        if row["n"] == 0:
+            continue
+        print(
+            f"{name:<22}{row['n']:>7}{row.get('requests_per_second', 0):>8.1f}"
+            f"{row['p50_ms']:>9.1f}{row['p90_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+        )
+
+    if output is not None:
+        Path(output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-c",
+        "--config-path",
+        default="/etc/abrechnung/abrechnung.yaml",
+        help="config file of the api under test, used to prepare the load test group, default: %(default)s",
+    )
+    parser.add_argument(
+        "--api-url",
+        default="http://localhost:8080",
+        help="base url of the running api, default: %(default)s",
+    )
+    parser.add_argument(
+        "--users", type=int, default=20, help="number of simulated users"
+    )
+    parser.add_argument(
+        "--transactions",
+        type=int,
+        default=1000,
+        help="number of transactions the group starts with",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=60,
+        help="duration of the load test in seconds",
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=2.0,
+        help="mean time in seconds a user waits between two actions",
+    )
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=5.0,
+        help="time in seconds over which the users log in",
+    )
+    parser.add_argument(
+        "-o", "--output", help="file the results are additionally written to as json"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            config_path=args.config_path,
+            api_url=args.api_url.rstrip("/"),
+            n_users=args.users,
+            n_transactions=args.transactions,
+            duration=args.duration,
+            think_time=args.think_time,
+            ramp_up=args.ramp_up,
+            output=args.output,
+        )
+    )